@@ -0,0 +1,205 @@
+"""Benchmarks of the pure-Python hot paths of preparemd.
+
+Synthetic systems are generated at increasing sizes, so AmberTools is not needed.
+
+    python benchmarks/bench_hotpaths.py --save            # store a baseline
+    python benchmarks/bench_hotpaths.py --threshold 0.2   # compare with it
+"""
+
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+
+ROOTDIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOTDIR)
+sys.path.insert(0, os.path.join(ROOTDIR, "benchmarks"))
+
+from synthetic import make_system  # noqa: E402
+
+import prepare_aMD  # noqa: E402
+from preparemd.amber.md import mdout, prepareinputs, writetrajfix  # noqa: E402
+from preparemd.amber.top import leapin  # noqa: E402
+from preparemd.utils.log import log_setup  # noqa: E402
+
+DEFAULT_SIZES = [1000, 10000, 100000, 1000000]
+DEFAULT_BASELINE = os.path.join(ROOTDIR, "benchmarks", "baseline.json")
+# これより短い時間の差は測定誤差として扱う
+MIN_DIFF = 0.005
+
+
+def make_cases(system: dict, distdir: str) -> dict:
+    """(setup, func) of each benchmark case. setup is not timed."""
+    pristine = system["pre2"] + ".orig"
+    shutil.copy2(system["pre2"], pristine)
+
+    def restore_pre2():
+        shutil.copy2(pristine, system["pre2"])
+
+    def nothing():
+        pass
+
+    # 合成したamber/pr/001/md.outを消さないよう、別のディレクトリに書き出す
+    colddir = os.path.join(distdir, "cold")
+    warmdir = os.path.join(distdir, "warm")
+
+    def remove_colddir():
+        shutil.rmtree(colddir, ignore_errors=True)
+
+    def fill_warmdir():
+        # 2回目以降はmanifestにより内容が同じファイルを書き直さない
+        if not os.path.isdir(warmdir):
+            prepare_amberfiles(warmdir)
+
+    def prepare_amberfiles(outdir: str):
+        prepareinputs.prepareamberfiles(
+            outdir, system["protein_residues"], 3, 50, "foodin"
+        )
+
+    return {
+        "_get_residues_from_pdb": (
+            nothing,
+            lambda: prepareinputs._get_residues_from_pdb(system["pre"]),
+        ),
+        "preparepre2file": (
+            nothing,
+            lambda: prepareinputs.preparepre2file(
+                distdir, sslink_file=system["sslink"]
+            ),
+        ),
+        "cys_to_cyx_in_pre2file": (
+            restore_pre2,
+            lambda: prepareinputs.cys_to_cyx_in_pre2file(distdir, system["sslink"]),
+        ),
+        "get_boxsize_from_pre2": (
+            restore_pre2,
+            lambda: prepareinputs.get_boxsize_from_pre2(system["pre2"]),
+        ),
+        "leapin.leapininput": (
+            nothing,
+            lambda: leapin.leapininput(
+                "", system["boxsize"], 150, system["sslink"], "ff19SB", None, None, None
+            ),
+        ),
+        # 毎回新しいamberディレクトリに書き出す場合と、manifestで書き込みを省く場合
+        "prepareamberfiles (cold)": (
+            remove_colddir,
+            lambda: prepare_amberfiles(colddir),
+        ),
+        "prepareamberfiles (manifest hit)": (
+            fill_warmdir,
+            lambda: prepare_amberfiles(warmdir),
+        ),
+        "writetrajfix": (
+            nothing,
+            lambda: writetrajfix.writetrajfix(distdir, system["protein_residues"], 3),
+        ),
+        "mdout.read_mdout": (
+            nothing,
+            lambda: mdout.read_mdout(system["mdout"]),
+        ),
+        "prepare_aMD._get_res_atom_number": (
+            nothing,
+            lambda: prepare_aMD._get_res_atom_number(system["leap"]),
+        ),
+    }
+
+
+def run_benchmarks(sizes: list[int], repeat: int, workdir: str) -> dict:
+    """Return the best time (s) of `repeat` runs of each case at each size."""
+    results = {}
+    for natoms in sizes:
+        distdir = os.path.join(workdir, f"sys{natoms}")
+        system = make_system(natoms, distdir)
+        results[str(natoms)] = {}
+        for name, (setup, func) in make_cases(system, distdir).items():
+            times = []
+            for _ in range(repeat):
+                setup()
+                start = time.perf_counter()
+                func()
+                times.append(time.perf_counter() - start)
+            results[str(natoms)][name] = min(times)
+            print(f"{natoms:>9d} atoms  {name:<36s} {min(times):10.4f} s")
+    return results
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list[str]:
+    """Cases that are slower than the baseline by more than threshold (ratio)."""
+    regressions = []
+    for size, cases in results.items():
+        for name, elapsed in cases.items():
+            base = baseline.get(size, {}).get(name)
+            if base is None:
+                continue
+            if elapsed - base > MIN_DIFF and elapsed > base * (1.0 + threshold):
+                regressions.append(
+                    f"{size} atoms {name}: {base:.4f} s -> {elapsed:.4f} s "
+                    f"(+{(elapsed / base - 1.0) * 100:.0f}%)"
+                )
+    return regressions
+
+
+def main():
+    parser = ArgumentParser(description="Benchmark pure-Python hot paths of preparemd.")
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=DEFAULT_SIZES,
+        help="Numbers of atoms of the synthetic systems.",
+    )
+    parser.add_argument("--repeat", type=int, default=3, help="Runs of each case.")
+    parser.add_argument(
+        "--baseline", default=DEFAULT_BASELINE, help="Baseline result file (JSON)."
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.2,
+        help="Report cases slower than the baseline by this ratio. Default: 0.2.",
+    )
+    parser.add_argument(
+        "--save", action="store_true", help="Store the results as the baseline."
+    )
+    parser.add_argument(
+        "--workdir", default=None, help="Directory for synthetic systems."
+    )
+    args = parser.parse_args()
+    log_setup(level="WARNING")
+
+    if args.workdir is None:
+        with tempfile.TemporaryDirectory() as workdir:
+            results = run_benchmarks(args.sizes, args.repeat, workdir)
+    else:
+        results = run_benchmarks(args.sizes, args.repeat, args.workdir)
+
+    if args.save:
+        with open(args.baseline, "w") as f:
+            json.dump(
+                {"machine": platform.node(), "python": sys.version, "results": results},
+                f,
+                indent=2,
+            )
+        print(f"Baseline was saved to {args.baseline}.")
+        return
+
+    if not os.path.isfile(args.baseline):
+        print(f"No baseline was found at {args.baseline}. Run with --save first.")
+        return
+    with open(args.baseline) as f:
+        baseline = json.load(f)["results"]
+    regressions = compare(results, baseline, args.threshold)
+    for line in regressions:
+        print(f"REGRESSION {line}")
+    if regressions:
+        raise SystemExit(1)
+    print("No regressions.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+import os
+
+import numpy as np
+
+# 残基テンプレート。(原子名, 元素, 残基内の相対座標)
+RESIDUES = {
+    "ALA": [
+        ("N", "N", (0.0, 0.0, 0.0)),
+        ("CA", "C", (1.46, 0.0, 0.0)),
+        ("C", "C", (2.0, 1.42, 0.0)),
+        ("O", "O", (1.25, 2.4, 0.0)),
+        ("CB", "C", (2.0, -0.8, 1.2)),
+    ],
+    "CYS": [
+        ("N", "N", (0.0, 0.0, 0.0)),
+        ("CA", "C", (1.46, 0.0, 0.0)),
+        ("C", "C", (2.0, 1.42, 0.0)),
+        ("O", "O", (1.25, 2.4, 0.0)),
+        ("CB", "C", (2.0, -0.8, 1.2)),
+        ("SG", "S", (3.7, -0.9, 1.3)),
+    ],
+}
+WATER = [
+    ("O", "O", (0.0, 0.0, 0.0)),
+    ("H1", "H", (0.96, 0.0, 0.0)),
+    ("H2", "H", (-0.24, 0.93, 0.0)),
+]
+RISE = 3.8  # 残基ごとの間隔(Å)
+CYS_INTERVAL = 20  # この間隔でCYS残基を置く
+
+
+def _atomline(serial, name, resname, resnum, xyz, element, record="ATOM  "):
+    name = f" {name:<3}" if len(name) < 4 else name
+    return (
+        f"{record}{serial % 100000:5d} {name} {resname:>3} A{resnum % 10000:4d}    "
+        f"{xyz[0]:8.3f}{xyz[1]:8.3f}{xyz[2]:8.3f}  1.00  0.00          {element:>2}\n"
+    )
+
+
+def make_system(
+    natoms: int, outdir: str, solvent_fraction: float = 0.8, seed: int = 0
+) -> dict:
+    """Write a synthetic protein/solvent system with about natoms atoms.
+
+    The protein is a chain of ALA residues with a CYS residue every
+    CYS_INTERVAL residues, folded on a grid so that the box stays compact.
+    The rest of the atoms are WAT molecules placed on a lattice around it.
+
+    Files written to outdir:
+        top/pre.pdb, top/pre2.pdb: protein only (pre2.pdb has a CRYST1 record).
+        top/pre_sslink: pairs of CYS residues.
+        top/leap.pdb: protein and solvent.
+        amber/pr/001/md.out: a production mdout with natoms // 10 energy records.
+    Returns:
+        dict: number of atoms and residues and the paths of the files.
+    """
+    rng = np.random.default_rng(seed)
+    topdir = os.path.join(outdir, "top")
+    os.makedirs(topdir, exist_ok=True)
+
+    nprotein = max(int(natoms * (1.0 - solvent_fraction)), 50)
+    protein, cysresnums = [], []
+    serial, resnum = 1, 0
+    side = max(int(np.ceil(np.sqrt(nprotein / 5.0 / 10.0))), 1)
+    while serial <= nprotein:
+        resnum += 1
+        resname = "CYS" if resnum % CYS_INTERVAL == 0 else "ALA"
+        if resname == "CYS":
+            cysresnums.append(resnum)
+        i = resnum - 1
+        origin = np.array(
+            [(i % 10) * RISE, (i // 10 % side) * 8.0, (i // 10 // side) * 8.0]
+        )
+        for name, element, offset in RESIDUES[resname]:
+            xyz = origin + offset + rng.normal(0.0, 0.05, 3)
+            protein.append(_atomline(serial, name, resname, resnum, xyz, element))
+            serial += 1
+    protein.append("TER\n")
+    nres = resnum
+    nprotein = serial - 1
+
+    lower = np.array([-10.0, -10.0, -10.0])
+    upper = np.array([10 * RISE, side * 8.0, (nres // 10 // side + 1) * 8.0]) + 10.0
+    box = upper - lower
+    cryst1 = (
+        f"CRYST1{box[0]:9.3f}{box[1]:9.3f}{box[2]:9.3f}"
+        "  90.00  90.00  90.00 P 1           1\n"
+    )
+    files = {
+        "pre": os.path.join(topdir, "pre.pdb"),
+        "pre2": os.path.join(topdir, "pre2.pdb"),
+        "sslink": os.path.join(topdir, "pre_sslink"),
+        "leap": os.path.join(topdir, "leap.pdb"),
+    }
+    with open(files["pre"], "w") as f:
+        f.writelines(protein)
+        f.write("END\n")
+    with open(files["pre2"], "w") as f:
+        f.write(cryst1)
+        f.writelines(protein)
+        f.write("END\n")
+    with open(files["sslink"], "w") as f:
+        for a, b in zip(cysresnums[0::2], cysresnums[1::2], strict=False):
+            f.write(f"{a:>5d} {b:>5d}\n")
+
+    # 溶媒は格子上に並べ、メモリに溜めずにそのまま書き出す
+    nwater = max((natoms - serial + 1) // 3, 0)
+    with open(files["leap"], "w") as f:
+        f.write(cryst1)
+        f.writelines(protein)
+        if nwater > 0:
+            spacing = (np.prod(box) / nwater) ** (1.0 / 3.0)
+            counts = np.ceil(box / spacing).astype(int)
+            for k in range(nwater):
+                index = np.array(
+                    [
+                        k % counts[0],
+                        k // counts[0] % counts[1],
+                        k // counts[0] // counts[1],
+                    ]
+                )
+                origin = lower + spacing * index
+                resnum += 1
+                for name, element, offset in WATER:
+                    xyz = origin + offset
+                    f.write(_atomline(serial, name, "WAT", resnum, xyz, element))
+                    serial += 1
+                f.write("TER\n")
+        f.write("END\n")
+
+    files["mdout"] = os.path.join(outdir, "amber", "pr", "001", "md.out")
+    make_mdout(max(natoms // 10, 1), files["mdout"], rng)
+
+    return {
+        "natoms": serial - 1,
+        "protein_atoms": nprotein,
+        "protein_residues": nres,
+        "boxsize": f"{box[0]:.3f} {box[1]:.3f} {box[2]:.3f}",
+        **files,
+    }
+
+
+MDOUT_RECORD = """\
+ NSTEP = {nstep:8d}   TIME(PS) = {time:11.3f}  TEMP(K) = {temp:8.2f}  PRESS = {press:8.1f}
+ Etot   = {etot:14.4f}  EKtot   = {ektot:14.4f}  EPtot      = {eptot:14.4f}
+ BOND   = {bond:14.4f}  ANGLE   = {angle:14.4f}  DIHED      = {dihed:14.4f}
+ 1-4 NB =       111.1111  1-4 EEL =      2222.2222  VDWAALS    =     33333.3333
+ EELEC  =   -444444.4444  EHBOND  =         0.0000  RESTRAINT  =         0.0000
+ EKCMT  =      5555.5555  VIRIAL  =      6666.6666  VOLUME     =    777777.7777
+                                                    Density    =         1.0123
+ Ewald error estimate:   0.1234E-03
+ ------------------------------------------------------------------------------
+
+"""
+
+
+def make_mdout(nrecords: int, path: str, rng: np.random.Generator) -> None:
+    """Write a pmemd-like mdout file with nrecords energy records."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    values = rng.normal(0.0, 1.0, (nrecords, 6))
+    with open(path, "w") as f:
+        f.write("   4.  RESULTS\n\n")
+        for i in range(nrecords):
+            v = values[i]
+            f.write(
+                MDOUT_RECORD.format(
+                    nstep=(i + 1) * 5000,
+                    time=(i + 1) * 10.0,
+                    temp=300.0 + v[0],
+                    press=v[1] * 100.0,
+                    etot=-123456.0 + v[2] * 100.0,
+                    ektot=23456.0 + v[3] * 50.0,
+                    eptot=-146912.0 + v[4] * 100.0,
+                    bond=1234.0,
+                    angle=3456.0,
+                    dihed=4567.0 + v[5] * 10.0,
+                )
+            )
+        f.write(f"      A V E R A G E S   O V E R {nrecords:8d} S T E P S\n\n")
+        f.write(
+            MDOUT_RECORD.format(
+                nstep=nrecords * 5000,
+                time=nrecords * 10.0,
+                temp=300.0,
+                press=0.0,
+                etot=-123456.0,
+                ektot=23456.0,
+                eptot=-146912.0,
+                bond=1234.0,
+                angle=3456.0,
+                dihed=4567.0,
+            )
+        )
@@ -1,58 +1,116 @@
 #!/usr/bin/env python3
 # %%
+import functools
+import glob
 import os
 import re
-import subprocess
+from concurrent.futures import ProcessPoolExecutor
 
+import numpy as np
 from absl import app, flags, logging
 from gemmi import read_structure
 
+from preparemd.amber.md import mdout, namelist, production, timestep
+from preparemd.amber.top import prmtop
+
+# 残基数に含めない残基
+SOLVENT_RESIDUES = ["Na+", "Cl-", "WAT"]
 
-def getvalue(mdout, energyterm):
-    """
-    md.outのファイルから値を取り出す。
-    """
-    AVEline = int(
-        subprocess.check_output(
-            f"sed -n '/A V E R A G E S   O V E R/=' {mdout}", shell=True
-        )
-    )
-    AVEline = str(AVEline)
-    value = float(
-        subprocess.check_output(
-            "tail -n +"
-            + AVEline
-            + " "
-            + mdout
-            + " | head -n 10 | grep '"
-            + energyterm
-            + "' | awk '{print $9'}",
-            shell=True,
-        )
-    )
-    return value
+
+def _is_prmtop(path) -> bool:
+    with open(path, "rb") as f:
+        return f.read(8).startswith((b"%VERSION", b"%FLAG"))
 
 
 def _get_res_atom_number(pdbfile) -> tuple[int, int]:
     """
-    compute the number of residues and atoms in a PDB file.
+    compute the number of residues and atoms in a topology (prmtop) or PDB file.
+    prmtopの場合はPOINTERSとRESIDUE_LABELのセクションだけを読む。
     Args:
-        pdbfile (str): Path to the PDB file.
+        pdbfile (str): Path to the prmtop or PDB file.
     Returns:
         tuple: A tuple containing the number of residues and atoms.
     """
+    if _is_prmtop(pdbfile):
+        parm = prmtop.Prmtop(pdbfile)
+        solvent = np.isin(parm.residue_labels, SOLVENT_RESIDUES)
+        return int(np.count_nonzero(~solvent)), parm.natom
     structure = read_structure(pdbfile)
     residuenum = 0
     atomnum = 0
     for model in structure:
         for chain in model:
             for residue in chain:
-                if residue.name not in ["Na+", "Cl-", "WAT"]:
+                if residue.name not in SOLVENT_RESIDUES:
                     residuenum += 1
                 atomnum += len(residue)
     return residuenum, atomnum
 
 
+@functools.cache
+def _cached_res_atom_number(pdbfile, mtime_ns: int, size: int) -> tuple[int, int]:
+    return _get_res_atom_number(pdbfile)
+
+
+def get_res_atom_number(pdbfile) -> tuple[int, int]:
+    """`_get_res_atom_number` computed once per topology file.
+
+    The result is reused while the file is not modified, so that many
+    production directories sharing one leap.parm7 only read it once.
+    """
+    stat = os.stat(pdbfile)
+    return _cached_res_atom_number(
+        os.path.realpath(pdbfile), stat.st_mtime_ns, stat.st_size
+    )
+
+
+def read_energies(mdout_path) -> tuple[float, float]:
+    """EPtot and DIHED of the "A V E R A G E S" block of an mdout file."""
+    result = mdout.read_mdout(mdout_path)
+    if not result.averages:
+        raise ValueError(
+            f"No averages were found in {mdout_path}. Is the run finished?"
+        )
+    return result.averages["EPtot"], result.averages["DIHED"]
+
+
+def amd_parameters(
+    eptot: float, dihed: float, residuenum: int, atomnum: int
+) -> tuple[float, float, float, float]:
+    """ethreshp, alphap, ethreshd and alphad of iamd=3."""
+    ethreshp = float(0.2 * atomnum + eptot)
+    alphap = float(0.2 * atomnum)
+    ethreshd = float(4.0 * residuenum + dihed)
+    alphad = float(4.0 * residuenum * 0.2)
+    return ethreshp, alphap, ethreshd, alphad
+
+
+def find_topdir(basedir: str, indir: str, pdbfile: str) -> str:
+    """The nearest "top" directory with pdbfile above basedir/indir.
+
+    Returns:
+        The path relative to basedir.
+    """
+    start = os.path.abspath(os.path.join(basedir, indir))
+    path = start
+    while True:
+        if os.path.isfile(os.path.join(path, "top", pdbfile)):
+            return os.path.relpath(os.path.join(path, "top"), basedir)
+        parent = os.path.dirname(path)
+        if parent == path:
+            raise ValueError(f"Could not find top/{pdbfile} above {start}")
+        path = parent
+
+
+def production_dt(basedir: str, indir: str) -> float:
+    """dt of the production run in indir (0.004 with --hmr), read from md.in."""
+    mdin_path = os.path.join(basedir, indir, "md.in")
+    if not os.path.isfile(mdin_path):
+        return timestep.DEFAULT_DT
+    cntrl = namelist.read_mdin(mdin_path).cntrl
+    return cntrl["dt"] if "dt" in cntrl else timestep.DEFAULT_DT
+
+
 def make_amdin(
     ethreshp: float,
     alphap: float,
@@ -62,55 +120,37 @@ def make_amdin(
     basedir: str,
     outdir: str,
     amdinputfile: str,
+    overrides: dict | None = None,
+    dt: float = timestep.DEFAULT_DT,
 ) -> None:
     """
     amd.inをoutput
-    amd.inのテンプレート
+    production runのmd.inをもとに、iamd=3と閾値・alphaの値を加える
+    dtが0.002でない場合(HMR)はステップ数を同じ時間になるよう変える
     """
-    amdincontent = f"""vt-continue
-&cntrl
-  imin=0,               ! Molecular dynamics
-!  irest=0,              ! DO NOT restart MD simulation from a previous run.
-!  ntx=1,                ! Coordinates and velocities will not be read
-  irest=1,              ! Restart MD simulation from a previous run.
-  ntx=5,                ! Coordinates and velocities will be read from a previous run.
-  nstlim=10000000,      ! Number of MD steps
-  dt=0.002,             ! Timestep (ps)
-  ntc=2,                ! SHAKE on for bonds involving hydrogen atoms
-  ntf=2,                ! No force evaluation for bonds with hydrogen
-  ig=-1,                ! Random seed for Langevin thermostat
-  cut=10.0,             ! Nonbonded cutoff (Angstroms)
-  tol=0.000001          ! SHAKE tolerance
-  ntb=2,                ! Constant pressure periodic boundary conditions
-  ntp=1,                ! Isotropic pressure coupling
-  ntpr=5000,            ! Print to mdout every ntpr steps
-  ntwr=500000,          ! Every ntwr steps during dynamics, the "restrt" file will be written
-  ntwx=5000,            ! Write to trajectory file every ntwc steps
-  ntt=3,                ! Langevin thermostat
-  gamma_ln=2.0,         ! Collision frequency for thermostat
-  temp0=300.0,          ! Simulation temperature (K)
-  ioutfm=1,             ! Write binary NetCDF trajectory
-  iwrap=1,              ! the coordinates written to the restart and trajectory files will be "wrapped" into a primary box.
-  iamd=3,               ! boost the whole potential with an extra boost to the torsions
-  nmropt={nmropt},             ! turn on NMR restraints
-  ethreshp={ethreshp:.2f}, alphap={alphap:.2f},
-  ethreshd={ethreshd:.2f}, alphad={alphad:.2f},
-  /
-  &ewald
-  dsum_tol=0.000001,
-  /
-  &wt
-   type='DUMPFREQ', istep1=5000,
-  /
-  &wt type='END' /
- DISANG=dist1.rst
- DUMPAVE=dist1.dat
-"""
+    mdin = production.set_restart(production.productionmdin(20))
+    timestep.set_timestep(mdin, dt)
+    cntrl = mdin.cntrl
+    cntrl.set(
+        "iamd",
+        3,
+        "boost the whole potential with an extra boost to the torsions",
+        before="nmropt",
+    )
+    cntrl.set("nmropt", nmropt)
+    cntrl.set("ethreshp", round(ethreshp, 2))
+    cntrl.set("alphap", round(alphap, 2))
+    cntrl.set("ethreshd", round(ethreshd, 2))
+    cntrl.set("alphad", round(alphad, 2))
+    mdin.namelists.insert(
+        1, namelist.Namelist("ewald", [namelist.Entry("dsum_tol", 0.000001)])
+    )
+    mdin.apply(overrides, "amd")
 
     os.makedirs(os.path.join(basedir, outdir), exist_ok=True)
     amd_in_path = os.path.join(basedir, outdir, amdinputfile)
     with open(amd_in_path, "w") as f:
-        f.write(amdincontent)
+        f.write(mdin.render())
 
 
 # %%
@@ -152,6 +192,7 @@ def write_amdinputfile(
     pdbfile: str,
     rstfile: str,
     nmropt: int,
+    overrides: dict | None = None,
 ):
     """
     amd.inファイルを出力する
@@ -161,30 +202,130 @@ def write_amdinputfile(
     if not os.path.exists(mdout_path):
         logging.error("Could not find mdout file, %s", mdout_path)
         raise ValueError(f"Could not find mdout file, {mdout_path}")
-    eptot = getvalue(mdout_path, "EPtot")
-    dihed = getvalue(mdout_path, "DIHED")
+    eptot, dihed = read_energies(mdout_path)
 
     pdbfile_path = os.path.join(basedir, topdir, pdbfile)
     if not os.path.exists(pdbfile_path):
         logging.error(f"Could not find {pdbfile_path} file")
         raise ValueError(f"Could not find {pdbfile_path} file")
-    residuenum, atomnum = _get_res_atom_number(pdbfile_path)
+    residuenum, atomnum = get_res_atom_number(pdbfile_path)
 
-    ethreshp = float(0.2 * atomnum + eptot)
-    alphap = float(0.2 * atomnum)
-    ethreshd = float(4.0 * residuenum + dihed)
-    alphad = float(4.0 * residuenum * 0.2)
+    ethreshp, alphap, ethreshd, alphad = amd_parameters(
+        eptot, dihed, residuenum, atomnum
+    )
 
     make_amdin(
-        ethreshp, alphap, ethreshd, alphad, nmropt, basedir, outdir, amdinputfile
+        ethreshp,
+        alphap,
+        ethreshd,
+        alphad,
+        nmropt,
+        basedir,
+        outdir,
+        amdinputfile,
+        overrides=overrides,
+        dt=production_dt(basedir, indir),
     )
     make_runsh(basedir, indir, prerunfile, outdir, rstfile, amdrunfile)
 
 
+def write_amdinputfiles(
+    basedir: str,
+    patterns: list[str],
+    outdir: str,
+    mdoutfile: str,
+    amdinputfile: str,
+    prerunfile: str,
+    amdrunfile: str,
+    topdir: str | None,
+    pdbfile: str,
+    rstfile: str,
+    nmropt: int,
+    overrides: dict | None = None,
+    workers: int = 1,
+) -> list[tuple[str, str]]:
+    """Write amd.in and run.sh for all directories matching the glob patterns.
+
+    The mdout files are parsed in parallel with a process pool. The numbers of
+    atoms and residues are computed once per topology, and all files are
+    written after the thresholds of every directory have been computed.
+
+    Args:
+        patterns: basedirからの相対パスのglobパターン。例: "rep*/pr/005"。
+        outdir: 出力先。"{parent}"と"{name}"は入力ディレクトリの親ディレクトリと
+                名前に置き換えられる。例: "{parent}/../amd/{name}"。
+        topdir: Noneの場合、各入力ディレクトリから上にたどって最初に見つかる
+                top/pdbfileを使う。
+
+    Returns:
+        list: (indir, outdir) pairs relative to basedir.
+    """
+    if workers < 1:
+        raise ValueError("The workers argument must be 1 or more.")
+    indirs = sorted(
+        {
+            os.path.relpath(path, basedir)
+            for pattern in patterns
+            for path in glob.glob(os.path.join(basedir, pattern))
+            if os.path.isfile(os.path.join(path, mdoutfile))
+        }
+    )
+    if not indirs:
+        raise ValueError(f"No directory with {mdoutfile} matches {patterns}.")
+
+    topfiles = {}
+    for indir in indirs:
+        top = topdir if topdir is not None else find_topdir(basedir, indir, pdbfile)
+        topfiles[indir] = os.path.join(basedir, top, pdbfile)
+    counts = {path: get_res_atom_number(path) for path in set(topfiles.values())}
+
+    mdouts = [os.path.join(basedir, indir, mdoutfile) for indir in indirs]
+    if workers == 1 or len(indirs) == 1:
+        energies = [read_energies(path) for path in mdouts]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            energies = list(executor.map(read_energies, mdouts))
+
+    pairs = []
+    for indir, (eptot, dihed) in zip(indirs, energies, strict=True):
+        parent, name = os.path.split(indir)
+        out = os.path.normpath(outdir.format(parent=parent or ".", name=name))
+        residuenum, atomnum = counts[topfiles[indir]]
+        make_amdin(
+            *amd_parameters(eptot, dihed, residuenum, atomnum),
+            nmropt,
+            basedir,
+            out,
+            amdinputfile,
+            overrides=overrides,
+            dt=production_dt(basedir, indir),
+        )
+        make_runsh(basedir, indir, prerunfile, out, rstfile, amdrunfile)
+        logging.info("%s -> %s", indir, out)
+        pairs.append((indir, out))
+    return pairs
+
+
 # %%
 flags.DEFINE_string("indir", None, "Path to input directory file.")
 flags.DEFINE_string(
-    "outdir", None, "Path to a directory that will store amd input files."
+    "outdir",
+    None,
+    "Path to a directory that will store amd input files. With --indirs, "
+    "'{parent}' and '{name}' are replaced with the parent and the name of each "
+    "input directory. Default with --indirs: '{parent}/../amd/{name}'.",
+)
+flags.DEFINE_multi_string(
+    "indirs",
+    [],
+    "Glob patterns of input directories relative to 'basedir', e.g. 'pr/005' or "
+    "'rep*/pr/005'. All matching directories with an mdout file are processed "
+    "at once. Can be specified more than once.",
+)
+flags.DEFINE_integer(
+    "workers",
+    os.cpu_count() or 1,
+    "Number of processes that read mdout files with --indirs.",
 )
 flags.DEFINE_string(
     "basedir",
@@ -194,7 +335,9 @@ flags.DEFINE_string(
 flags.DEFINE_string(
     "topdir",
     "../../top",
-    "The directory containing 'leap.parm7' and 'leap.pdb' files. Default is '../../top'.",
+    "The directory containing 'leap.parm7' and 'leap.pdb' files. Default is '../../top'. "
+    "With --indirs, the nearest 'top' directory above each input directory is "
+    "used unless this is given.",
 )
 flags.DEFINE_string(
     "mdoutfile",
@@ -208,8 +351,9 @@ flags.DEFINE_string(
 )
 flags.DEFINE_string(
     "pdbfile",
-    "leap.pdb",
-    "The name of leap PDB file in the 'topdir'. (Default is 'leap.pdb')",
+    "leap.parm7",
+    "The name of the topology file (or leap PDB file) in the 'topdir', used to "
+    "count the residues and atoms. (Default is 'leap.parm7')",
 )
 flags.DEFINE_string(
     "amdinputfile", "amd.in", "amd input file that will be created in 'outdir'. "
@@ -227,6 +371,17 @@ flags.DEFINE_integer(
     0,
     "Use NMR restraints or not. Deafult is '0'",
 )
+flags.DEFINE_multi_string(
+    "mdin",
+    [],
+    "Override a value of amd.in, e.g. 'cntrl.ntwx=10000' or 'ewald.dsum_tol=1e-5'. "
+    "Can be specified more than once.",
+)
+flags.DEFINE_string(
+    "mdin_config",
+    None,
+    "TOML file with values of amd.in to override, e.g. '[cntrl]' 'cut = 9.0'.",
+)
 
 
 FLAGS = flags.FLAGS
@@ -235,6 +390,30 @@ FLAGS = flags.FLAGS
 def main(argv):
     if len(argv) > 1:
         raise app.UsageError("Too many command-line arguments.")
+    overrides = namelist.merge_overrides(
+        namelist.load_overrides(FLAGS.mdin_config) if FLAGS.mdin_config else None,
+        namelist.parse_overrides(FLAGS.mdin),
+    )
+    if FLAGS.indirs:
+        # 複数のディレクトリのamd.inをまとめて作る
+        write_amdinputfiles(
+            FLAGS.basedir,
+            FLAGS.indirs,
+            FLAGS.outdir or "{parent}/../amd/{name}",
+            FLAGS.mdoutfile,
+            FLAGS.amdinputfile,
+            FLAGS.prerunfile,
+            FLAGS.amdrunfile,
+            FLAGS.topdir if FLAGS["topdir"].present else None,
+            FLAGS.pdbfile,
+            FLAGS.rstfile,
+            FLAGS.nmropt,
+            overrides=overrides,
+            workers=FLAGS.workers,
+        )
+        return
+    if FLAGS.indir is None or FLAGS.outdir is None:
+        raise app.UsageError("--indir and --outdir, or --indirs are required.")
     # main process: amd.inファイルを作り出す
     write_amdinputfile(
         FLAGS.basedir,
@@ -248,15 +427,9 @@ def main(argv):
         FLAGS.pdbfile,
         FLAGS.rstfile,
         FLAGS.nmropt,
+        overrides=overrides,
     )
 
 
 if __name__ == "__main__":
-    flags.mark_flags_as_required(
-        [
-            "indir",
-            "outdir",
-        ]
-    )
-
     app.run(main)
@@ -0,0 +1,138 @@
+import textwrap
+
+from preparemd.amber.md import production
+from preparemd.utils import header
+
+TASK_FILE = "tasks.txt"
+DONE_FILE = "dispatch.done"
+
+
+def tasklist(box: int, replicas: int = 0) -> str:
+    """Content of amber/tasks.txt.
+
+    Each line is "<directory> [<directory that must finish first>]", relative to
+    the amber directory. Production segments are listed segment by segment, so
+    that the replicas advance evenly.
+    """
+    lines = ["minimize", "heat minimize"]
+    if replicas > 0:
+        prdirs = [f"{name}/pr" for name in production.replica_names(replicas)]
+    else:
+        prdirs = ["pr"]
+    for i in range(1, box + 1):
+        for prdir in prdirs:
+            dep = "heat" if i == 1 else f"{prdir}/{str(i - 1).zfill(3)}"
+            lines.append(f"{prdir}/{str(i).zfill(3)} {dep}")
+    return "\n".join(lines) + "\n"
+
+
+def dispatchscript(machineenv: str, gpus: int, walltime: str = "") -> str:
+    """Content of amber/gpu_dispatch.sh.
+
+    1ノードのGPUをすべて確保し、各GPUでrun.shを1つずつ実行する。GPUが空くと、
+    依存するタスクが終わっている次のタスクを開始する。終わったタスクには
+    dispatch.doneを作るので、再投入すると続きから実行される。
+    CUDA_VISIBLE_DEVICESが設定されている場合は、その中のGPUだけを使う。
+    複数の系のtasks.txtを引数に渡せば、それらをまとめて1ノードに詰め込める。
+    """
+    content = header.queue_header(machineenv, walltime=walltime, gpus=gpus)
+    content += textwrap.dedent(
+        """\
+        # 使い方: ./gpu_dispatch.sh [path/to/amber/tasks.txt ...]
+        # 引数がなければこのスクリプトと同じディレクトリのtasks.txtを使う
+        NGPUS=${{NGPUS:-{gpus}}}
+        POLL=${{POLL:-10}}
+        if [ $# -eq 0 ]; then
+            set -- "$(dirname "$0")/{taskfile}"
+        fi
+        # スケジューラがCUDA_VISIBLE_DEVICESを設定していれば(例: 4,5,6,7)、
+        # g番目のタスクにはそのg番目のGPUを使う。他のジョブのGPUは使わない
+        devices=()
+        if [ -n "${{CUDA_VISIBLE_DEVICES+x}}" ]; then
+            IFS=, read -r -a devices <<< "${{CUDA_VISIBLE_DEVICES}}"
+            if [ "${{#devices[@]}}" -lt "${{NGPUS}}" ]; then
+                echo "Only ${{#devices[@]}} GPUs are visible (${{CUDA_VISIBLE_DEVICES}})."
+                NGPUS=${{#devices[@]}}
+            fi
+        fi
+
+        dirs=()
+        deps=()
+        for f in "$@"; do
+            base=$(cd "$(dirname "$f")" && pwd)
+            while read -r dir dep; do
+                [ -z "${{dir}}" ] && continue
+                dirs+=("${{base}}/${{dir}}")
+                deps+=("${{dep:+${{base}}/${{dep}}}}")
+            done < "$f"
+        done
+
+        state=()
+        for i in "${{!dirs[@]}}"; do
+            if [ -f "${{dirs[$i]}}/{done}" ]; then
+                state[$i]=done
+            else
+                state[$i]=pending
+            fi
+        done
+        pids=()
+        tasks=()
+        for ((g = 0; g < NGPUS; g++)); do
+            pids[$g]=""
+        done
+
+        while :; do
+            # 終了したタスクを回収する
+            for ((g = 0; g < NGPUS; g++)); do
+                pid=${{pids[$g]}}
+                if [ -n "${{pid}}" ] && ! kill -0 "${{pid}}" 2>/dev/null; then
+                    i=${{tasks[$g]}}
+                    if wait "${{pid}}"; then
+                        state[$i]=done
+                        touch "${{dirs[$i]}}/{done}"
+                        echo "GPU ${{g}} finished: ${{dirs[$i]}}"
+                    else
+                        state[$i]=failed
+                        echo "GPU ${{g}} failed: ${{dirs[$i]}}"
+                    fi
+                    pids[$g]=""
+                fi
+            done
+            # 空いたGPUに実行可能なタスクを割り当てる
+            for ((g = 0; g < NGPUS; g++)); do
+                [ -n "${{pids[$g]}}" ] && continue
+                for i in "${{!dirs[@]}}"; do
+                    [ "${{state[$i]}}" = pending ] || continue
+                    dep=${{deps[$i]}}
+                    [ -z "${{dep}}" ] || [ -f "${{dep}}/{done}" ] || continue
+                    (
+                        cd "${{dirs[$i]}}" &&
+                            CUDA_VISIBLE_DEVICES=${{devices[$g]:-${{g}}}} \\
+                                exec bash run.sh > dispatch.log 2>&1
+                    ) &
+                    pids[$g]=$!
+                    tasks[$g]=$i
+                    state[$i]=running
+                    echo "GPU ${{g}} started: ${{dirs[$i]}}"
+                    break
+                done
+            done
+            running=0
+            for pid in "${{pids[@]}}"; do
+                [ -n "${{pid}}" ] && running=1
+            done
+            [ ${{running}} -eq 0 ] && break
+            sleep "${{POLL}}"
+        done
+
+        status=0
+        for i in "${{!dirs[@]}}"; do
+            if [ "${{state[$i]}}" != done ]; then
+                echo "not finished (${{state[$i]}}): ${{dirs[$i]}}"
+                status=1
+            fi
+        done
+        exit ${{status}}
+        """
+    ).format(gpus=gpus, taskfile=TASK_FILE, done=DONE_FILE)
+    return content
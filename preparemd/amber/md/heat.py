@@ -1,59 +1,116 @@
 import textwrap
 
+from preparemd.amber.md import namelist, timestep
 from preparemd.utils import header
 
+# md2-9.inの&cntrl。md1.inはこれを書き換えて作る
+HEAT_CNTRL = [
+    ("imin", 0, "Molecular Dynamics"),
+    ("irest", 1, "Restart MD simulation from a previous run."),
+    ("ntx", 5, "Coordinates and velocities will be read from a previous run."),
+    ("nstlim", 50000, "Number of MD steps ( 100 ps )"),
+    ("dt", 0.002, "Timestep (ps)"),
+    ("igb", 0, "No generalized Born term is used (Default)"),
+    ("ntp", 1, "MD simulations with isotropic position scaling"),
+    ("ntb", 2, "Constant Pressure. NPT simulation."),
+    ("ntc", 2, "SHAKE on for bonds involving hydrogen atoms"),
+    ("ntf", 2, "No force evaluation for bonds with hydrogen"),
+    ("cut", 8.0, "Nonbonded cutoff (Angstroms)"),
+    ("iwrap", 1, 'the coordinates written to the restart and trajectory files will be "wrapped" into a primary box.'),
+    ("ntpr", 5000, "Print to mdout every ntpr steps"),
+    ("ntwx", 5000, "Write to trajectory file every ntwx steps"),
+    ("ntwr", 5000, 'Every ntwr steps during dynamics, the "restrt" file will be written'),
+    ("ntt", 3, "Langevin thermostat"),
+    ("gamma_ln", 2.0, "Collision frequency for thermostat"),
+    ("ig", -1, "Random seed for Langevin thermostat"),
+    ("temp0", 300.0, "Reference temperature at which the system is to be kept."),
+    ("ntr", 1, "Harmonic position restraints ON"),
+    ("restraintmask", "", "Atoms to be restrained"),
+    ("restraint_wt", 0.0, "Restraint weight"),
+    ("ioutfm", 1, "Binary NetCDF trajectory"),
+    ("nmropt", 0, "NMR restraints off"),
+]  # fmt: skip  # noqa: E501
+
+
+def heatmdin(residuenum: int) -> namelist.Mdin:
+    """Base of md2-9.in (NPT, restarted from the previous step).
+    Args:
+        residuenum: 入力pdbファイルの残基数。position restraintsをかける範囲。
+    """
+    cntrl = namelist.Namelist("cntrl", [namelist.Entry(*e) for e in HEAT_CNTRL])
+    cntrl.set("restraintmask", f":1-{residuenum} & !@H=")
+    return namelist.Mdin(
+        "Heat system (constant volume)",
+        [
+            cntrl,
+            namelist.Namelist(
+                "wt",
+                [namelist.Entry("type", "DUMPFREQ"), namelist.Entry("istep1", 5000)],
+            ),
+            namelist.Namelist("wt", [namelist.Entry("type", "END")]),
+        ],
+        trailer=["DISANG=dist1.rst", "DUMPAVE=dist1.dat"],
+        width=32,
+    )
+
+
+def heatstage(base: namelist.Mdin, number: int, weight: float) -> namelist.Mdin:
+    """md{number}.in made from a copy of `heatmdin`.
+
+    md1.inはNVTで10 Kから300 Kまで昇温する。md2-9.inはNPTで直前のステップから再開する。
+    """
+    mdin = base.copy()
+    cntrl = mdin.cntrl
+    cntrl.set("restraint_wt", weight)
+    if number == 1:
+        cntrl.set("irest", 0, "DO NOT restart MD simulation from a previous run.")
+        cntrl.set("ntx", 1, "Coordinates and velocities will not be read.")
+        cntrl.set("nstlim", 100000, "Number of MD steps ( 200 ps )")
+        cntrl.set("ntp", 0, "No pressure scaling (Default)")
+        cntrl.set("ntb", 1, "Constant Volume. NVT simulation.")
+        cntrl.set(
+            "tempi",
+            10.0,
+            "Initial Temperature. For the initial dynamics run, (NTX < 3) the "
+            "velocities are assigned from a Maxwellian distribution at TEMPI K.",
+            before="temp0",
+        )
+        mdin.namelists[1:] = [
+            namelist.Namelist(
+                "wt",
+                [
+                    namelist.Entry("TYPE", "TEMP0"),
+                    namelist.Entry("istep1", 0),
+                    namelist.Entry("istep2", 100000),
+                    namelist.Entry("value1", 10.0),
+                    namelist.Entry("value2", 300.0),
+                ],
+            ),
+            namelist.Namelist("wt", [namelist.Entry("TYPE", "END")]),
+        ]
+        mdin.trailer = []
+    return mdin
+
 
 def heatinput(
-    restart_input: str,
-    simtime: int,
-    ntp: str,
-    ntb: str,
-    annealing: str,
     residuenum: int,
     weights: list,
     number: int,
-    temperature: str,
+    overrides: dict | None = None,
+    hmr: bool = False,
 ) -> str:
-    """Write md[1-9].in file. Do not use f-string here, use .format() instead."""
-    heat_template = textwrap.dedent("""\
-        Heat system (constant volume)
-        &cntrl
-            imin=0,                         ! Molecular Dynamics
-            {restart_input}
-            nstlim={simtime},               ! Number of MD steps ( 200 ps )
-            dt=0.002,                       ! Timestep (ps)
-            igb=0,                          ! No generalized Born term is used (Default)
-            ntp=0,                          ! No pressure scaling (Default)
-            {ntp}
-            {ntb}
-            ntc=2,                          ! SHAKE on for bonds involving hydrogen atoms
-            ntf=2,                          ! No force evaluation for bonds with hydrogen
-            cut=8.0,                        ! Nonbonded cutoff (Angstroms)
-            iwrap=1,                        ! the coordinates written to the restart and trajectory files will be "wrapped" into a primary box.
-            ntpr=5000,                      ! Print to mdout every ntpr steps
-            ntwx=5000,                      ! Write to trajectory file every ntwx steps
-            ntwr=5000,                      ! Every ntwr steps during dynamics, the "restrt" file will be written
-            ntt=3,                         ! Langevin thermostat
-            gamma_ln=2.0,                   ! Collision frequency for thermostat
-            ig=-1,                         ! Random seed for Langevin thermostat
-            {temperature}
-            ntr=1,                         ! Harmonic position restraints ON
-            restraintmask=':1-{residuenum} & !@H=',  ! Atoms to be restrained
-            restraint_wt={restraint_weight},              ! Restraint weight
-            ioutfm=1,                      ! Binary NetCDF trajectory
-            nmropt=0,                      ! NMR restraints off
-            {annealing}/
-    """).format(
-        restart_input=restart_input,
-        simtime=simtime,
-        ntp=ntp,
-        ntb=ntb,
-        temperature=temperature,
-        residuenum=residuenum,
-        restraint_weight=weights[number - 1],
-        annealing=annealing,
-    )
-    return heat_template
+    """Write md[1-9].in file.
+
+    Args:
+        residuenum: 入力pdbファイルの残基数。
+        weights: 各ステップのrestraint_wtの値。
+        number: ステップの番号(1-9)。
+        overrides: `namelist.parse_overrides`で作った値の上書き。
+        hmr: Trueの場合、dt=0.004にしてステップ数を同じ時間になるよう変える。
+    """
+    mdin = heatstage(heatmdin(residuenum), number, weights[number - 1])
+    timestep.set_timestep(mdin, timestep.stage_dt(hmr))
+    return mdin.apply(overrides, "heat").render()
 
 
 def heatcontent() -> str:
@@ -92,8 +149,8 @@ def heatcontent() -> str:
     return content
 
 
-def runinput(machineenv: str) -> str:
+def runinput(machineenv: str, walltime: str = "") -> str:
     """content of heat/run.sh"""
-    runinput = header.queue_header(machineenv=machineenv)
+    runinput = header.queue_header(machineenv=machineenv, walltime=walltime)
     runinput += heatcontent()
     return runinput
@@ -0,0 +1,224 @@
+"""Streaming parser of AMBER (pmemd/sander) mdout and mdinfo files.
+
+The energies of each NSTEP record are written as "NAME = value" pairs, and a
+record ends with a line of dashes::
+
+     NSTEP =     5000   TIME(PS) =      10.000  TEMP(K) =   300.12  PRESS =    -5.3
+     Etot   =   -123456.7890  EKtot   =     23456.7890  EPtot      =   -146913.5780
+     BOND   =       123.4567  ANGLE   =       345.6789  DIHED      =       456.7890
+     ...
+     ------------------------------------------------------------------------------
+
+The records after "A V E R A G E S   O V E R" and "R M S  F L U C T U A T I O N S"
+are the averages and the fluctuations of the run. The file is read once line by
+line, and the values are converted to NumPy arrays in chunks of records, so
+multi-GB files of long runs can be read with little memory.
+"""
+
+import math
+import re
+from dataclasses import dataclass, field
+
+import numpy as np
+
+_STEPS = re.compile(r"O V E R\s+([\d ]+?)\s+S T E P S")
+_WALL_TIME = re.compile(r"Total wall time:\s+([0-9.]+)\s+seconds")
+
+
+@dataclass
+class Mdout:
+    """Values read from an mdout file.
+
+    Attributes:
+        records: 各NSTEPレコードの値。キーはmdoutの項目名("NSTEP", "EPtot"など)。
+                 途中から現れた項目の値はnan。
+        averages: 最後の"A V E R A G E S"ブロックの値。終わっていない計算では空。
+        fluctuations: 最後の"R M S  F L U C T U A T I O N S"ブロックの値。
+        timings: 計算速度("ns/day", "seconds/ns", "Elapsed(s)", "wall_time(s)"など)。
+                 全ステップの平均があればその値、なければ最後に出力された値。
+        averaged_steps: averagesの平均をとったステップ数。
+    """
+
+    records: dict[str, np.ndarray] = field(default_factory=dict)
+    averages: dict[str, float] = field(default_factory=dict)
+    fluctuations: dict[str, float] = field(default_factory=dict)
+    timings: dict[str, float] = field(default_factory=dict)
+    averaged_steps: int = 0
+
+    def __len__(self) -> int:
+        return len(self.records.get("NSTEP", ()))
+
+    def average(self, term: str) -> float:
+        """Average of a term. The mean of the records is used if the run has
+        not written its averages yet."""
+        if term in self.averages:
+            return self.averages[term]
+        if term in self.records and len(self.records[term]) > 0:
+            return float(np.nanmean(self.records[term]))
+        raise KeyError(f"{term} was not found in the mdout file.")
+
+
+# この数のレコードごとに値の文字列をまとめて数値に変換する
+CHUNK_RECORDS = 4096
+
+
+def _to_float(text: str) -> float:
+    try:
+        return float(text)
+    except ValueError:
+        # 桁あふれした値は"*******"と出力される
+        return math.nan
+
+
+def split_pairs(lines: list[str]) -> tuple[list[str], list[str]]:
+    """Names and values of "NAME = value" pairs in the lines of a record.
+
+    Values never contain spaces, so splitting at "=" gives the value at the head
+    of each part and the next name at its tail. This is several times faster
+    than a regular expression. Lines without "=" (e.g. "Ewald error estimate")
+    are ignored.
+    """
+    parts = "".join([line for line in lines if "=" in line]).split("=")
+    names = [parts[0].strip()]
+    values = []
+    for part in parts[1:]:
+        fields = part.split(None, 1)
+        if not fields:
+            break
+        values.append(fields[0])
+        if len(fields) == 1:
+            break
+        names.append(fields[1].strip())
+    return names[: len(values)], values
+
+
+def iter_mdout(lines):
+    """Split lines of an mdout file into blocks.
+
+    Yields:
+        (kind, lines): kind is "record", "averages", "fluctuations", "timings_all",
+            "timings_last" or "wall_time". "A V E R A G E S" lines are yielded as
+            "averaged_steps".
+    """
+    section = "record"
+    block = None
+    timing = None
+    for line in lines:
+        if block is not None:
+            if line.startswith(" ---"):
+                yield section, block
+                block = None
+                section = "record"
+            else:
+                block.append(line)
+            continue
+        if line.startswith(" NSTEP ="):
+            block = [line]
+        elif line.startswith("|"):
+            if "Average timings for" in line:
+                timing = "all" if "all steps" in line else "last"
+            elif timing is not None:
+                if "=" in line:
+                    yield f"timings_{timing}", [line[1:]]
+                else:
+                    timing = None
+            if "Total wall time:" in line:
+                yield "wall_time", [line]
+        elif "A V E R A G E S" in line:
+            section = "averages"
+            yield "averaged_steps", [line]
+        elif "R M S  F L U C T U A T I O N S" in line:
+            section = "fluctuations"
+    if block is not None:
+        # 書き出し途中のレコード
+        yield section, block
+
+
+class _Columns:
+    """Values of the records, converted to numbers chunk by chunk."""
+
+    def __init__(self):
+        self.chunks: dict[str, list[np.ndarray]] = {}
+        self.nrecords = 0
+        self.names: list[str] = []
+        self.pending: list[list[str]] = []
+
+    def append(self, names: list[str], values: list[str]) -> None:
+        if names != self.names or len(self.pending) >= CHUNK_RECORDS:
+            self.flush()
+            self.names = names
+        self.pending.append(values)
+
+    def flush(self) -> None:
+        if not self.pending:
+            return
+        try:
+            block = np.array(self.pending, dtype=np.float64)
+        except ValueError:
+            block = np.array(
+                [[_to_float(v) for v in row] for row in self.pending], dtype=np.float64
+            )
+        n = len(self.pending)
+        seen = set()
+        for j, name in enumerate(self.names):
+            if name in seen:
+                # 1つのレコードに同じ項目が2回ある場合は最初の値を使う
+                continue
+            seen.add(name)
+            if name not in self.chunks:
+                # 途中から現れた項目の、それまでのレコードの値はnan
+                self.chunks[name] = [np.full(self.nrecords, np.nan)]
+            self.chunks[name].append(block[:, j])
+        for name, chunks in self.chunks.items():
+            if name not in seen:
+                chunks.append(np.full(n, np.nan))
+        self.nrecords += n
+        self.pending = []
+
+    def arrays(self) -> dict[str, np.ndarray]:
+        self.flush()
+        return {name: np.concatenate(chunks) for name, chunks in self.chunks.items()}
+
+
+def parse_mdout(lines) -> Mdout:
+    """Parse lines (an iterable of str) of an mdout or mdinfo file."""
+    columns = _Columns()
+    result = Mdout()
+    last_timings: dict[str, float] = {}
+    all_timings: dict[str, float] = {}
+    for kind, block in iter_mdout(lines):
+        if kind == "record":
+            columns.append(*split_pairs(block))
+        elif kind == "averages":
+            result.averages = _to_dict(block)
+        elif kind == "fluctuations":
+            result.fluctuations = _to_dict(block)
+        elif kind == "averaged_steps":
+            match = _STEPS.search(block[0])
+            if match:
+                result.averaged_steps = int(match.group(1).replace(" ", ""))
+        elif kind == "timings_all":
+            all_timings.update(_to_dict(block))
+        elif kind == "timings_last":
+            last_timings.update(_to_dict(block))
+        elif kind == "wall_time":
+            match = _WALL_TIME.search(block[0])
+            if match:
+                result.timings["wall_time(s)"] = float(match.group(1))
+    result.records = columns.arrays()
+    result.timings.update(all_timings or last_timings)
+    return result
+
+
+def _to_dict(lines: list[str]) -> dict[str, float]:
+    names, values = split_pairs(lines)
+    result: dict[str, float] = {}
+    for name, value in zip(names, values, strict=True):
+        result.setdefault(name, _to_float(value))
+    return result
+
+
+def read_mdout(path: str) -> Mdout:
+    """Read an mdout or mdinfo file."""
+    with open(path, errors="replace") as f:
+        return parse_mdout(f)
@@ -1,68 +1,54 @@
 import textwrap
 
+from preparemd.amber.md import namelist
 from preparemd.utils import header
 
-
-def min1input() -> str:
+# (key, value, comment[, quote])
+MIN1_CNTRL = [
+    ("imin", 1, "Do Minimization"),
+    ("nmropt", 0, "No restraints"),
+    ("ntx", 1, "Coordinates, but no velocities, will be read (default)"),
+    ("irest", 0, "Do NOT restart the simulation"),
+    ("ntxo", 1, "ASCII Output Format of the final coordinates"),
+    ("ntpr", 20, "Every ntpr steps, energy information will be printed."),
+    ("ntwr", 2000, "Every ntwr steps during dynamics, the “restrt” file will be written"),
+    ("ntwx", 0, "Every ntwx steps, the coordinates will be written to the mdcrd file. if 0, no output."),
+    ("ioutfm", 0, "ASCII format of coordinate and velocity trajectory files (mdcrd, mdvel and inptraj)."),
+    ("ibelly", 1, "If ibelly=1, the coordinates except the bellymasked atoms will be frozen."),
+    ("bellymask", ":WAT,Na+,Cl-", "mask for ibelly = 1", '"'),
+    ("ntr", 0, "Flag for restraining specified atoms in Cartesian space using a harmonic potential. No restraints."),
+    ("ntmin", 1, "Method of minimization. For NCYC cycles the steepest descent method is used then conjugate gradient is switched on"),
+    ("maxcyc", 200, "The maximum number of cycles of minimization. Default = 1."),
+    ("ncyc", 100, 'If "ntmin" is 1, the method of minimization will be switched from steepest descent to conjugate gradient after NCYC cycles. Default 10.'),
+    ("nstlim", 2000, "number of MD-steps to be performed."),
+    ("nscm", 0, "Flag for the removal of translational and rotational center-of-mass"),
+    ("jfastw", 0, ""),
+]  # fmt: skip  # noqa: E501
+
+
+def min1mdin() -> namelist.Mdin:
+    """min1.in: minimization of the solvent and ions only (ibelly)."""
+    cntrl = namelist.Namelist("cntrl", [namelist.Entry(*e) for e in MIN1_CNTRL])
+    return namelist.Mdin("molecular dynamics minimization run 1", [cntrl], width=19)
+
+
+def min2mdin() -> namelist.Mdin:
+    """min2.in: minimization of the whole system."""
+    mdin = min1mdin()
+    mdin.title = "molecular dynamics minimization run 2"
+    mdin.cntrl.remove("ibelly")
+    mdin.cntrl.remove("bellymask")
+    return mdin
+
+
+def min1input(overrides: dict | None = None) -> str:
     """Template file for min1.in"""
+    return min1mdin().apply(overrides, "minimize").render()
 
-    min1_template = textwrap.dedent(
-        """\
-        molecular dynamics minimization run 1
-        &cntrl
-            imin=1,            ! Do Minimization
-            nmropt=0,          ! No restraints
-            ntx=1,             ! Coordinates, but no velocities, will be read (default)
-            irest=0,           ! Do NOT restart the simulation
-            ntxo=1,            ! ASCII Output Format of the final coordinates
-            ntpr=20,           ! Every ntpr steps, energy information will be printed.
-            ntwr=2000,         ! Every ntwr steps during dynamics, the “restrt” file will be written
-            ntwx=0,            ! Every ntwx steps, the coordinates will be written to the mdcrd file. if 0, no output.
-            ioutfm=0,          ! ASCII format of coordinate and velocity trajectory files (mdcrd, mdvel and inptraj).
-            ibelly=1,          ! If ibelly=1, the coordinates except the bellymasked atoms will be frozen.
-            bellymask=":WAT,Na+,Cl-",   ! mask for ibelly = 1
-            ntr=0,             ! Flag for restraining specified atoms in Cartesian space using a harmonic potential. No restraints.
-            ntmin=1,           ! Method of minimization. For NCYC cycles the steepest descent method is used then conjugate gradient is switched on
-            maxcyc=200,        ! The maximum number of cycles of minimization. Default = 1.
-            ncyc=100,          ! If "ntmin" is 1, the method of minimization will be switched from steepest descent to conjugate gradient after NCYC cycles. Default 10.
-            nstlim=2000,       ! number of MD-steps to be performed.
-            nscm=0,            ! Flag for the removal of translational and rotational center-of-mass
-            jfastw=0,
-        /
-        """  # noqa: E501
-    )
-
-    return min1_template
-
-
-def min2input() -> str:
-    """Template file for min2.in"""
 
-    min2_template = textwrap.dedent(
-        """\
-        molecular dynamics minimization run 2
-        &cntrl
-            imin=1,            ! Do Minimization
-            nmropt=0,          ! No restraints
-            ntx=1,             ! Coordinates, but no velocities, will be read (default)
-            irest=0,           ! Do NOT restart the simulation
-            ntxo=1,            ! ASCII Output Format of the final coordinates
-            ntpr=20,           ! Every ntpr steps, energy information will be printed.
-            ntwr=2000,         ! Every ntwr steps during dynamics, the “restrt” file will be written
-            ntwx=0,            ! Every ntwx steps, the coordinates will be written to the mdcrd file. if 0, no output.
-            ioutfm=0,          ! ASCII format of coordinate and velocity trajectory files (mdcrd, mdvel and inptraj).
-            ntr=0,             ! Flag for restraining specified atoms in Cartesian space using a harmonic potential. No restraints.
-            ntmin=1,           ! Method of minimization. For NCYC cycles the steepest descent method is used then conjugate gradient is switched on
-            maxcyc=200,        ! The maximum number of cycles of minimization. Default = 1.
-            ncyc=100,          ! If "ntmin" is 1, the method of minimization will be switched from steepest descent to conjugate gradient after NCYC cycles. Default 10.
-            nstlim=2000,       ! number of MD-steps to be performed.
-            nscm=0,            ! Flag for the removal of translational and rotational center-of-mass
-            jfastw=0,
-        /
-        """  # noqa: E501
-    )
-
-    return min2_template
+def min2input(overrides: dict | None = None) -> str:
+    """Template file for min2.in"""
+    return min2mdin().apply(overrides, "minimize").render()
 
 
 def minimizercontent() -> str:
@@ -102,10 +88,10 @@ def minimizercontent() -> str:
     return content
 
 
-def runinput(machineenv: str) -> str:
+def runinput(machineenv: str, walltime: str = "") -> str:
     """content of minimize/run.sh"""
 
-    runinput = header.queue_header(machineenv=machineenv)
+    runinput = header.queue_header(machineenv=machineenv, walltime=walltime)
     runinput += minimizercontent()
 
     return runinput
@@ -0,0 +1,366 @@
+"""Object model of AMBER mdin files (&cntrl, &ewald, &wt namelists).
+
+An mdin file is a title line, a list of namelists and trailing lines such as
+"DISANG=dist1.rst". Each namelist keeps its entries in order, so that the
+rendered file keeps the layout of the templates. Copies share the entries, so
+making many inputs from one base object only costs the changed fields.
+"""
+
+import copy
+import re
+import tomllib
+from dataclasses import dataclass, field
+
+# 値を変えられる段階の名前。"*"はすべての段階に適用する
+STAGES = ("minimize", "heat", "production", "amd")
+
+
+@dataclass(frozen=True)
+class Entry:
+    key: str
+    value: int | float | str | bool
+    comment: str = ""
+    # 文字列の値を囲む引用符。""ならそのまま書き出す
+    quote: str = "'"
+
+
+def format_value(value, quote: str = "'") -> str:
+    """Fortran namelist representation of a value."""
+    if isinstance(value, bool):
+        return ".true." if value else ".false."
+    if isinstance(value, int):
+        return str(value)
+    if isinstance(value, float):
+        text = repr(value)
+        if "e" in text or "E" in text:
+            # 1e-06ではなく0.000001のように書く
+            text = f"{value:.12f}".rstrip("0")
+            if text.endswith("."):
+                text += "0"
+        return text
+    return f"{quote}{value}{quote}"
+
+
+def parse_value(text: str) -> tuple[int | float | str | bool, str]:
+    """Convert a namelist value to a Python value.
+
+    Returns:
+        (value, quote): quote is the quotation mark of a string value.
+    """
+    text = text.strip()
+    if len(text) >= 2 and text[0] == text[-1] and text[0] in "'\"":
+        return text[1:-1], text[0]
+    if re.fullmatch(r"[+-]?\d+", text):
+        return int(text), "'"
+    if re.fullmatch(r"[+-]?(\d+\.?\d*|\.\d+)([eEdD][+-]?\d+)?", text):
+        return float(text.replace("d", "e").replace("D", "e")), "'"
+    if text.lower() in (".true.", ".t.", "t"):
+        return True, "'"
+    if text.lower() in (".false.", ".f.", "f"):
+        return False, "'"
+    return text, ""
+
+
+class Namelist:
+    """One namelist, e.g. &cntrl ... /."""
+
+    def __init__(self, name: str, entries: list[Entry] | None = None):
+        self.name = name
+        self._entries: dict[str, Entry] = {}
+        for entry in entries or []:
+            self._entries[entry.key.lower()] = entry
+
+    def __contains__(self, key: str) -> bool:
+        return key.lower() in self._entries
+
+    def __getitem__(self, key: str):
+        return self._entries[key.lower()].value
+
+    def __setitem__(self, key: str, value) -> None:
+        self.set(key, value)
+
+    def __eq__(self, other) -> bool:
+        return (
+            isinstance(other, Namelist)
+            and self.name == other.name
+            and list(self._entries.values()) == list(other._entries.values())
+        )
+
+    @property
+    def entries(self) -> list[Entry]:
+        return list(self._entries.values())
+
+    def set(
+        self, key: str, value, comment: str | None = None, before: str | None = None
+    ) -> "Namelist":
+        """Set a value. The position and the comment of an existing key are kept.
+
+        A new key is appended, or inserted before the key `before` if it is given.
+        """
+        old = self._entries.get(key.lower())
+        if old is None:
+            entry = Entry(key, value, comment or "")
+            if before is None or before.lower() not in self._entries:
+                self._entries[key.lower()] = entry
+            else:
+                items = list(self._entries.items())
+                index = list(self._entries).index(before.lower())
+                items.insert(index, (key.lower(), entry))
+                self._entries = dict(items)
+        else:
+            self._entries[key.lower()] = Entry(
+                old.key,
+                value,
+                old.comment if comment is None else comment,
+                old.quote if isinstance(value, str) else "'",
+            )
+        return self
+
+    def remove(self, key: str) -> None:
+        self._entries.pop(key.lower(), None)
+
+    def copy(self) -> "Namelist":
+        new = Namelist(self.name)
+        new._entries = dict(self._entries)
+        return new
+
+    def render(self, indent: int = 4, width: int = 0, inline: bool = False) -> str:
+        """Render the namelist.
+
+        Args:
+            indent: Indent of each entry.
+            width: Column of the comments, counted from the entry. Comments of
+                   longer entries are separated by 3 spaces.
+            inline: Write all entries in one line (used for &wt).
+        """
+        if inline:
+            items = [
+                f"{e.key}={format_value(e.value, e.quote)}"
+                for e in self._entries.values()
+            ]
+            if len(items) == 1:
+                return f"&{self.name} {items[0]} /\n"
+            return f"&{self.name} {', '.join(items)}, /\n"
+        lines = [f"&{self.name}\n"]
+        pad = " " * indent
+        for e in self._entries.values():
+            text = f"{e.key}={format_value(e.value, e.quote)},"
+            if e.comment:
+                text += " " * max(width - len(text), 3) + f"! {e.comment}"
+            lines.append(f"{pad}{text}\n")
+        lines.append("/\n")
+        return "".join(lines)
+
+
+@dataclass
+class Mdin:
+    """A whole mdin file."""
+
+    title: str
+    namelists: list[Namelist] = field(default_factory=list)
+    trailer: list[str] = field(default_factory=list)
+    indent: int = 4
+    width: int = 0
+
+    def namelist(self, name: str = "cntrl") -> Namelist:
+        """The first namelist with the name."""
+        for nml in self.namelists:
+            if nml.name.lower() == name.lower():
+                return nml
+        raise KeyError(f"&{name} namelist was not found.")
+
+    @property
+    def cntrl(self) -> Namelist:
+        return self.namelist("cntrl")
+
+    def copy(self) -> "Mdin":
+        return Mdin(
+            self.title,
+            [nml.copy() for nml in self.namelists],
+            list(self.trailer),
+            self.indent,
+            self.width,
+        )
+
+    def apply(self, overrides: dict | None, stage: str) -> "Mdin":
+        """Apply overrides made by `parse_overrides` or `load_overrides`.
+
+        The values for "*" are applied first, then the values for the stage.
+        Namelists that do not exist yet are added before the &wt namelists.
+        """
+        if not overrides:
+            return self
+        for target in ("*", stage):
+            for name, values in overrides.get(target, {}).items():
+                try:
+                    nml = self.namelist(name)
+                except KeyError:
+                    nml = Namelist(name)
+                    index = next(
+                        (
+                            i
+                            for i, n in enumerate(self.namelists)
+                            if n.name.lower() == "wt"
+                        ),
+                        len(self.namelists),
+                    )
+                    self.namelists.insert(index, nml)
+                for key, value in values.items():
+                    nml.set(key, value)
+        return self
+
+    def render(self) -> str:
+        parts = [self.title + "\n"]
+        for nml in self.namelists:
+            parts.append(
+                nml.render(self.indent, self.width, inline=nml.name.lower() == "wt")
+            )
+        parts.extend(line + "\n" for line in self.trailer)
+        return "".join(parts)
+
+
+_TOKEN = re.compile(
+    r"""\s*(?:
+        (?P<end>/|&end\b)
+      | (?P<key>[A-Za-z_]\w*(?:\(\d+\))?)\s*=\s*
+        (?P<value>'[^']*'|"[^"]*"|[^,\s/!]+)\s*,?
+    )""",
+    re.VERBOSE | re.IGNORECASE,
+)
+
+
+def _split_comment(line: str) -> tuple[str, str]:
+    """Split a line at '!' outside quoted strings."""
+    quote = ""
+    for i, c in enumerate(line):
+        if quote:
+            if c == quote:
+                quote = ""
+        elif c in "'\"":
+            quote = c
+        elif c == "!":
+            return line[:i], line[i + 1 :].strip()
+    return line, ""
+
+
+def parse_mdin(text: str) -> Mdin:
+    """Parse the content of an mdin file.
+
+    Lines with only comments inside namelists are dropped. Lines that are not
+    in any namelist after the title are kept in `Mdin.trailer`. The indent and
+    the comment column are taken from the entries of the namelists.
+    """
+    lines = text.splitlines()
+    if not lines:
+        raise ValueError("The mdin file is empty.")
+    mdin = Mdin(lines[0].rstrip())
+    current = None
+    indents, widths = [], []
+    for line in lines[1:]:
+        body, comment = _split_comment(line)
+        rest = body.strip()
+        if current is None:
+            if not rest.startswith("&"):
+                if rest != "":
+                    mdin.trailer.append(line.strip())
+                continue
+            name = re.match(r"&(\w+)", rest).group(1)
+            current = Namelist(name)
+            mdin.namelists.append(current)
+            rest = rest[len(name) + 1 :]
+        nml, last, pos = current, None, 0
+        while pos < len(rest):
+            match = _TOKEN.match(rest, pos)
+            if match is None:
+                if rest[pos:].strip(" ,") == "":
+                    break
+                raise ValueError(f"Could not parse the mdin line: {line}")
+            pos = match.end()
+            if match.group("end"):
+                current = None
+                break
+            value, quote = parse_value(match.group("value"))
+            last = Entry(match.group("key"), value, "", quote)
+            nml._entries[last.key.lower()] = last
+        if last is None or nml.name.lower() == "wt":
+            continue
+        indent = len(line) - len(line.lstrip())
+        indents.append(indent)
+        if comment:
+            nml._entries[last.key.lower()] = Entry(
+                last.key, last.value, comment, last.quote
+            )
+            widths.append(len(body) - indent)
+    if indents:
+        mdin.indent = max(set(indents), key=indents.count)
+    if widths:
+        mdin.width = max(set(widths), key=widths.count)
+    return mdin
+
+
+def read_mdin(path: str) -> Mdin:
+    with open(path) as f:
+        return parse_mdin(f.read())
+
+
+def parse_overrides(items: list[str] | None) -> dict:
+    """Parse overrides given on the command line.
+
+    Each item is "[stage:][namelist.]key=value", e.g. "cut=9.0" (&cntrl of all
+    stages), "production:ntwx=10000" or "heat:ewald.dsum_tol=1e-6".
+    Returns:
+        dict: {stage or "*": {namelist: {key: value}}}
+    """
+    overrides: dict = {}
+    for item in items or []:
+        if "=" not in item:
+            raise ValueError(f"mdin override must be key=value: {item}")
+        target, text = item.split("=", 1)
+        stage, _, target = target.rpartition(":")
+        stage = stage or "*"
+        if stage != "*" and stage not in STAGES:
+            raise ValueError(f"Unknown stage {stage}. Choose from {', '.join(STAGES)}.")
+        name, _, key = target.rpartition(".")
+        value, _ = parse_value(text)
+        overrides.setdefault(stage, {}).setdefault(name or "cntrl", {})[key.strip()] = (
+            value
+        )
+    return overrides
+
+
+def load_overrides(path: str) -> dict:
+    """Read overrides from a TOML file.
+
+    Top-level tables are namelists applied to all stages, and tables under a
+    stage name are applied to that stage only::
+
+        [cntrl]
+        cut = 9.0
+
+        [production.cntrl]
+        ntwx = 10000
+    """
+    with open(path, "rb") as f:
+        data = tomllib.load(f)
+    overrides: dict = {}
+    for name, table in data.items():
+        if not isinstance(table, dict):
+            raise ValueError(f"{name} in {path} must be a table.")
+        if name in STAGES:
+            for nmlname, values in table.items():
+                if not isinstance(values, dict):
+                    raise ValueError(f"{name}.{nmlname} in {path} must be a table.")
+                overrides.setdefault(name, {})[nmlname] = dict(values)
+        else:
+            overrides.setdefault("*", {})[name] = dict(table)
+    return overrides
+
+
+def merge_overrides(*overrides: dict | None) -> dict:
+    """Merge overrides. Later values take precedence."""
+    merged: dict = {}
+    for ov in overrides:
+        for stage, namelists in (ov or {}).items():
+            for name, values in namelists.items():
+                merged.setdefault(stage, {}).setdefault(name, {}).update(values)
+    return copy.deepcopy(merged)
@@ -1,21 +1,27 @@
+import functools
 import os
 import shutil
-import subprocess
-import tempfile
 import textwrap
 
+import numpy as np
 from gemmi import read_structure
 from loguru import logger
 
-from preparemd.amber.md import heat, minimize, production
-from preparemd.utils import header
+from preparemd.amber.md import dispatch, heat, minimize, production, submit, timestep
+from preparemd.amber.top import geometry, leapin, mmcif, pdbstream, prmtop
+from preparemd.utils import cache, header, manifest, profile, runner
 from preparemd.utils.log import log_setup
 
 log_setup(level="INFO")
 
 
 def write_minimizeinput(
-    dir: str, machineenv: str, minimizedir: str = "minimize"
+    dir: str,
+    machineenv: str,
+    minimizedir: str = "minimize",
+    filemanifest: manifest.Manifest | None = None,
+    mdin_overrides: dict | None = None,
+    walltime: str = "",
 ) -> None:
     """make AMBER inputfiles for minimization"""
     if not os.path.exists(os.path.join(dir, minimizedir)):
@@ -24,18 +30,25 @@ def write_minimizeinput(
     min2file = os.path.join(dir, minimizedir, "min2.in")
     runfile = os.path.join(dir, minimizedir, "run.sh")
 
-    with open(min1file, mode="w") as f:
-        f.write(minimize.min1input())
-    with open(min2file, mode="w") as f:
-        f.write(minimize.min2input())
-    with open(runfile, mode="w") as f:
-        f.write(minimize.runinput(machineenv=machineenv))
-
-    os.chmod(runfile, 0o755)
+    manifest.write_file(min1file, minimize.min1input(mdin_overrides), filemanifest)
+    manifest.write_file(min2file, minimize.min2input(mdin_overrides), filemanifest)
+    manifest.write_file(
+        runfile,
+        minimize.runinput(machineenv=machineenv, walltime=walltime),
+        filemanifest,
+        executable=True,
+    )
 
 
 def write_heatinput(
-    dir, residuenum: int, machineenv: str, heatdir: str = "heat"
+    dir,
+    residuenum: int,
+    machineenv: str,
+    heatdir: str = "heat",
+    filemanifest: manifest.Manifest | None = None,
+    mdin_overrides: dict | None = None,
+    walltime: str = "",
+    hmr: bool = False,
 ) -> None:
     """make AMBER inputfiles for equilibration
     Args:
@@ -44,90 +57,70 @@ def write_heatinput(
                     heatのときにposition restraintsをかける範囲指定のために必要。
         heatdir: 出力先のディレクトリ名で作るheatのインプットファイルを入れるディレクトリ名。
         初期値は"heat"
+        mdin_overrides: `namelist.parse_overrides`で作ったmd*.inの値の上書き。
+        hmr: Trueの場合、dt=0.004にしてステップ数を同じ時間になるよう変える。
     """  # noqa: E501
     if not os.path.exists(os.path.join(dir, heatdir)):
         os.makedirs(os.path.join(dir, heatdir))
     # 徐々にrestraint_wtの値を小さくしていく
     weights = [10.0, 10.0, 5.0, 2.0, 1.0, 0.5, 0.2, 0.1, 0.0]
+    # md1.inはirest=0, ntx=1のNVT、md2-md9.inはirest=1, ntx=5のNPT。
+    # 共通の&cntrlを一度だけ作り、各ステップで異なる値だけを書き換える
+    base = heat.heatmdin(residuenum)
     for i in range(1, 10):
-        # md1.inにはirest=0, ntx=1、md2-md9.inにはirest=1, ntx=5を指定する。
-        is_md1 = True if i == 1 else False
-        if is_md1:
-            restart_input = textwrap.dedent(
-                """\
-                irest=0,                        ! DO NOT restart MD simulation from a previous run.
-                    ntx=1,                          ! Coordinates and velocities will not be read.\
-                """  # noqa: E501
-            )
-            simtime = 100000
-            ntp = "ntp=0,                          ! No pressure scaling (Default)"
-            ntb = "ntb=1,                          ! Constant Volume. NVT simulation."
-            temperature = textwrap.dedent(
-                """\
-                tempi=10.0,                     ! Initial Temperature. For the initial dynamics run, (NTX < 3) the velocities are assigned from a Maxwellian distribution at TEMPI K.
-                    temp0=300.0,                    ! Reference temperature at which the system is to be kept.\
-                """  # noqa: E501
-            )
-            annealing = textwrap.dedent(
-                """\
-                /
-                &wt TYPE='TEMP0', istep1=0, istep2=100000,
-                    value1=10.0, value2=300.0, /
-                &wt TYPE='END'
-                """
-            )
-        else:
-            restart_input = textwrap.dedent(
-                """\
-                irest=1,                        ! Restart MD simulation from a previous run.
-                    ntx=5,                          ! Coordinates and velocities will be read from a previous run.\
-                """  # noqa: E501
-            )
-            simtime = 50000
-            ntp = "ntp=1,                          ! MD simulations with isotropic position scaling"
-            ntb = "ntb=2,                          ! Constant Pressure. NPT simulation."
-            temperature = "temp0=300.0,                  ! Reference temperature at which the system is to be kept."  # noqa: E501
-            annealing = textwrap.dedent(
-                """\
-                /
-                &wt
-                    type='DUMPFREQ', istep1=5000,
-                /
-                &wt type='END' /
-                DISANG=dist1.rst
-                DUMPAVE=dist1.dat
-                """
-            )
-
-        md_i = heat.heatinput(
-            restart_input,
-            simtime,
-            ntp,
-            ntb,
-            annealing,
-            residuenum,
-            weights,
-            i,
-            temperature,
-        )
+        mdin = heat.heatstage(base, i, weights[i - 1])
+        timestep.set_timestep(mdin, timestep.stage_dt(hmr))
+        mdin.apply(mdin_overrides, "heat")
         mdfile = os.path.join(dir, heatdir, f"md{i}.in")
-        with open(mdfile, mode="w") as f:
-            f.write(md_i)
+        manifest.write_file(mdfile, mdin.render(), filemanifest)
 
-        runfile = os.path.join(dir, heatdir, "run.sh")
-        runinput = heat.runinput(machineenv=machineenv)
-        with open(runfile, mode="w") as f:
-            f.write(runinput)
-        os.chmod(runfile, 0o755)
+    runfile = os.path.join(dir, heatdir, "run.sh")
+    runinput = heat.runinput(machineenv=machineenv, walltime=walltime)
+    manifest.write_file(runfile, runinput, filemanifest, executable=True)
 
 
 def write_productioninput(
-    dir, machineenv: str, box: int = 3, ns_per_mddir: int = 50, productiondir="pr"
+    dir,
+    machineenv: str,
+    box: int = 3,
+    ns_per_mddir: int = 50,
+    productiondir="pr",
+    filemanifest: manifest.Manifest | None = None,
+    mdin_overrides: dict | None = None,
+    seed: int | None = None,
+    walltime: str = "",
+    nstlim: int | None = None,
+    hmr: bool = False,
+    resume_partial: bool = False,
 ) -> None:
-    """make AMBER input files for production run"""
+    """make AMBER input files for production run
+
+    Args:
+        productiondir: dirからの相対パス。レプリカの場合は"rep01/pr"など。
+        seed: If provided, the first segment assigns new velocities with this
+              random seed (used for replicas).
+        nstlim: If provided, the number of steps of each segment. It takes
+                precedence over ns_per_mddir and mdin_overrides.
+        hmr: If True, use dt=0.004 for a topology with repartitioned hydrogen
+             masses. nstlim and the output intervals are rescaled accordingly.
+        resume_partial: If True, run.sh continues a segment stopped halfway from
+                        its last periodic restart instead of running it again.
+    """
     if not os.path.exists(os.path.join(dir, productiondir)):
         os.makedirs(os.path.join(dir, productiondir))
-    mdfile = os.path.join(dir, productiondir, "md.in")
+    base = production.productionmdin(ns_per_mddir)
+    timestep.set_timestep(base, timestep.stage_dt(hmr))
+    base.apply(mdin_overrides, "production")
+    if nstlim is not None:
+        base.cntrl.set("nstlim", nstlim)
+    if seed is None:
+        first = base.render()
+    else:
+        first = production.set_velocities(base.copy(), seed).render()
+    restarted = production.set_restart(base.copy()).render()
+    # 各セグメントのディレクトリ(pr/001など)からtopとheatへの相対パス
+    updir = os.path.relpath(dir, os.path.join(dir, productiondir, "001"))
+    topfile = os.path.join(updir, "..", "top", "leap.parm7")
 
     # prディレクトリの中にboxで指定した数だけ001〜xxxというディレクトリを作成する
     # 各ディレクトリではns_per_mddirで指定した時間(ns)だけMDシミュレーションを
@@ -140,38 +133,71 @@ def write_productioninput(
 
         # i == 1 ならばrestartしない。それ以外はrestartをONにする
         # 直前のMD runの速度情報を引き継ぐ
-        do_restart = False if i == 1 else True
-        if do_restart:
-            restart_input = textwrap.dedent(
-                """\
-                irest=1,              ! Restart MD simulation from a previous run.
-                    ntx=5,                ! Coordinates and velocities will be read from a previous run."""  # noqa: E501
-            )
-        else:
-            restart_input = textwrap.dedent(
-                """\
-                irest=0,              ! DO NOT restart MD simulation from a previous run.
-                    ntx=1,                ! Coordinates and velocities will not be read."""  # noqa: E501
-            )
-        mdinput = production.productioninput(restart_input, ns_per_mddir)
+        mdinput = first if i == 1 else restarted
         mdfile = os.path.join(dir, productiondir, box_zero, "md.in")
-        with open(mdfile, mode="w") as f:
-            f.write(mdinput)
+        manifest.write_file(mdfile, mdinput, filemanifest)
 
         runfile = os.path.join(dir, productiondir, box_zero, "run.sh")
         if i == 1:
-            prevrstfile = "../../heat/md9.rst7"
-        runinput = production.runinput(prevrstfile, machineenv=machineenv)
-        with open(runfile, mode="w") as f:
-            f.write(runinput)
-        os.chmod(runfile, 0o755)
+            prevrstfile = os.path.join(updir, "heat", "md9.rst7")
+        runinput = production.runinput(
+            prevrstfile,
+            machineenv=machineenv,
+            topfile=topfile,
+            walltime=walltime,
+            resume_partial=resume_partial,
+        )
+        manifest.write_file(runfile, runinput, filemanifest, executable=True)
 
         prevrstfile = os.path.join("..", box_zero, "md.rst7")
 
 
-def write_totalrunscript(dir: str, box: int, machineenv: str) -> None:
-    """make a run.sh file to run"""
+def write_totalrunscript(
+    dir: str,
+    box: int,
+    machineenv: str,
+    filemanifest: manifest.Manifest | None = None,
+    replicas: int = 0,
+    resume_partial: bool = False,
+) -> None:
+    """make a run.sh file to run
+
+    replicas > 0 の場合は、heatの後に各レプリカ(rep01/pr, rep02/pr, ...)の
+    production runを順に実行する。終了済みのセグメントは飛ばす
+    (`production.segmentfunctions`)。
+    """
     totalrunfile = os.path.join(dir, "totalrun.sh")
+    if replicas > 0:
+        production_content = textwrap.dedent("""\
+        for rep in {names}; do
+        (
+            topfile="../../../../top/leap.parm7"
+            rstfile="../../../heat/md9.rst7"
+            cd ${{rep}}/pr
+            for i in `seq 1 {box}`; do
+                j=$(printf "%03d\\n" "${{i}}")
+                cd $j
+                run_segment ${{rstfile}} || exit $?
+                rstfile="../${{j}}/md.rst7"
+                cd ..
+            done
+        ) || exit $?
+        done
+        """).format(names=" ".join(production.replica_names(replicas)), box=box)
+    else:
+        production_content = textwrap.dedent("""\
+        topfile="../../../top/leap.parm7"
+        rstfile="../../heat/md9.rst7"
+
+        cd pr
+        for i in `seq 1 {box}`; do
+            j=$(printf "%03d\\n" "${{i}}")
+            cd $j
+            run_segment ${{rstfile}} || exit $?
+            rstfile="../${{j}}/md.rst7"
+            cd ..
+        done
+        """).format(box=box)
     runinput = textwrap.dedent("""\
     {header}
     (
@@ -182,37 +208,32 @@ def write_totalrunscript(dir: str, box: int, machineenv: str) -> None:
         cd heat
         {heat_content}
     ) || exit $?
-    topfile="../../../top/leap.parm7"
-    rstfile="../../heat/md9.rst7"
-
-    cd pr
-    for i in `seq 1 {box}`; do
-        j=$(printf "%03d\\n" "${{i}}")
-        cd $j
-        pmemd.cuda_SPFP.MPI -O \\
-            -i md.in \\
-            -o md.out \\
-            -p ${{topfile}} \\
-            -c ${{rstfile}} \\
-            -r md.rst7 \\
-            -ref ${{topfile}} || exit $?
-        rstfile="../${{j}}/md.rst7"
-        cd ..
-    done
     """).format(
         header=header.queue_header(machineenv=machineenv),
         minimize_content=minimize.minimizercontent(),
         heat_content=heat.heatcontent(),
-        box=box,
     )
-    with open(totalrunfile, mode="w") as f:
-        f.write(runinput)
-    os.chmod(totalrunfile, 0o755)
+    runinput += production.segmentfunctions(resume_partial) + "\n" + production_content
+    manifest.write_file(totalrunfile, runinput, filemanifest, executable=True)
 
 
 def prepareamberfiles(
-    distdir: str, residuenum: int, box: int, ns_per_mddir: int, machineenv: str
-) -> None:
+    distdir: str,
+    residuenum: int,
+    box: int,
+    ns_per_mddir: int,
+    machineenv: str,
+    filemanifest: manifest.Manifest | None = None,
+    mdin_overrides: dict | None = None,
+    replicas: int = 0,
+    replica_seed: int = 1,
+    submit_mode: str = "",
+    walltime: str = "",
+    gpus_per_node: int = 1,
+    nstlim: int | None = None,
+    hmr: bool = False,
+    resume_partial: bool = False,
+) -> dict:
     """prepare AMBER input files for minimize, heat, and pr directories
 
     Args:
@@ -221,16 +242,118 @@ def prepareamberfiles(
         box: prディレクトリ内部に作成するサブディレクトリ数(001, 002, ...)。
         ns_per_mddir: 上記のサブディレクトリにつき、何nsのシミュレーションを行うか。
         machineenv: どこでMDを実行するか
+        filemanifest: 生成ファイルの記録。Noneの場合はdistdir/amberの記録を読み込み、
+                      書き出しまで行う。
+        mdin_overrides: min*.in, md*.inの値の上書き。`namelist.parse_overrides`,
+                        `namelist.load_overrides`で作る。
+        replicas: 1以上の場合、amber/prの代わりにamber/rep01/pr, rep02/pr, ...を作る。
+                  minimize, heatと/topのトポロジーは全レプリカで共有し、各レプリカの
+                  最初のセグメントで乱数シード(ig)を変えて速度を割り当て直す。
+        replica_seed: レプリカN(1始まり)の乱数シードは replica_seed + N - 1。
+        submit_mode: "chain"または"array"の場合、各段階を依存関係つきのジョブとして
+                     投入するamber/submit.shを書き出す。
+        walltime: minimize, heat, pr/NNNの各run.shで要求する実行時間("hh:mm:ss")。
+        gpus_per_node: 2以上の場合、ノード全体を確保して各GPUで別々のrun.shを実行する
+                       amber/gpu_dispatch.shと、その実行順を書いたamber/tasks.txtを書き出す。
+        nstlim: 指定した場合、各セグメントのステップ数。ns_per_mddirより優先する。
+        hmr: Trueの場合、heatとproductionをdt=0.004で行う。トポロジーの水素原子の
+             質量は`prmtop.repartition_hydrogen_mass`で変えておく。
+        resume_partial: Trueの場合、途中で止まったproductionのセグメントを最後の
+                        周期的なrestartから続ける。終了済みのセグメントは常に飛ばす。
+
+    Returns:
+        dict: added, changed, unchanged and stale files relative to distdir/amber.
+            内容が前回から変わっていないファイルは書き直さない。
     """
     outputdir = os.path.join(distdir, "amber")
     if not os.path.exists(outputdir):
         os.makedirs(outputdir)
-    write_minimizeinput(outputdir, machineenv=machineenv)
-    write_heatinput(outputdir, residuenum=residuenum, machineenv=machineenv)
-    write_productioninput(
-        outputdir, machineenv=machineenv, box=box, ns_per_mddir=ns_per_mddir
+    save = filemanifest is None
+    if save:
+        filemanifest = manifest.Manifest(outputdir)
+    write_minimizeinput(
+        outputdir,
+        machineenv=machineenv,
+        filemanifest=filemanifest,
+        mdin_overrides=mdin_overrides,
+        walltime=walltime,
     )
-    write_totalrunscript(outputdir, box=box, machineenv=machineenv)
+    write_heatinput(
+        outputdir,
+        residuenum=residuenum,
+        machineenv=machineenv,
+        filemanifest=filemanifest,
+        mdin_overrides=mdin_overrides,
+        walltime=walltime,
+        hmr=hmr,
+    )
+    if replicas > 0:
+        for i, name in enumerate(production.replica_names(replicas)):
+            write_productioninput(
+                outputdir,
+                machineenv=machineenv,
+                box=box,
+                ns_per_mddir=ns_per_mddir,
+                productiondir=os.path.join(name, "pr"),
+                filemanifest=filemanifest,
+                mdin_overrides=mdin_overrides,
+                seed=replica_seed + i,
+                walltime=walltime,
+                nstlim=nstlim,
+                hmr=hmr,
+                resume_partial=resume_partial,
+            )
+    else:
+        write_productioninput(
+            outputdir,
+            machineenv=machineenv,
+            box=box,
+            ns_per_mddir=ns_per_mddir,
+            filemanifest=filemanifest,
+            mdin_overrides=mdin_overrides,
+            walltime=walltime,
+            nstlim=nstlim,
+            hmr=hmr,
+            resume_partial=resume_partial,
+        )
+    write_totalrunscript(
+        outputdir,
+        box=box,
+        machineenv=machineenv,
+        filemanifest=filemanifest,
+        replicas=replicas,
+        resume_partial=resume_partial,
+    )
+    if submit_mode != "":
+        manifest.write_file(
+            os.path.join(outputdir, "submit.sh"),
+            submit.submitscript(machineenv, box, replicas, submit_mode),
+            filemanifest,
+            executable=True,
+        )
+        if submit_mode == "array":
+            manifest.write_file(
+                os.path.join(outputdir, "pr_array.sh"),
+                submit.arrayscript(machineenv, replicas, walltime),
+                filemanifest,
+                executable=True,
+            )
+    if gpus_per_node > 1:
+        manifest.write_file(
+            os.path.join(outputdir, dispatch.TASK_FILE),
+            dispatch.tasklist(box, replicas),
+            filemanifest,
+        )
+        manifest.write_file(
+            os.path.join(outputdir, "gpu_dispatch.sh"),
+            dispatch.dispatchscript(machineenv, gpus_per_node, walltime),
+            filemanifest,
+            executable=True,
+        )
+    if save:
+        filemanifest.save()
+        filemanifest.log_report()
+    return filemanifest.report()
 
 
 def get_boxsize_from_pre2(pre2file: str):
@@ -244,56 +367,99 @@ def get_boxsize_from_pre2(pre2file: str):
     return boxsize
 
 
-def preparepre2file(distdir: str, rotate: str = "", sslink_file: str = ""):
-    """prepare pre2.pdb file.
-    translate pre.pdb file to center (0,0,0)."""
+def auto_rotation(pdbfile: str, boxshape: str = "box") -> str:
+    """Find the orientation of the solute that minimizes the solvated box.
 
-    cpptraj_path = shutil.which("cpptraj")
-    if cpptraj_path is None:
-        raise RuntimeError(
-            "cpptraj command was not found. Make sure AmberTools was correctly installed."
-        )
+    The expected reduction of water molecules from the original orientation is
+    logged.
 
-    pdbfile_path = os.path.join(distdir, "top", "pre.pdb")
-    outfile_path = os.path.join(distdir, "top", "pre2.pdb")
-    fp = tempfile.NamedTemporaryFile(suffix=".in", mode="w+t", encoding="utf-8")
-    fp.write(
-        textwrap.dedent(
-            f"""\
-            parm {pdbfile_path}
-            trajin {pdbfile_path}
-            box auto
-            autoimage @CA origin
-            {rotate}
-            trajout {outfile_path}
-            go
-            """
-        )
+    Returns:
+        rotate: rotate string (e.g. "x 12.5 y -3 z 40") of the optimal rotation.
+    """
+    chunks = list(pdbstream.iter_atom_chunks(pdbfile))
+    if len(chunks) == 0:
+        raise ValueError(f"No atoms were found in {pdbfile}.")
+    coords = np.concatenate([c for c, _, _ in chunks])
+    radii = np.concatenate([r for _, _, r in chunks])
+    isometric = boxshape == "oct"
+    rotation = geometry.minimum_volume_rotation(coords, radii, isometric=isometric)
+    # 再現できるよう、pre2.pdbには丸めた回転角の文字列と同じ回転を適用する
+    rotate = geometry.rotate_string(rotation)
+    rotation = geometry.parse_rotate(rotate)
+
+    ratio = leapin.OCT_VOLUME_RATIO if isometric else 1.0
+    before = ratio * geometry.padded_volume(coords, radii, isometric=isometric)
+    after = ratio * geometry.padded_volume(coords, radii, rotation, isometric=isometric)
+    waters = max(int((before - after) * geometry.WATER_DENSITY), 0)
+    logger.info(
+        f'Automatic rotation: "{rotate}". The solvated box is {before:.0f} -> '
+        f"{after:.0f} A^3 ({100 * (1 - after / before):.1f}% smaller), about "
+        f"{waters} fewer water molecules ({3 * waters} atoms with TIP3P, "
+        f"{4 * waters} atoms with OPC)."
     )
-    fp.seek(0)
-    cmd = [cpptraj_path, "-i", fp.name, "-o", "/dev/null"]
-
-    logger.info(f"Launching subprocess {' '.join(cmd)}")
-    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    _, stderr = process.communicate()
-    retcode = process.wait()
+    return rotate
 
-    if retcode:
-        print(stderr)
-        raise RuntimeError("cpptraj process failed.")
 
-    fp.close()
-
-    boxsize = get_boxsize_from_pre2(outfile_path)
+def preparepre2file(
+    distdir: str, rotate: str = "", sslink_file: str = "", boxshape: str = "box"
+):
+    """prepare pre2.pdb file.
+    translate pre.pdb file to center (0,0,0).
 
-    # outfile_path中のCYX残基はすべてCYSにする
-    with open(outfile_path, "rt") as f:
-        x = f.read()
+    The geometric center of CA atoms is moved to the origin, the solute is rotated
+    by `rotate` (e.g. "rotate z 45") and the lengths of its bounding box are
+    written to the CRYST1 record. pre.pdb is streamed twice with constant memory:
+    the first pass computes the center and the box, the second pass writes
+    pre2.pdb with all line transforms (coordinates, CYX -> CYS and, if sslink_file
+    is given, CYS -> CYX of SS-bonded residues) applied at once.
+    If rotate is "auto", the rotation that minimizes the volume of the solvated
+    box of `boxshape` is searched (see `auto_rotation`) and recorded in a REMARK.
 
-    with open(outfile_path, "wt") as f:
-        x = x.replace("CYX", "CYS")
-        f.write(x)
+    Returns:
+        boxsize: "x y z" lengths of the bounding box of the solute.
+    """
+    pdbfile_path = os.path.join(distdir, "top", "pre.pdb")
+    outfile_path = os.path.join(distdir, "top", "pre2.pdb")
+    if not os.path.isfile(pdbfile_path):
+        raise FileNotFoundError(f"{pdbfile_path} was not found.")
+
+    remarks = []
+    if rotate == "auto":
+        rotate = auto_rotation(pdbfile_path, boxshape)
+        remarks.append(f"REMARK   1 PREPAREMD ROTATE {rotate}\n")
+    rotation = geometry.parse_rotate(rotate) if rotate != "" else np.identity(3)
+    # 回転後のボックスの大きさは平行移動に依存しないため、1回目の走査で中心と同時に求める
+    ca_sum, ca_num = np.zeros(3), 0
+    all_sum, all_num = np.zeros(3), 0
+    lower, upper = np.full(3, np.inf), np.full(3, -np.inf)
+    for coords, is_ca, radii in pdbstream.iter_atom_chunks(pdbfile_path):
+        ca_sum += coords[is_ca].sum(axis=0)
+        ca_num += int(is_ca.sum())
+        all_sum += coords.sum(axis=0)
+        all_num += len(coords)
+        rotated = coords @ rotation.T
+        lower = np.minimum(lower, (rotated - radii[:, None]).min(axis=0))
+        upper = np.maximum(upper, (rotated + radii[:, None]).max(axis=0))
+    if all_num == 0:
+        raise ValueError(f"No atoms were found in {pdbfile_path}.")
+    center = ca_sum / ca_num if ca_num > 0 else all_sum / all_num
+    box = upper - lower
+
+    transforms = [
+        pdbstream.drop_records("CRYST1"),
+        pdbstream.move_coordinates(center, rotation),
+        # outfile_path中のCYX残基はすべてCYSにする
+        pdbstream.rename_residue("CYX", "CYS"),
+    ]
+    if sslink_file != "":
+        transforms.append(pdbstream.cys_to_cyx(pdbstream.read_sslink(sslink_file)))
+    cryst1 = (
+        f"CRYST1{box[0]:9.3f}{box[1]:9.3f}{box[2]:9.3f}"
+        f"{90.0:7.2f}{90.0:7.2f}{90.0:7.2f} P 1           1\n"
+    )
+    pdbstream.rewrite(pdbfile_path, outfile_path, transforms, header=[cryst1, *remarks])
 
+    boxsize = f"{box[0]:.3f} {box[1]:.3f} {box[2]:.3f}"
     return boxsize
 
 
@@ -322,82 +488,94 @@ def get_charge(logfile: str) -> list[str]:
     return result_charge
 
 
-def run_leap(distdir: str, boxsize: str, pre2boxsize: str) -> None:
-    """make leap.in file to run tleap command."""
-    tleap_path = shutil.which("tleap")
-    if tleap_path is None:
-        raise RuntimeError(
-            "tleap command was not found. Make sure AmberTools was correctly installed."
-        )
+# tleapが出力するファイル群。キャッシュにはこれらを保存する
+LEAP_OUTPUTS = ["leap.parm7", "leap.rst7", "leap.pdb", "leap.log"]
+
+
+def _leap_cache_key(topdir: str, paramfiles: list[str], tleap_path: str) -> str:
+    """Cache key of tleap outputs: leap.in, pre2.pdb and the parameter files
+    copied into the top directory."""
+    with open(os.path.join(topdir, "leap.in")) as f:
+        leapininput = f.read()
+    parts = [leapininput, cache.hash_file(os.path.join(topdir, "pre2.pdb"))]
+    for name in sorted(paramfiles):
+        parts += [name, cache.hash_file(os.path.join(topdir, name))]
+    parts.append(_get_leap_version(tleap_path))
+    return cache.make_key(*parts)
 
-    # 作業ディレクトリを一時的に変更
-    cwd = os.getcwd()
-    os.chdir(os.path.join(cwd, distdir, "top"))
-    leapinfile = "leap.in"
+
+def run_leap(
+    distdir: str,
+    boxsize: str,
+    pre2boxsize: str,
+    paramfiles: list[str] | None = None,
+    filecache: cache.FileCache | None = None,
+    boxshape: str = "box",
+) -> None:
+    """make leap.in file to run tleap command.
+
+    Args:
+        paramfiles: names of frcmod/prep/mol2 files in the top directory loaded by leap.in.
+        boxshape: "oct"の場合、leap.parm7の切頂八面体のボックスを切り出す立方体の
+                  大きさに直し、入力サイズの最大値を一辺とする立方体と比べる。
+        filecache: If provided, leap.parm7, leap.rst7, leap.pdb and leap.log are
+                   hardlinked (or copied) from this cache when leap.in, pre2.pdb and
+                   the parameter files are the same as a previous run.
+    """
+    tleap_path = runner.find_command("tleap")
+
+    # tleapはdistdir/topの中で実行する。プロセス全体の作業ディレクトリは変更しない
+    topdir = os.path.join(distdir, "top")
+    leapinfile = os.path.join(topdir, "leap.in")
     if not os.path.isfile(leapinfile):
         raise FileNotFoundError(f"{leapinfile} was not found.")
-    outlogfile = "leap.log"
+    outlogfile = os.path.join(topdir, "leap.log")
     if os.path.isfile(outlogfile):
         os.remove(outlogfile)
-    cmd = [tleap_path, "-f", leapinfile]
-
-    logger.info(f"Launching subprocess {' '.join(cmd)}")
-    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    stdout, stderr = process.communicate()
-    retcode = process.wait()
-
-    if retcode:
-        print(stdout.decode())
-        print(stderr.decode())
-        os.chdir(cwd)
-        raise RuntimeError("tleap process failed.")
 
-    # leap終了時のボックスサイズを取得
-    result_boxsize = get_resultboxsize(outlogfile)
+    key = None
+    if filecache is not None:
+        key = _leap_cache_key(topdir, paramfiles or [], tleap_path)
+    if key is None or not filecache.restore(key, topdir, LEAP_OUTPUTS, link=True):
+        cmd = [tleap_path, "-f", "leap.in"]
+        runner.run_command(cmd, cwd=topdir)
+        if key is not None:
+            filecache.store(key, topdir, LEAP_OUTPUTS)
+
+    # leap終了時のボックスサイズをleap.parm7のBOX_DIMENSIONSから取得
+    parm = prmtop.Prmtop(os.path.join(topdir, "leap.parm7"))
+    logger.info(f"leap.parm7 has {parm.natom} atoms and {parm.nres} residues.")
+    box = parm.box_dimensions
+    if box is None:
+        raise RuntimeError(f"leap.parm7 has no periodic box. See {outlogfile}.")
+    result_boxsize = box[1:]
     if boxsize == "":
         inputsize = pre2boxsize.split()
     else:
         inputsize = boxsize.split()
+    if boxshape == "oct":
+        # solvateOctは等方的な箱(立方体)から切頂八面体を作る。
+        # 切頂八面体の格子ベクトルの長さは立方体の一辺の√3/2倍
+        inputsize = [max(float(x) for x in inputsize)] * 3
+        result_boxsize = result_boxsize * 2 / np.sqrt(3)
 
     if not (
         float(result_boxsize[0]) - float(inputsize[0]) < 5.0
         and float(result_boxsize[1]) - float(inputsize[1]) < 5.0
         and float(result_boxsize[2]) - float(inputsize[2]) < 5.0
     ):
-        print(f"Warning: Result box size is {result_boxsize}.")
-
-    # 作業ディレクトリの変更終了
-    os.chdir(cwd)
+        logger.warning(f"Result box size is {np.round(result_boxsize, 3)}.")
 
 
 def cys_to_cyx_in_pre2file(distdir: str, sslink_file: str) -> None:
     """
     すでに一度CYX残基がCYSに修正されたpre2.pdbファイルについて、sslinkに応じて再度
     該当残基をCYX残基にする操作
+    `preparepre2file`にsslink_fileを渡した場合は同じ処理が済んでいるので不要。
     """
     pre2file = os.path.join(distdir, "top", "pre2.pdb")
-    cyxresnums = []
-    with open(sslink_file) as f:
-        lines = [line.strip() for line in f.readlines()]
-        for line in lines:
-            cyxresnums.append(int(line.split()[0]))
-            cyxresnums.append(int(line.split()[1]))
-
-    with open(pre2file, "rt") as f:
-        lines = f.readlines()
-
-    outcontent = []
-    with open(pre2file, "wt") as f:
-        for line in lines:
-            if line.startswith("ATOM  "):
-                resnum = int(line[22:26])
-                if resnum in cyxresnums:
-                    if line[17:20] != "CYS":
-                        raise Exception(f"Residue {resnum} is not CYS residue.")
-                    else:
-                        line = line.replace("CYS", "CYX")
-            outcontent.append(line)
-        f.writelines(outcontent)
+    cyxresnums = pdbstream.read_sslink(sslink_file)
+    pdbstream.rewrite(pre2file, pre2file, [pdbstream.cys_to_cyx(cyxresnums)])
 
 
 def _get_residues_from_pdb(pdbfile: str) -> int:
@@ -419,8 +597,60 @@ def _get_residues_from_pdb(pdbfile: str) -> int:
     return resnum
 
 
+# --versionの応答を待つ時間(秒)
+VERSION_TIMEOUT = 60
+
+
+@functools.cache
+def _get_tool_version(path: str) -> str:
+    """Version string of an AmberTools command. Used as a part of cache keys."""
+    result = runner.run_command(
+        [path, "--version"], timeout=VERSION_TIMEOUT, check=False
+    )
+    version = (result.stdout + result.stderr).decode(errors="replace").strip()
+    if result.returncode or result.timed_out or version == "":
+        # バージョンが取得できない場合は実行ファイルの更新時刻で代用する
+        version = f"{path}:{os.stat(path).st_mtime_ns}"
+    return version
+
+
+def _file_stamp(path: str) -> str:
+    path = os.path.realpath(path)
+    stat = os.stat(path)
+    return f"{path}:{stat.st_size}:{stat.st_mtime_ns}"
+
+
+@functools.cache
+def _get_leap_version(tleap_path: str) -> str:
+    """Fingerprint of tleap used as a part of cache keys.
+
+    tleapは--versionを解釈せず対話モードで起動することがあるため実行しない。
+    代わりにtleap, teLeapの実体と$AMBERHOME/dat/leap以下のファイルの
+    パス・サイズ・更新時刻から求める。
+    """
+    bindir = os.path.dirname(os.path.realpath(tleap_path))
+    amberhome = os.environ.get("AMBERHOME") or os.path.dirname(bindir)
+    parts = [_file_stamp(tleap_path)]
+    teleap = shutil.which("teLeap") or os.path.join(bindir, "teLeap")
+    if os.path.isfile(teleap):
+        parts.append(_file_stamp(teleap))
+    datdir = os.path.join(amberhome, "dat", "leap")
+    for root, dirs, files in os.walk(datdir):
+        dirs.sort()
+        parts += [_file_stamp(os.path.join(root, name)) for name in sorted(files)]
+    return cache.make_key(*parts)
+
+
+# pdb4amberが出力するファイル群。キャッシュにはこれらを保存する
+PDB4AMBER_OUTPUTS = ["pre.pdb", "pre_sslink", "pre_nonprot.pdb", "pre_renum.txt"]
+
+
 def run_pdb4amber(
-    pdbfile_path: str, distdir: str, strip: str = "", sslink_file: str = ""
+    pdbfile_path: str,
+    distdir: str,
+    strip: str = "",
+    sslink_file: str = "",
+    filecache: cache.FileCache | None = None,
 ):
     """run pdb4amber command to obtain cleaned pdb and sslink files.
     pdb4amber is a command in AmberTools that prepares PDB files for MD simulations.
@@ -429,6 +659,8 @@ def run_pdb4amber(
 
     Args:
         pdbfile_path (str): input PDB file path to be processed by pdb4amber.
+                     mmCIF files (.cif, .mmcif) are converted in memory with gemmi.
+                     Their residues are renumbered from 1 in each chain.
         distdir (str): output directory. A "top" directory will be created inside this directory.
         strip (str): residue numbers to be excluded from the MD simulation in the input PDB file.
                      This should be specified using AMBER MASK syntax.
@@ -437,16 +669,15 @@ def run_pdb4amber(
         sslink_file (str): SS bond information file.
                      This is the file that contains the SS bond information generated by pdb4amber.
                      If provided, the SS link information in that file will be used preferentially.
+        filecache (FileCache): If provided, the outputs of pdb4amber are restored from
+                     this cache when the input file, the strip mask and the version of
+                     pdb4amber are the same as a previous run.
 
     Returns:
         resnum: pdb4amberを通して出てきた整形済みのpdbファイル。HIS->HIDまたはHIE, CYS -> CYXになっている
         sslink_file: pdb4amberを通して出てきたSS結合情報を格納したテキストファイル
     """
-    pdb4amber_path = shutil.which("pdb4amber")
-    if pdb4amber_path is None:
-        raise RuntimeError(
-            "pdb4amber command was not found. Make sure AmberTools was correctly installed."
-        )
+    pdb4amber_path = runner.find_command("pdb4amber")
 
     if not os.path.exists(os.path.join(distdir, "top")):
         os.makedirs(os.path.join(distdir, "top"))
@@ -458,16 +689,28 @@ def run_pdb4amber(
         strip += " | @H, H2, H3, HG"
     else:
         strip = "@H, H2, H3, HG"
-    cmd = [pdb4amber_path, "-i", pdbfile_path, "-o", outputfile, "-s", strip]
 
-    logger.info(f"Launching subprocess {' '.join(cmd)}")
-    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    _, stderr = process.communicate()
-    retcode = process.wait()
-
-    if retcode:
-        print(stderr)
-        raise RuntimeError("pdb4amber process failed.")
+    if not os.path.isfile(pdbfile_path):
+        raise FileNotFoundError(f"{pdbfile_path} was not found.")
+    # mmCIFファイルはgemmiでPDB形式に変換し、標準入力からpdb4amberに渡す
+    if mmcif.is_mmcif(pdbfile_path):
+        pdbtext = mmcif.mmcif_to_pdb_string(pdbfile_path).encode()
+        inputhash = cache.make_key("mmcif", pdbtext)
+        cmd = [pdb4amber_path, "-o", outputfile, "-s", strip]
+    else:
+        pdbtext = None
+        inputhash = cache.hash_file(pdbfile_path)
+        cmd = [pdb4amber_path, "-i", pdbfile_path, "-o", outputfile, "-s", strip]
+
+    # 入力ファイル・stripの値・pdb4amberのバージョンが同じならキャッシュを再利用する
+    key = None
+    if filecache is not None:
+        key = cache.make_key(inputhash, strip, _get_tool_version(pdb4amber_path))
+    topdir = os.path.join(distdir, "top")
+    if key is None or not filecache.restore(key, topdir, PDB4AMBER_OUTPUTS):
+        runner.run_command(cmd, input=pdbtext)
+        if key is not None:
+            filecache.store(key, topdir, PDB4AMBER_OUTPUTS)
 
     if sslink_file == "":
         sslink_file = os.path.join(distdir, "top", "pre_sslink")
@@ -475,6 +718,7 @@ def run_pdb4amber(
     if not os.path.isfile(sslink_file):
         raise FileNotFoundError(f"{sslink_file} file is not found.")
 
-    resnum = _get_residues_from_pdb(outputfile)
+    with profile.stage("count_residues"):
+        resnum = _get_residues_from_pdb(outputfile)
 
     return resnum, sslink_file
@@ -1,69 +1,269 @@
 import textwrap
 
+from preparemd.amber.md import namelist, timestep
 from preparemd.utils import header
 
+PRODUCTION_CNTRL = [
+    ("imin", 0, "Molecular dynamics"),
+    ("irest", 0, "DO NOT restart MD simulation from a previous run."),
+    ("ntx", 1, "Coordinates and velocities will not be read."),
+    ("dt", 0.002, "Timestep (ps)"),
+    ("nstlim", 25000000, "Number of MD steps"),
+    ("ntc", 2, "SHAKE on for bonds involving hydrogen atoms"),
+    ("ntf", 2, "No force evaluation for bonds with hydrogen"),
+    ("ig", -1, "Random seed for Langevin thermostat"),
+    ("cut", 10.0, "Nonbonded cutoff (Angstroms)"),
+    ("tol", 0.000001, "SHAKE tolerance"),
+    ("ntb", 2, "Constant pressure periodic boundary conditions"),
+    ("ntp", 1, "Isotropic pressure coupling"),
+    ("ntpr", 5000, "Print to mdout every ntpr steps"),
+    ("ntwr", 500000, 'Every ntwr steps during dynamics, the "restrt" file will be written'),
+    ("ntwx", 5000, "Write to trajectory file every ntwc steps"),
+    ("ntt", 3, "Langevin thermostat"),
+    ("gamma_ln", 2.0, "Collision frequency for thermostat"),
+    ("temp0", 300.0, "Simulation temperature (K)"),
+    ("ioutfm", 1, "Write binary NetCDF trajectory"),
+    ("iwrap", 1, 'the coordinates written to the restart and trajectory files will be "wrapped" into a primary box.'),
+    ("nmropt", 0, "turn on NMR restraints"),
+]  # fmt: skip  # noqa: E501
 
-def productioninput(restart_input: str, ns_per_box: int) -> str:
-    # set simulationtime to ns_per_box * 500000
-    simulationtime = ns_per_box * 500000
 
+def productionmdin(ns_per_box: int) -> namelist.Mdin:
+    """Base of the production md.in file, not restarted from a previous run."""
+    cntrl = namelist.Namelist("cntrl", [namelist.Entry(*e) for e in PRODUCTION_CNTRL])
+    # dt=0.002 psなので1 nsあたり500000ステップ
+    cntrl.set("nstlim", ns_per_box * 500000)
+    return namelist.Mdin(
+        "vt-continue",
+        [
+            cntrl,
+            namelist.Namelist(
+                "wt",
+                [namelist.Entry("type", "DUMPFREQ"), namelist.Entry("istep1", 5000)],
+            ),
+            namelist.Namelist("wt", [namelist.Entry("type", "END")]),
+        ],
+        trailer=["DISANG=dist1.rst", "DUMPAVE=dist1.dat"],
+        width=22,
+    )
+
+
+def set_restart(mdin: namelist.Mdin) -> namelist.Mdin:
+    """Read coordinates and velocities from the previous run (irest=1, ntx=5)."""
+    mdin.cntrl.set("irest", 1, "Restart MD simulation from a previous run.")
+    mdin.cntrl.set(
+        "ntx", 5, "Coordinates and velocities will be read from a previous run."
+    )
+    return mdin
+
+
+def set_velocities(mdin: namelist.Mdin, seed: int) -> namelist.Mdin:
+    """Assign new velocities from a Maxwellian distribution with the seed.
+
+    Used for the first segment of each replica, so that replicas started from
+    the same equilibrated structure follow independent trajectories.
+    """
+    cntrl = mdin.cntrl
+    cntrl.set("ig", seed, "Random seed for initial velocities and Langevin thermostat")
+    cntrl.set(
+        "tempi",
+        cntrl["temp0"],
+        "Initial velocities are assigned from a Maxwellian distribution at TEMPI K.",
+        before="temp0",
+    )
+    return mdin
+
+
+def replica_names(replicas: int) -> list[str]:
+    """rep01, rep02, ... (3 digits or more for over 99 replicas)"""
+    digits = max(2, len(str(replicas)))
+    return [f"rep{i:0{digits}d}" for i in range(1, replicas + 1)]
+
+
+def productioninput(
+    restart: bool, ns_per_box: int, overrides: dict | None = None, hmr: bool = False
+) -> str:
     """Template file for production md.in file."""
-    prod_template = textwrap.dedent("""\
-    vt-continue
-        &cntrl
-        imin=0,               ! Molecular dynamics
-        {restart_input}
-        dt=0.002,             ! Timestep (ps)
-        nstlim={simulationtime},      ! Number of MD steps
-        ntc=2,                ! SHAKE on for bonds involving hydrogen atoms
-        ntf=2,                ! No force evaluation for bonds with hydrogen
-        ig=-1,                ! Random seed for Langevin thermostat
-        cut=10.0,             ! Nonbonded cutoff (Angstroms)
-        tol=0.000001          ! SHAKE tolerance
-        ntb=2,                ! Constant pressure periodic boundary conditions
-        ntp=1,                ! Isotropic pressure coupling
-        ntpr=5000,            ! Print to mdout every ntpr steps
-        ntwr=500000,          ! Every ntwr steps during dynamics, the "restrt" file will be written
-        ntwx=5000,            ! Write to trajectory file every ntwc steps
-        ntt=3,                ! Langevin thermostat
-        gamma_ln=2.0,         ! Collision frequency for thermostat
-        temp0=300.0,          ! Simulation temperature (K)
-        ioutfm=1,             ! Write binary NetCDF trajectory
-        iwrap=1,              ! the coordinates written to the restart and trajectory files will be "wrapped" into a primary box.
-        nmropt=0,             ! turn on NMR restraints
-    /
-        &wt
-        type='DUMPFREQ', istep1=5000,
-    /
-        &wt type='END' /
-        DISANG=dist1.rst
-        DUMPAVE=dist1.dat
-    /
-    """).format(restart_input=restart_input, simulationtime=simulationtime)
-
-    return prod_template
-
-
-def runinput(prevrstfile: str, machineenv: str) -> str:
+    mdin = productionmdin(ns_per_box)
+    timestep.set_timestep(mdin, timestep.stage_dt(hmr))
+    if restart:
+        set_restart(mdin)
+    return mdin.apply(overrides, "production").render()
+
+
+# pr/NNN/run.shとtotalrun.shで使うbashの関数。セグメントのディレクトリ内で呼ぶ
+SEGMENT_FUNCTIONS = textwrap.dedent(
+    r"""
+    # rst7ファイルの時刻(ps)。壊れていて読めなければ何も出力しない
+    rst7_time() {
+        local t tmpdir
+        [ -s "$1" ] || return 1
+        if [ "$(head -c 3 "$1")" != CDF ]; then
+            sed -n 2p "$1" | awk 'NF >= 2 {print $2}'
+            return 0
+        fi
+        if command -v ncdump > /dev/null; then
+            t=$(ncdump -v time "$1" 2>/dev/null |
+                sed -n 's/^ *time = *\([-+0-9.eE]*\) *;.*/\1/p')
+        elif command -v cpptraj > /dev/null; then
+            # ncdumpがなければcpptrajでASCIIのrst7に変換して読む
+            tmpdir=$(mktemp -d)
+            cpptraj -p "${topfile}" -y "$1" -x "${tmpdir}/time.rst7" > /dev/null 2>&1 &&
+                t=$(sed -n 2p "${tmpdir}/time.rst7" | awk 'NF >= 2 {print $2}')
+            rm -rf "${tmpdir}"
+        fi
+        if [ -z "${t}" ]; then
+            echo "Warning: the time in $1 could not be read with ncdump or cpptraj." >&2
+            return 1
+        fi
+        echo "${t}"
+    }
+
+    # md.inの&cntrlの値(nstlim, dtなど)
+    mdin_value() {
+        sed 's/!.*//' "$1" | grep -io "\b$2 *= *[-+0-9.eE]*" | head -n 1 |
+            sed 's/.*= *//'
+    }
+
+    # $2から始めたmd.inのうち、md.rst7の時点までに終わったステップ数
+    steps_done() {
+        local t0 t1 dt
+        if [ "$(mdin_value "$1" irest)" = 1 ]; then
+            t0=$(rst7_time "$2")
+        else
+            # irest=0の場合、開始時刻はrst7ではなくtの値(デフォルト0)
+            t0=$(mdin_value "$1" t)
+            t0=${t0:-0.0}
+        fi
+        t1=$(rst7_time md.rst7)
+        [ -n "${t0}" ] && [ -n "${t1}" ] || return 1
+        dt=$(mdin_value "$1" dt)
+        awk -v t0="${t0}" -v t1="${t1}" -v dt="${dt:-0.002}" \
+            'BEGIN {printf "%d\n", (t1 - t0) / dt + 0.5}'
+    }
+
+    # md.outが最後のステップまで到達し、md.rst7がその時刻まで進んでいれば終了済み
+    segment_done() {
+        local mdin=md.in last
+        [ -f md.resume.in ] && mdin=md.resume.in
+        [ -f md.out ] && grep -q "Total wall time" md.out || return 1
+        last=$(grep -o "NSTEP = *[0-9]*" md.out | tail -n 1 | tr -dc '0-9')
+        [ "${last:-0}" -ge "$(mdin_value "${mdin}" nstlim)" ] || return 1
+        [ "$(steps_done md.in "$1")" = "$(mdin_value md.in nstlim)" ]
+    }
+
+    run_pmemd() {
+        pmemd.cuda_SPFP.MPI -O \
+            -i "$1" \
+            -o md.out \
+            -p "${topfile}" \
+            -c "$2" \
+            -r md.rst7 \
+            -ref "${topfile}"
+    }
+
+    # 途中で止まったセグメントを最後の周期的なrestart(ntwrステップごとのmd.rst7)
+    # から続けるためのmd.resume.inを作る。それまでのmdcrdとmd.outは番号をつけて残す
+    prepare_resume() {
+        local done prev nstlim ntwx k
+        [ -f md.out ] && done=$(steps_done md.in "$1") || return 1
+        nstlim=$(mdin_value md.in nstlim)
+        [ -n "${done}" ] && [ "${done}" -gt 0 ] && [ "${done}" -lt "${nstlim}" ] ||
+            return 1
+        prev=0
+        [ -f resume.steps ] && read -r prev resume_rst7 < resume.steps
+        k=1
+        while [ -e md.out.${k} ]; do k=$((k + 1)); done
+        mv md.out md.out.${k}
+        if [ "${done}" -le "${prev}" ]; then
+            # 前回の再開から新しいrestartが書かれる前に止まったので、同じ所から続ける
+            rm -f mdcrd
+            echo "Resume from step ${prev} of ${nstlim} again."
+            return 0
+        fi
+        resume_rst7=md.rst7.${k}
+        cp md.rst7 ${resume_rst7}
+        ntwx=$(mdin_value md.in ntwx)
+        if [ -f mdcrd ] && [ "${ntwx:-0}" -gt 0 ]; then
+            mv mdcrd mdcrd.${k}
+            # restartより後に書かれたフレームは捨てる
+            echo "mdcrd.${k} $(((done - prev) / ntwx))" >> resume.parts
+        fi
+        echo "${done} ${resume_rst7}" > resume.steps
+        sed -E -e "s/\b(nstlim *= *)[0-9]+/\1$((nstlim - done))/I" \
+            -e "s/\b(irest *= *)[0-9]+/\11/I" \
+            -e "s/\b(ntx *= *)[0-9]+/\15/I" md.in > md.resume.in
+        echo "Resume from step ${done} of ${nstlim}."
+    }
+
+    # 再開したセグメントのmdcrdをcpptrajで1つにつなげる
+    join_parts() {
+        [ -f resume.parts ] || return 0
+        {
+            echo "parm ${topfile}"
+            while read -r part frames; do
+                [ "${frames}" -gt 0 ] && echo "trajin ${part} 1 ${frames}"
+            done < resume.parts
+            echo "trajin mdcrd"
+            echo "trajout mdcrd.joined netcdf"
+            echo "go"
+        } > resume.cpptraj
+        cpptraj -i resume.cpptraj > resume.log && mv mdcrd.joined mdcrd || return 1
+        rm -f $(awk '{print $1}' resume.parts) md.rst7.[0-9]* resume.parts resume.cpptraj
+    }
+
+    run_segment() {
+        if segment_done "$1"; then
+            echo "$(basename "${PWD}") has already finished. Skip."
+            return 0
+        fi
+        if {resume_partial} && prepare_resume "$1"; then
+            run_pmemd md.resume.in "${resume_rst7}" || return $?
+            join_parts || return $?
+        else
+            rm -f md.resume.in resume.steps resume.parts mdcrd.[0-9]* md.rst7.[0-9]*
+            run_pmemd md.in "$1"
+        fi
+    }
+    """
+)
+
+
+def segmentfunctions(resume_partial: bool = False) -> str:
+    """bash functions to run a production segment (pr/NNN) unless it has finished.
+
+    終了済みのセグメント(md.outが最後のステップまで到達し、md.rst7がその時刻まで
+    進んでいるもの)は飛ばす。resume_partial=Trueの場合は、途中で止まった
+    セグメントを最後の周期的なrestartから続け、mdcrdをcpptrajでつなげる。
+    NetCDF形式のrst7の時刻はncdumpで読み、ncdumpがなければcpptrajで読む。
+    どちらでも読めない場合は警告を出し、そのセグメントは終了していないものとして扱う。
+    """
+    flag = "true" if resume_partial else "false"
+    return SEGMENT_FUNCTIONS.replace("{resume_partial}", flag)
+
+
+def runinput(
+    prevrstfile: str,
+    machineenv: str,
+    topfile: str = "../../../top/leap.parm7",
+    walltime: str = "",
+    resume_partial: bool = False,
+) -> str:
     """Template file for pr/00x/run.sh"""
 
-    qsub_template = header.queue_header(machineenv=machineenv)
-    run_template = qsub_template + textwrap.dedent(
-        """\
+    qsub_template = header.queue_header(machineenv=machineenv, walltime=walltime)
+    run_template = qsub_template + segmentfunctions(resume_partial)
+    run_template += textwrap.dedent(
+        """
             # トポロジーファイルの指定
-            topfile="../../../top/leap.parm7"
+            topfile="{topfile}"
             # 再開させたいrst7ファイルを指定
             rstfile="{prevrstfile}"
 
-            pmemd.cuda_SPFP.MPI -O \\
-                -i md.in \\
-                -o md.out \\
-                -p ${{topfile}} \\
-                -c ${{rstfile}} \\
-                -r md.rst7 \\
-                -ref ${{topfile}}
+            # 終了済みならpmemdを実行しない
+            run_segment ${{rstfile}}
 
-            """.format(prevrstfile=prevrstfile)
+            """.format(prevrstfile=prevrstfile, topfile=topfile)
     )
 
     return run_template
@@ -0,0 +1,184 @@
+"""Size production segments from the performance measured in the heat stage.
+
+pmemd writes the achieved performance to mdout and mdinfo files::
+
+    |     Average timings for all steps:
+    |     Elapsed(s) =      57.94 Per Step(ms) =       1.16
+    |         ns/day =     149.12   seconds/ns =     579.38
+
+The heat stages md2-md9 run NPT dynamics with the same time step as the
+production run, so their ns/day is used to choose nstlim and the number of
+segments so that each pr/NNN finishes within a fraction of the walltime.
+The heat stages use a shorter cutoff (8 A) than the production run (10 A), so
+the measured value is somewhat optimistic; the fraction leaves room for it.
+"""
+
+import math
+import os
+import re
+import statistics
+
+from preparemd.amber.md import mdout, namelist, production
+
+# md1はNVTで短く、初期化の時間が相対的に大きいため、md2-md9を優先して使う
+NPT_STAGES = range(2, 10)
+DEFAULT_FRACTION = 0.8
+
+
+def read_ns_per_day(path: str) -> float | None:
+    """ns/day in a pmemd mdout or mdinfo file.
+
+    The average over all steps is preferred. If the run has not finished yet,
+    the last reported value is used. Returns None if there is no timing.
+    """
+    return mdout.read_mdout(path).timings.get("ns/day")
+
+
+def measure_ns_per_day(heatdir: str) -> float:
+    """Median ns/day of the heat stages in heatdir.
+
+    For each md{i}, md{i}.out is read first and md{i}.info is used if the
+    mdout has no timing (e.g. the run is still going on).
+    """
+    values = {}
+    for i in range(1, 10):
+        for ext in ("out", "info"):
+            path = os.path.join(heatdir, f"md{i}.{ext}")
+            if os.path.isfile(path):
+                value = read_ns_per_day(path)
+                if value is not None:
+                    values[i] = value
+                    break
+    if not values:
+        raise FileNotFoundError(
+            f"No ns/day was found in md*.out or md*.info in {heatdir}. "
+            "Run the heat stage first."
+        )
+    npt = [v for i, v in values.items() if i in NPT_STAGES]
+    return statistics.median(npt or list(values.values()))
+
+
+def walltime_seconds(walltime: str) -> int:
+    """Seconds of "hh:mm:ss" or "d-hh:mm:ss"."""
+    days, _, hms = walltime.strip().rpartition("-")
+    parts = hms.split(":")
+    if (
+        len(parts) != 3
+        or not all(p.isdigit() for p in parts)
+        or (days != "" and not days.isdigit())
+    ):
+        raise ValueError(f'walltime must be "hh:mm:ss" or "d-hh:mm:ss": {walltime}')
+    h, m, s = (int(p) for p in parts)
+    return ((int(days or 0) * 24 + h) * 60 + m) * 60 + s
+
+
+def plan_segments(
+    total_ns: float,
+    ns_per_day: float,
+    walltime: str,
+    fraction: float = DEFAULT_FRACTION,
+    dt: float = 0.002,
+    step_unit: int = 5000,
+) -> dict:
+    """Number of segments and nstlim of each segment.
+
+    Args:
+        total_ns: 全セグメントを合わせたシミュレーション時間(ns)。
+        ns_per_day: 1日あたりに進むシミュレーション時間(ns)。
+        walltime: 1セグメントあたりのジョブの実行時間の上限("hh:mm:ss")。
+        fraction: 1セグメントに使うwalltimeの割合。残りは起動や書き出しの余裕。
+        dt: タイムステップ(ps)。
+        step_unit: nstlimはこの倍数にする(ntpr, ntwxの最小公倍数)。
+
+    Returns:
+        dict: segments, nstlim, ns_per_segment (ns), hours (expected hours per
+            segment) and total_ns (actually simulated, >= total_ns).
+    """
+    if total_ns <= 0 or ns_per_day <= 0 or dt <= 0:
+        raise ValueError("total_ns, ns_per_day and dt must be positive.")
+    if not 0 < fraction <= 1:
+        raise ValueError("fraction must be in (0, 1].")
+    steps_per_ns = 1000.0 / dt
+    seconds = walltime_seconds(walltime) * fraction
+    max_steps = (
+        int(ns_per_day * seconds / 86400 * steps_per_ns) // step_unit * step_unit
+    )
+    if max_steps == 0:
+        raise ValueError(
+            f"The walltime {walltime} is too short for {step_unit} steps "
+            f"at {ns_per_day} ns/day."
+        )
+    total_steps = math.ceil(total_ns * steps_per_ns)
+    segments = math.ceil(total_steps / max_steps)
+    # 同じ数のセグメントのままnstlimを均等にし、最後のセグメントだけが短くならないようにする
+    nstlim = math.ceil(total_steps / segments / step_unit) * step_unit
+    ns_per_segment = nstlim / steps_per_ns
+    return {
+        "segments": segments,
+        "nstlim": nstlim,
+        "ns_per_segment": ns_per_segment,
+        "hours": ns_per_segment / ns_per_day * 24,
+        "total_ns": ns_per_segment * segments,
+    }
+
+
+def production_dirs(amberdir: str, replicas: int = 0) -> list[str]:
+    """Production directories (pr or repNN/pr) relative to amberdir."""
+    if replicas > 0:
+        return [os.path.join(name, "pr") for name in production.replica_names(replicas)]
+    return ["pr"]
+
+
+def generated_segments(amberdir: str) -> int | None:
+    """Number of segments that totalrun.sh runs (`seq 1 N`), or None if unknown.
+
+    縮小後に残った古いセグメント(使われなくなったpr/NNN)は数えない。
+    """
+    path = os.path.join(amberdir, "totalrun.sh")
+    if not os.path.isfile(path):
+        return None
+    with open(path) as f:
+        match = re.search(r"`seq 1 (\d+)`", f.read())
+    return int(match.group(1)) if match else None
+
+
+def current_total_ns(prdir: str, segments: int | None = None) -> float:
+    """Total ns of the segments 001, 002, ... in prdir.
+
+    segments (`generated_segments`) が与えられた場合は001からその数までを合計し、
+    足りないセグメントがあればFileNotFoundErrorを送出する。Noneの場合は
+    連続して存在するセグメントを合計する。
+    """
+    total, i = 0.0, 1
+    while segments is None or i <= segments:
+        mdfile = os.path.join(prdir, str(i).zfill(3), "md.in")
+        if not os.path.isfile(mdfile):
+            if segments is not None:
+                raise FileNotFoundError(f"{mdfile} was not found.")
+            break
+        cntrl = namelist.read_mdin(mdfile).cntrl
+        total += cntrl["nstlim"] * cntrl["dt"] / 1000
+        i += 1
+    if i == 1:
+        raise FileNotFoundError(f"No production segment was found in {prdir}.")
+    return total
+
+
+def started_segments(amberdir: str, replicas: int = 0) -> list[str]:
+    """Production segments that have an md.out, i.e. have already been run."""
+    started = []
+    for prdir in production_dirs(amberdir, replicas):
+        path = os.path.join(amberdir, prdir)
+        if not os.path.isdir(path):
+            continue
+        for name in sorted(os.listdir(path)):
+            if os.path.isfile(os.path.join(path, name, "md.out")):
+                started.append(os.path.join(prdir, name))
+    return started
+
+
+def step_unit(mdin: namelist.Mdin) -> int:
+    """Least common multiple of ntpr and ntwx of an md.in (nstlim is its multiple)."""
+    cntrl = mdin.cntrl
+    values = [int(cntrl[key]) for key in ("ntpr", "ntwx") if key in cntrl]
+    return math.lcm(*[v for v in values if v > 0]) if values else 1
@@ -0,0 +1,146 @@
+import textwrap
+
+from preparemd.amber.md import production
+from preparemd.utils import header
+
+SUBMIT_MODES = ("chain", "array")
+
+# submit <ディレクトリ> <スクリプト> [依存するジョブID]
+# ジョブIDだけを標準出力に書き出す
+SUBMIT_FUNCTIONS = {
+    "slurm": textwrap.dedent(
+        """\
+        submit() {
+            local jid
+            jid=$(cd "$1" && sbatch --parsable ${3:+-d afterok:$3} "${@:4}" "$2")
+            echo "${jid%%;*}"
+        }
+        """
+    ),
+    "pbs": textwrap.dedent(
+        """\
+        submit() {
+            (cd "$1" && qsub ${3:+-W depend=afterok:$3} "$2")
+        }
+        """
+    ),
+    # PJMではステップジョブとして投入する。前のステップが異常終了した場合は
+    # 残りのステップをすべてキャンセルする
+    "pjm": textwrap.dedent(
+        """\
+        submit() {
+            if [ -z "$3" ]; then
+                (cd "$1" && pjsub -z jid --step "$2")
+            else
+                (cd "$1" && pjsub -z jid --step --sparam "jid=${3%%_*},sd=ec!=0:all" "$2")
+            fi
+        }
+        """  # noqa: E501
+    ),
+}
+
+
+def _segments(box: int) -> str:
+    return " ".join(str(i).zfill(3) for i in range(1, box + 1))
+
+
+def check_submit(machineenv: str, replicas: int, mode: str) -> None:
+    """Raise ValueError if the submit mode cannot be used."""
+    if mode not in SUBMIT_MODES:
+        raise ValueError(f"Unknown submit mode {mode}. Choose from chain or array.")
+    scheduler = header.SCHEDULERS.get(machineenv)
+    if scheduler is None:
+        raise ValueError(f"Job submission is not supported for {machineenv}.")
+    if mode == "array" and (scheduler != "slurm" or replicas == 0):
+        raise ValueError("Job arrays are supported only for replicas on SLURM.")
+
+
+def submitscript(
+    machineenv: str, box: int, replicas: int = 0, mode: str = "chain"
+) -> str:
+    """Content of amber/submit.sh.
+
+    minimize -> heat -> pr/001 -> pr/002 -> ... を別々のジョブとして、前のジョブが
+    正常終了した後に実行されるよう依存関係をつけて投入する。各ジョブは1セグメント分の
+    実行時間だけを要求すればよいので、混雑したクラスタでもbackfillされやすい。
+
+    Args:
+        machineenv: 計算機環境。SLURM (foodin), PJM (flow), PBS (yayoi)に対応する。
+        box: production runのセグメント数。
+        replicas: レプリカ数。0の場合はamber/prを使う。
+        mode: "chain"は各レプリカのセグメントを依存関係でつなぐ。"array"は各セグメントを
+              レプリカを要素とするジョブ配列として投入する(SLURMのみ)。
+              配列の各要素は前のセグメントの同じ要素が終わった後に始まる(aftercorr)。
+    """
+    check_submit(machineenv, replicas, mode)
+    scheduler = header.SCHEDULERS[machineenv]
+
+    content = textwrap.dedent(
+        """\
+        #!/bin/bash
+        # minimize -> heat -> production runの各セグメントを、前のジョブが正常終了した後に
+        # 実行されるジョブとして投入する。
+        set -e
+        cd "$(dirname "$0")"
+
+        """
+    )
+    content += SUBMIT_FUNCTIONS[scheduler]
+    content += textwrap.dedent(
+        """
+        jid=$(submit minimize run.sh)
+        echo "minimize: ${jid}"
+        jid=$(submit heat run.sh ${jid})
+        echo "heat: ${jid}"
+        heatjid=${jid}
+        """
+    )
+    if mode == "array":
+        content += textwrap.dedent(
+            """\
+            dependency="afterok"
+            for j in {segments}; do
+                jid=$(submit . pr_array.sh "" --array=1-{replicas} \\
+                    -d ${{dependency}}:${{jid}} --export=ALL,SEGMENT=${{j}})
+                echo "pr/${{j}} (rep01-{last}): ${{jid}}"
+                dependency="aftercorr"
+            done
+            """
+        ).format(
+            segments=_segments(box),
+            replicas=replicas,
+            last=production.replica_names(replicas)[-1],
+        )
+        return content
+
+    if replicas > 0:
+        prdirs = [f"{name}/pr" for name in production.replica_names(replicas)]
+    else:
+        prdirs = ["pr"]
+    # PJMのステップジョブは分岐できないので、全レプリカを1本の鎖にする
+    branch = "" if scheduler == "pjm" else "    jid=${heatjid}\n"
+    content += textwrap.dedent(
+        """\
+        for prdir in {prdirs}; do
+        {branch}    for j in {segments}; do
+                jid=$(submit ${{prdir}}/${{j}} run.sh ${{jid}})
+                echo "${{prdir}}/${{j}}: ${{jid}}"
+            done
+        done
+        """
+    ).format(prdirs=" ".join(prdirs), branch=branch, segments=_segments(box))
+    return content
+
+
+def arrayscript(machineenv: str, replicas: int, walltime: str = "") -> str:
+    """Content of amber/pr_array.sh: run one segment of one replica.
+    SLURM_ARRAY_TASK_IDがレプリカの番号、SEGMENTがセグメント(001, 002, ...)。
+    """
+    digits = len(production.replica_names(replicas)[0]) - len("rep")
+    return header.queue_header(machineenv, walltime=walltime) + textwrap.dedent(
+        """\
+        rep=$(printf "rep%0{digits}d" "${{SLURM_ARRAY_TASK_ID}}")
+        cd ${{rep}}/pr/${{SEGMENT}} || exit 1
+        bash run.sh
+        """
+    ).format(digits=digits)
@@ -0,0 +1,53 @@
+"""Timestep of the MD stages.
+
+With hydrogen mass repartitioning (HMR, see
+`preparemd.amber.top.prmtop.repartition_hydrogen_mass`) the heat and
+production stages can use a 4 fs timestep instead of 2 fs. The numbers of
+steps in the mdin files are rescaled so that the simulated times and the
+output intervals stay the same.
+"""
+
+from preparemd.amber.md import namelist
+
+DEFAULT_DT = 0.002
+HMR_DT = 0.004
+# ステップ数で時間を表す&cntrlの値
+STEP_KEYS = ("nstlim", "ntpr", "ntwx", "ntwr", "ntwe", "ntwv", "ntave", "nscm")
+# &wtのステップ数
+WT_STEP_KEYS = ("istep1", "istep2")
+
+
+def _rescale(value: int, factor: float) -> int:
+    if value == 0:
+        return 0
+    scaled = max(1, round(abs(value) * factor))
+    return scaled if value > 0 else -scaled
+
+
+def set_timestep(mdin: namelist.Mdin, dt: float) -> namelist.Mdin:
+    """Change dt of the mdin and rescale the numbers of steps.
+
+    nstlim, ntpr, ntwx, ntwrなどと&wtのistep1, istep2を、同じ時間(ps)になるよう
+    dtの比で変える。負の値(ntwr<0など)は符号を保つ。
+    """
+    cntrl = mdin.cntrl
+    old = cntrl["dt"] if "dt" in cntrl else DEFAULT_DT
+    if old == dt:
+        return mdin
+    factor = old / dt
+    cntrl.set("dt", dt)
+    for key in STEP_KEYS:
+        if key in cntrl:
+            cntrl.set(key, _rescale(cntrl[key], factor))
+    for nml in mdin.namelists:
+        if nml.name.lower() != "wt":
+            continue
+        for key in WT_STEP_KEYS:
+            if key in nml:
+                nml.set(key, _rescale(nml[key], factor))
+    return mdin
+
+
+def stage_dt(hmr: bool) -> float:
+    """dt of the heat and production stages."""
+    return HMR_DT if hmr else DEFAULT_DT
@@ -1,34 +1,31 @@
 import os
 import textwrap
 
+from preparemd.amber.md import production
+from preparemd.amber.top import prmtop
+from preparemd.utils import manifest
 
-def writetrajfix(
-    distdir: str, resnumber: int, num_mddir: int, suffix: str = ""
-) -> None:
-    """Write trajfix.in file in amber/pr directory.
+
+def trajfixcontent(
+    resnumber: int,
+    trajins: list[str],
+    reference: str,
+    suffix: str = "",
+    step: int = 50,
+) -> str:
+    """Content of a cpptraj script that fixes and joins trajectories.
 
     Args:
-        distdir: 出力先のディレクトリ名。この中にamber, topディレクトリが作られる
-                 ことを想定する。
-        resnumber: 系に存在する残基数。position restraintsをかける対象の原子の
-                   残基範囲と一致する。
-        num_mddir: 上記のサブディレクトリにつき、何nsのシミュレーションを行うか。
-        suffix: 出力トラジェクトリにつけるサフィックス。デフォルトは""。
+        trajins: 結合するトラジェクトリのパス(スクリプトのあるディレクトリからの相対パス)。
+        reference: leap.rst7への相対パス。
     """
+    trajinpart = "".join(f"trajin {trajin} 1 last {step}\n" for trajin in trajins)
 
-    trajfixfile = os.path.join(distdir, "amber", "pr", "trajfix.in")
-    STEP = 50
-    trajinpart = ""
-    for i in range(1, num_mddir + 1):
-        # box_zeroはboxを桁数指定で0埋めしたもの
-        box_zero = str(i).zfill(3)
-        trajinpart += f"trajin {box_zero}/mdcrd 1 last {STEP}\n"
-
-    trajfix_content = textwrap.dedent(
+    return textwrap.dedent(
         """\
             ## 1段階目のtrajin処理。
-            trajin 001/mdcrd 1 1 1
-            reference ../../top/leap.rst7
+            trajin {first} 1 1 1
+            reference {reference}
             unwrap :1-{resnumber}
             center :1-{resnumber}@CA mass origin
             rms first out rmsd.dat @CA
@@ -48,6 +45,257 @@ def writetrajfix(
             trajout {suffix}traj.trr
             go
         """
-    ).format(resnumber=resnumber, suffix=suffix, trajinpart=trajinpart)
-    with open(trajfixfile, mode="w") as f:
-        f.write(trajfix_content)
+    ).format(
+        resnumber=resnumber,
+        suffix=suffix,
+        trajinpart=trajinpart,
+        first=trajins[0],
+        reference=reference,
+    )
+
+
+def segmentcontent(
+    resnumber: int, trajin: str, reference: str, output: str, step: int = 50
+) -> str:
+    """Content of a cpptraj script that fixes one segment for `mergecontent`.
+
+    unwrapの基準(reference)には、そのセグメントの直前のrestart(001なら
+    heat/md9.rst7、それ以外は前のセグメントのmd.rst7)を使う。これらは後処理の
+    前にすべて揃っているので、セグメントごとに独立して実行できる。
+    leap.rst7のように離れた時刻の構造を基準にすると、溶質が回転・拡散した後は
+    分子が別々のイメージに分かれてしまう。rmsは結合時にまとめて行う。
+    """
+    return textwrap.dedent(
+        """\
+            trajin {trajin} 1 last {step}
+            reference {reference}
+            unwrap :1-{resnumber} reference
+            center :1-{resnumber}@CA mass origin
+            strip :SOD,WAT,TIP3,Cl-,Na+
+            trajout {output} netcdf
+            go
+        """
+    ).format(
+        resnumber=resnumber,
+        trajin=trajin,
+        step=step,
+        reference=reference,
+        output=output,
+    )
+
+
+def initcontent(resnumber: int, trajin: str, reference: str, suffix: str = "") -> str:
+    """Content of a cpptraj script that writes {suffix}init.pdb.
+
+    referenceは最初のセグメントの直前のrestart(heat/md9.rst7)。
+    """
+    return textwrap.dedent(
+        """\
+            trajin {trajin} 1 1 1
+            reference {reference}
+            unwrap :1-{resnumber} reference
+            center :1-{resnumber}@CA mass origin
+            strip :SOD,WAT,TIP3,Cl-,Na+
+            trajout {suffix}init.pdb pdb nobox
+            go
+        """
+    ).format(resnumber=resnumber, trajin=trajin, reference=reference, suffix=suffix)
+
+
+def mergecontent(
+    fixed: list[str], init_pdb: str, suffix: str = "", rmsdfile: str = "rmsd.dat"
+) -> str:
+    """Content of a cpptraj script that joins the fixed segments in order.
+
+    各フレームをinit.pdb(最初のセグメントの最初のフレーム)に重ねる。
+    """
+    trajinpart = "".join(f"trajin {path} parm {init_pdb}\n" for path in fixed)
+    return textwrap.dedent(
+        """\
+            parm {init_pdb}
+            reference {init_pdb} parm {init_pdb}
+            {trajinpart}
+            rms reference out {rmsdfile} @CA
+            trajout {suffix}traj.trr
+            go
+        """
+    ).format(init_pdb=init_pdb, trajinpart=trajinpart, rmsdfile=rmsdfile, suffix=suffix)
+
+
+def runnercontent(num_mddir: int, parm: str) -> str:
+    """Content of pr/trajfix.sh that runs the scripts in pr/trajfix.
+
+    Usage:
+        bash trajfix.sh [jobs]: init.pdbと各セグメントをjobs並列(デフォルトは
+            コア数)で処理し、最後に結合する。
+        bash trajfix.sh segment N: N番目のセグメントだけを処理する。ジョブ配列の
+            番号はSLURM_ARRAY_TASK_ID, PBS_ARRAY_INDEXから読む。
+        bash trajfix.sh merge: init.pdbを書き出してセグメントを結合する。
+    """
+    segments = " ".join(str(i).zfill(3) for i in range(1, num_mddir + 1))
+    return textwrap.dedent(
+        """\
+            #!/bin/bash
+            # 各セグメントのトラジェクトリを独立に処理してから、順番通りに結合する。
+            #   bash trajfix.sh [並列数]      ローカルで並列に処理して結合する
+            #   sbatch --array=1-{last} trajfix.sh segment
+            #   sbatch -d afterok:<jobid> trajfix.sh merge
+            set -e
+            cd "${{SLURM_SUBMIT_DIR:-${{PBS_O_WORKDIR:-$(dirname "$0")}}}}"
+            parm=${{parm:-{parm}}}
+            segments="{segments}"
+
+            run() {{
+                cpptraj -p "${{parm}}" -i "trajfix/$1.in" > "trajfix/$1.log"
+            }}
+
+            case "$1" in
+            segment)
+                index=${{2:-${{SLURM_ARRAY_TASK_ID:-${{PBS_ARRAY_INDEX}}}}}}
+                run "$(printf "%03d" "${{index}}")"
+                ;;
+            merge)
+                run init
+                run merge
+                ;;
+            *)
+                export -f run
+                export parm
+                echo ${{segments}} | tr " " "\\n" | xargs -P "${{1:-$(nproc)}}" -I{{}} \\
+                    bash -c 'run {{}}'
+                run init
+                run merge
+                ;;
+            esac
+        """
+    ).format(segments=segments, last=num_mddir, parm=parm)
+
+
+def write_parallel(
+    prdir: str,
+    resnumber: int,
+    num_mddir: int,
+    topdir: str,
+    heatdir: str,
+    suffix: str = "",
+    filemanifest: manifest.Manifest | None = None,
+) -> list[str]:
+    """Write pr/trajfix/{NNN,init,merge}.in and pr/trajfix.sh.
+
+    Args:
+        topdir: prdirからtopディレクトリへの相対パス。
+        heatdir: prdirからheatディレクトリへの相対パス。001のunwrapの基準には
+                 heat/md9.rst7を使う。
+
+    Returns:
+        list[str]: The fixed segments (pr/trajfix/NNN.nc) relative to prdir.
+    """
+    first_reference = f"{heatdir}/md9.rst7"
+    fixed = []
+    for i in range(1, num_mddir + 1):
+        segment = str(i).zfill(3)
+        output = f"trajfix/{segment}.nc"
+        # 直前のrestartをunwrapの基準にする
+        reference = first_reference if i == 1 else f"{str(i - 1).zfill(3)}/md.rst7"
+        content = segmentcontent(resnumber, f"{segment}/mdcrd", reference, output)
+        manifest.write_file(
+            os.path.join(prdir, "trajfix", f"{segment}.in"), content, filemanifest
+        )
+        fixed.append(output)
+    content = initcontent(resnumber, "001/mdcrd", first_reference, suffix)
+    manifest.write_file(
+        os.path.join(prdir, "trajfix", "init.in"), content, filemanifest
+    )
+    content = mergecontent(fixed, f"{suffix}init.pdb", suffix)
+    manifest.write_file(
+        os.path.join(prdir, "trajfix", "merge.in"), content, filemanifest
+    )
+    manifest.write_file(
+        os.path.join(prdir, "trajfix.sh"),
+        runnercontent(num_mddir, f"{topdir}/leap.parm7"),
+        filemanifest,
+        executable=True,
+    )
+    return fixed
+
+
+def writetrajfix(
+    distdir: str,
+    resnumber: int,
+    num_mddir: int,
+    suffix: str = "",
+    filemanifest: manifest.Manifest | None = None,
+    replicas: int = 0,
+    parallel: bool = False,
+) -> None:
+    """Write trajfix.in file in amber/pr directory.
+
+    Args:
+        distdir: 出力先のディレクトリ名。この中にamber, topディレクトリが作られる
+                 ことを想定する。
+        resnumber: 系に存在する残基数。position restraintsをかける対象の原子の
+                   残基範囲と一致する。0の場合はtop/leap.parm7から溶質(最初の
+                   水・イオンより前)の残基数を読む。
+        num_mddir: 上記のサブディレクトリにつき、何nsのシミュレーションを行うか。
+        suffix: 出力トラジェクトリにつけるサフィックス。デフォルトは""。
+        filemanifest: 生成ファイルの記録。内容が変わらない場合は書き直さない。
+        replicas: 1以上の場合、各レプリカのamber/repNN/pr/trajfix.inと、それらが
+                  書き出したトラジェクトリを結合するだけのamber/trajfix_pooled.inを
+                  書き出す。
+        parallel: Trueの場合、trajfix.inの代わりにセグメントごとに独立して実行できる
+                  pr/trajfix/NNN.inと、それらを結合するpr/trajfix/merge.in、
+                  実行用のpr/trajfix.shを書き出す。
+    """
+    if resnumber <= 0:
+        parmfile = os.path.join(distdir, "top", "leap.parm7")
+        resnumber = prmtop.Prmtop(parmfile).solute_residues()
+    segments = [f"{str(i).zfill(3)}/mdcrd" for i in range(1, num_mddir + 1)]
+    if replicas == 0 and parallel:
+        prdir = os.path.join(distdir, "amber", "pr")
+        write_parallel(
+            prdir, resnumber, num_mddir, "../../top", "../heat", suffix, filemanifest
+        )
+        return
+    if replicas == 0:
+        trajfixfile = os.path.join(distdir, "amber", "pr", "trajfix.in")
+        content = trajfixcontent(resnumber, segments, "../../top/leap.rst7", suffix)
+        manifest.write_file(trajfixfile, content, filemanifest)
+        return
+
+    pooled = []
+    if parallel:
+        for name in production.replica_names(replicas):
+            prdir = os.path.join(distdir, "amber", name, "pr")
+            fixed = write_parallel(
+                prdir,
+                resnumber,
+                num_mddir,
+                "../../../top",
+                "../../heat",
+                suffix,
+                filemanifest,
+            )
+            pooled += [f"{name}/pr/{path}" for path in fixed]
+        # 各レプリカのtrajfix.shを実行した後に、amberディレクトリで実行する
+        first = production.replica_names(replicas)[0]
+        content = mergecontent(
+            pooled, f"{first}/pr/{suffix}init.pdb", f"{suffix}pooled_"
+        )
+        manifest.write_file(
+            os.path.join(distdir, "amber", "trajfix_pooled.in"), content, filemanifest
+        )
+        return
+
+    for name in production.replica_names(replicas):
+        trajfixfile = os.path.join(distdir, "amber", name, "pr", "trajfix.in")
+        content = trajfixcontent(resnumber, segments, "../../../top/leap.rst7", suffix)
+        manifest.write_file(trajfixfile, content, filemanifest)
+        pooled.append(f"{name}/pr/{suffix}traj.trr")
+
+    # 各レプリカのtrajfix.inで処理したトラジェクトリを1つにまとめる。
+    # レプリカは独立なトラジェクトリなので、レプリカをまたいでunwrapしてはならない。
+    # 各レプリカのtrajfix.inを実行した後に、amberディレクトリで実行する
+    first = production.replica_names(replicas)[0]
+    content = mergecontent(pooled, f"{first}/pr/{suffix}init.pdb", f"{suffix}pooled_")
+    trajfixfile = os.path.join(distdir, "amber", "trajfix_pooled.in")
+    manifest.write_file(trajfixfile, content, filemanifest)
@@ -0,0 +1,212 @@
+import numpy as np
+
+# cpptrajの"box auto"と同様に、原子の半径を含めてボックスの大きさを決める
+ELEMENT_RADII = {"H": 1.2, "C": 1.7, "N": 1.55, "O": 1.52, "S": 1.8, "P": 1.8}
+DEFAULT_RADIUS = 1.5
+# tleapのsolvateBoxで溶質の周りにとる余白(Å)
+SOLVENT_MARGIN = 10.0
+# 300 Kの水の数密度(molecules/Å^3)
+WATER_DENSITY = 0.0334
+# 自動回転の局所探索で試す回転角(度)。粗いものから順に細かくする
+ROTATION_STEPS = (30.0, 10.0, 3.0, 1.0, 0.3)
+
+
+def atom_radius(element: str) -> float:
+    """Approximate van der Waals radius of an element."""
+    return ELEMENT_RADII.get(element.strip().capitalize(), DEFAULT_RADIUS)
+
+
+def rotation_matrix(axis: str, degree: float) -> np.ndarray:
+    """Rotation matrix around x, y or z axis (right-handed, degree)."""
+    theta = np.deg2rad(degree)
+    c, s = np.cos(theta), np.sin(theta)
+    if axis == "x":
+        return np.array([[1.0, 0.0, 0.0], [0.0, c, -s], [0.0, s, c]])
+    elif axis == "y":
+        return np.array([[c, 0.0, s], [0.0, 1.0, 0.0], [-s, 0.0, c]])
+    elif axis == "z":
+        return np.array([[c, -s, 0.0], [s, c, 0.0], [0.0, 0.0, 1.0]])
+    raise ValueError(f"Unknown rotation axis: {axis}")
+
+
+def parse_rotate(rotate: str) -> np.ndarray:
+    """Convert a cpptraj-style rotate string to a rotation matrix.
+
+    Both "rotate z 45" and "x 90 y 30" are accepted. As in the cpptraj
+    `rotate` action, the rotations are applied around x, y and z in this order
+    regardless of the written order (matrix = Rz @ Ry @ Rx).
+    Each axis can be given only once.
+    """
+    tokens = rotate.split()
+    if len(tokens) > 0 and tokens[0] == "rotate":
+        tokens = tokens[1:]
+    if len(tokens) % 2 != 0:
+        raise ValueError(f'Invalid rotate argument: "{rotate}"')
+
+    degrees = {}
+    for axis, degree in zip(tokens[0::2], tokens[1::2], strict=True):
+        axis = axis.lower()
+        if axis not in ("x", "y", "z"):
+            raise ValueError(f"Unknown rotation axis: {axis}")
+        if axis in degrees:
+            raise ValueError(f'The {axis} axis is repeated in "{rotate}"')
+        try:
+            degrees[axis] = float(degree)
+        except ValueError as e:
+            raise ValueError(f'Invalid rotate argument: "{rotate}"') from e
+
+    matrix = np.identity(3)
+    for axis in ("x", "y", "z"):
+        if axis in degrees:
+            matrix = rotation_matrix(axis, degrees[axis]) @ matrix
+    return matrix
+
+
+def rotate_string(matrix: np.ndarray, decimals: int = 3) -> str:
+    """Convert a rotation matrix to a rotate string such as "x 10 y 20 z 30".
+
+    The inverse of `parse_rotate` (matrix = Rz @ Ry @ Rx).
+    """
+    beta = np.arcsin(np.clip(-matrix[2, 0], -1.0, 1.0))
+    alpha = np.arctan2(matrix[2, 1], matrix[2, 2])
+    gamma = np.arctan2(matrix[1, 0], matrix[0, 0])
+    degrees = np.round(np.rad2deg([alpha, beta, gamma]), decimals) + 0.0
+    return " ".join(f"{axis} {d:g}" for axis, d in zip("xyz", degrees, strict=True))
+
+
+def bounding_box(coords: np.ndarray, radii: np.ndarray | None = None) -> np.ndarray:
+    """Lengths of the axis-aligned bounding box of (N, 3) coordinates.
+    If radii are given, the box encloses the spheres of the atoms."""
+    if len(coords) == 0:
+        raise ValueError("No coordinates were found.")
+    if radii is None:
+        radii = np.zeros(len(coords))
+    radii = radii.reshape(-1, 1)
+    return (coords + radii).max(axis=0) - (coords - radii).min(axis=0)
+
+
+def padded_volume(
+    coords: np.ndarray,
+    radii: np.ndarray | None = None,
+    rotation: np.ndarray | None = None,
+    margin: float = SOLVENT_MARGIN,
+    isometric: bool = False,
+) -> float:
+    """Volume of the bounding box of the rotated coordinates plus the margin on
+    each side. If isometric is True, the volume of the cube whose edge is the
+    longest side (solvateOct cuts the truncated octahedron from this cube)."""
+    if rotation is not None:
+        coords = coords @ rotation.T
+    box = bounding_box(coords, radii) + 2 * margin
+    if isometric:
+        return float(box.max() ** 3)
+    return float(np.prod(box))
+
+
+def principal_axes(coords: np.ndarray) -> np.ndarray:
+    """Rotation matrix whose rows are the principal axes of the coordinates,
+    the axis with the largest spread first."""
+    centered = coords - coords.mean(axis=0)
+    _, vectors = np.linalg.eigh(centered.T @ centered)
+    axes = vectors[:, ::-1].T.copy()
+    # 右手系にする
+    if np.linalg.det(axes) < 0:
+        axes[2] *= -1
+    return axes
+
+
+def minimum_volume_rotation(
+    coords: np.ndarray,
+    radii: np.ndarray | None = None,
+    margin: float = SOLVENT_MARGIN,
+    isometric: bool = False,
+    steps: tuple[float, ...] = ROTATION_STEPS,
+) -> np.ndarray:
+    """Rotation that minimizes the volume of the solvated box.
+
+    The search starts from both the original orientation and the principal axes,
+    and the better one is refined by rotating around x, y and z with decreasing
+    angles while the volume decreases. The result is never worse than the
+    original orientation.
+    """
+    coords = coords - coords.mean(axis=0)
+
+    def volume(rotation: np.ndarray) -> float:
+        return padded_volume(coords, radii, rotation, margin, isometric)
+
+    best = min([np.identity(3), principal_axes(coords)], key=volume)
+    best_volume = volume(best)
+    for step in steps:
+        improved = True
+        while improved:
+            improved = False
+            for axis in "xyz":
+                for degree in (step, -step):
+                    trial = rotation_matrix(axis, degree) @ best
+                    trial_volume = volume(trial)
+                    if trial_volume < best_volume * (1 - 1e-9):
+                        best, best_volume, improved = trial, trial_volume, True
+    return best
+
+
+def center_and_rotate(
+    coords: np.ndarray, anchor: np.ndarray, rotation: np.ndarray | None = None
+) -> np.ndarray:
+    """Move the geometric center of the anchor atoms to the origin and rotate
+    the coordinates around the origin.
+
+    Args:
+        coords: (N, 3) coordinates.
+        anchor: boolean mask of the anchor atoms (e.g. CA atoms).
+                All atoms are used if no atom is selected.
+        rotation: (3, 3) rotation matrix.
+    """
+    center = coords[anchor].mean(axis=0) if anchor.any() else coords.mean(axis=0)
+    coords = coords - center
+    if rotation is not None:
+        coords = coords @ rotation.T
+    return coords
+
+
+def box_vectors(lengths: np.ndarray, angles: np.ndarray) -> np.ndarray:
+    """Box vectors (n, 3, 3) as rows from cell lengths and angles (n, 3).
+
+    The first vector is along x and the second one is in the xy plane.
+    """
+    lengths = np.atleast_2d(lengths)
+    alpha, beta, gamma = np.radians(np.atleast_2d(angles)).T
+    a, b, c = lengths.T
+    vectors = np.zeros((len(lengths), 3, 3))
+    vectors[:, 0, 0] = a
+    vectors[:, 1, 0] = b * np.cos(gamma)
+    vectors[:, 1, 1] = b * np.sin(gamma)
+    cx = c * np.cos(beta)
+    cy = c * (np.cos(alpha) - np.cos(beta) * np.cos(gamma)) / np.sin(gamma)
+    vectors[:, 2, 0] = cx
+    vectors[:, 2, 1] = cy
+    vectors[:, 2, 2] = np.sqrt(np.maximum(c**2 - cx**2 - cy**2, 0.0))
+    # 直方体の箱で余弦の丸め誤差が残らないようにする
+    vectors[np.abs(vectors) < 1e-8] = 0.0
+    return vectors
+
+
+def kabsch(mobile: np.ndarray, target: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Optimal rotations of frames onto a target (Kabsch algorithm).
+
+    Args:
+        mobile: (n, m, 3) coordinates of n frames, centered at the origin.
+        target: (m, 3) coordinates, centered at the origin.
+
+    Returns:
+        (rotations, rmsd): rotations (n, 3, 3) such that mobile @ rotation fits
+            the target, and the RMSD (n,) after the fit.
+    """
+    h = np.einsum("nai,aj->nij", mobile, target)
+    u, _, vt = np.linalg.svd(h)
+    # 鏡映にならないように符号を直す
+    d = np.sign(np.linalg.det(u @ vt))
+    u[:, :, 2] *= d[:, None]
+    rotations = u @ vt
+    diff = mobile @ rotations - target
+    rmsd = np.sqrt((diff**2).sum(axis=(1, 2)) / max(mobile.shape[1], 1))
+    return rotations, rmsd
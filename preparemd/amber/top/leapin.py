@@ -2,6 +2,11 @@ import os
 import re
 import textwrap
 
+# solvateBoxで直方体、solvateOctで切頂八面体の箱を作る
+BOXSHAPES = ("box", "oct")
+# 切頂八面体の体積は、それを切り出す立方体の体積の半分
+OCT_VOLUME_RATIO = 0.5
+
 
 def boxsize_checker(boxsize: str) -> str:
     """boxsizeの引数が''以外で与えられた場合に、boxsizeの値がスペース区切りの
@@ -30,12 +35,27 @@ def is_plusnum(s) -> bool:
         return True if float(s) > 0.0 else False
 
 
-def calculate_ion_nums(boxsize: str, ion_conc: float) -> float:
+def box_volume(boxsize: str, boxshape: str = "box") -> float:
+    """Volume (A^3) of the periodic box.
+
+    boxshape="oct"の場合、tleapのsolvateOctと同じく、ボックスサイズの最大値を
+    一辺とする立方体から切り出した切頂八面体の体積。
+    """
+    if boxshape not in BOXSHAPES:
+        raise ValueError(f"Unknown box shape {boxshape}. Choose from box or oct.")
+    box_dict = [float(x.strip()) for x in boxsize_checker(boxsize).split()]
+    if boxshape == "oct":
+        return OCT_VOLUME_RATIO * max(box_dict) ** 3
+    return box_dict[0] * box_dict[1] * box_dict[2]
+
+
+def calculate_ion_nums(boxsize: str, ion_conc: float, boxshape: str = "box") -> float:
     """Determine how many ions are needed in the system.
     Args:
         boxsize:  系のボックスサイズ。"x y z"のような3-tuple型かつ
                   いずれも0より大きい。
         ion_conc: イオン濃度。
+        boxshape: "box"(直方体)または"oct"(切頂八面体)。
 
     Returns:
         ionnum:   系に含めるべきイオンの個数
@@ -44,9 +64,7 @@ def calculate_ion_nums(boxsize: str, ion_conc: float) -> float:
     # 120 * 120 * 120 のサイズのときに156.0個のイオンになれば良い
 
     # boxsizeはすでに3-tupleであることが保証されている前提
-    boxsize = boxsize_checker(boxsize)
-    box_dict = [float(x.strip()) for x in boxsize.split()]
-    boxvolume = box_dict[0] * box_dict[1] * box_dict[2]
+    boxvolume = box_volume(boxsize, boxshape)
     ionnum = boxvolume * 0.0602 * ion_conc // 100000  # 切り捨て
     return int(ionnum)
 
@@ -115,20 +133,28 @@ def leapininput(
     frcmod: list,
     prep: list,
     mol2: list,
+    boxshape: str = "box",
 ) -> str:
-    """Content of leap.in file"""
+    """Content of leap.in file
+
+    boxshape="oct"の場合はsolvateOctで切頂八面体の箱を作る。boxsizeを指定した場合は
+    その最大値が切頂八面体を切り出す立方体の一辺になるように余白を決める。
+    """
     boxsize = boxsize_checker(boxsize)
     pre2boxsize = boxsize_checker(pre2boxsize)
 
     if boxsize == "":
         boxsize = pre2boxsize
         boxmargin = 10.0
+    elif boxshape == "oct":
+        solute = max(float(x) for x in pre2boxsize.split())
+        edge = max(float(x) for x in boxsize.split())
+        boxmargin = max(round((edge - solute) / 2, 3), 0.01)
     else:
         boxmargin = 0.01
 
     # イオンの個数はボックスサイズで決まる
-    ionnum = calculate_ion_nums(boxsize=boxsize, ion_conc=ion_conc)
-
+    ionnum = calculate_ion_nums(boxsize=boxsize, ion_conc=ion_conc, boxshape=boxshape)
     ssbondinfo = get_sspair_from_sslink_file(sslink_file)
 
     if fftype == "ff14SB":
@@ -159,6 +185,16 @@ def leapininput(
         solvateboxtype = "OPCBOX"
 
     additionalparams = additional_params(frcmod, prep, mol2)
+    if boxshape == "oct":
+        solvate = (
+            f"#溶質の周りに{boxmargin}Aの余白をとった切頂八面体の箱を設置し、溶媒和させる。\n"
+            f"solvateOct mol {solvateboxtype} {boxmargin}"
+        )
+    else:
+        solvate = (
+            f"#ボックスの周りに更に{boxmargin}Aのボックスを設置し、溶媒和させる。\n"
+            f"solvateBox mol {solvateboxtype} {boxmargin}"
+        )
 
     leapin_template = textwrap.dedent(
         """\
@@ -177,8 +213,7 @@ def leapininput(
         addIons2 mol Na+ {ionnum}
         addIons2 mol Cl- 0
 
-        #ボックスの周りに更に{boxmargin}Aのボックスを設置し、溶媒和させる。
-        solvateBox mol {solvateboxtype} {boxmargin}
+        {solvate}
         #最後に、"mol"という溶媒和ボックスの系の電荷情報を表示する。0.00000になっていることが理想。
         charge mol
 
@@ -195,7 +230,6 @@ def leapininput(
         ssbondinfo=ssbondinfo,
         boxsize=boxsize,
         ionnum=ionnum,
-        boxmargin=boxmargin,
-        solvateboxtype=solvateboxtype,
+        solvate=solvate,
     )
     return leapin_template
@@ -44,6 +44,20 @@ def filecopy_mol2(mol2: list, distdir: str) -> None:
                 shutil.copy2(filepath, os.path.join(distdir, "top"))
 
 
+def paramfile_names(frcmod: list, prep: list, mol2: list) -> list[str]:
+    """Names of the parameter files copied into the top directory by
+    `filecopy` and `filecopy_mol2`."""
+    names = []
+    for val in [frcmod, prep]:
+        if val is not None:
+            names += [os.path.basename(i) for i in val]
+    if mol2 is not None:
+        for i in mol2:
+            filepath = [a for a in re.split("=| |loadMol2", i) if a != ""][1]
+            names.append(os.path.basename(filepath))
+    return names
+
+
 def makeleapin(
     distdir: str,
     boxsize: str,
@@ -54,6 +68,7 @@ def makeleapin(
     frcmod: list,
     prep: list,
     mol2: list,
+    boxshape: str = "box",
 ) -> None:
     """make a leap.in file
     パラメータファイル（frcmod, prep, mol2）はdistdir内にコピーする
@@ -67,7 +82,15 @@ def makeleapin(
     filecopy_mol2(mol2, distdir)
 
     leapininput = leapin.leapininput(
-        boxsize, pre2boxsize, ion_conc, sslink_file, fftype, frcmod, prep, mol2
+        boxsize,
+        pre2boxsize,
+        ion_conc,
+        sslink_file,
+        fftype,
+        frcmod,
+        prep,
+        mol2,
+        boxshape=boxshape,
     )
 
     with open(leapinfile, mode="w") as f:
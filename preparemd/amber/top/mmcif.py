@@ -0,0 +1,50 @@
+import gemmi
+from loguru import logger
+
+MMCIF_SUFFIXES = (".cif", ".mmcif", ".cif.gz", ".mmcif.gz")
+# PDBフォーマットの残基番号の桁数の上限
+MAX_PDB_RESNUM = 9999
+
+
+def is_mmcif(path: str) -> bool:
+    return path.lower().endswith(MMCIF_SUFFIXES)
+
+
+def mmcif_to_pdb_string(path: str) -> str:
+    """Read an mmCIF file (e.g. an AlphaFold3 model) and convert it to PDB text
+    that pdb4amber can read.
+
+    Only the first model is kept. Chain names are shortened to one character and
+    residues are renumbered from 1 in each chain, so that large assemblies fit
+    in the residue number columns of the PDB format. In a chain with more than
+    9,999 residues the numbering restarts from 1 after 9999, which pdb4amber
+    and tleap read as the next residue of the same chain. Atom serial numbers
+    over 99,999 are written in hybrid-36.
+
+    Args:
+        path: Path to the mmCIF file.
+    Returns:
+        str: content of the converted PDB file.
+    """
+    st = gemmi.read_structure(path)
+    st.setup_entities()
+    while len(st) > 1:
+        del st[1]
+    st.remove_empty_chains()
+    if len(st) == 0:
+        raise ValueError(f"No atoms were found in {path}.")
+
+    for chain in st[0]:
+        if len(chain) > MAX_PDB_RESNUM:
+            # 鎖を分けるとTERで末端が作られてしまうため、同じ鎖のまま番号を振り直す
+            logger.warning(
+                f"Chain {chain.name} of {path} has {len(chain)} residues. "
+                f"Its residue numbers restart from 1 after {MAX_PDB_RESNUM}."
+            )
+        for i, residue in enumerate(chain):
+            residue.seqid = gemmi.SeqId(i % MAX_PDB_RESNUM + 1, " ")
+    st.shorten_chain_names()
+
+    options = gemmi.PdbWriteOptions(minimal=True)
+    options.cryst1_record = False
+    return st.make_pdb_string(options)
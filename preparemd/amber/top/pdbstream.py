@@ -0,0 +1,163 @@
+import os
+import stat
+import tempfile
+from collections.abc import Callable, Iterable, Iterator
+
+import numpy as np
+
+from preparemd.amber.top import geometry
+
+# 1行を受け取り、書き換えた行を返す。Noneを返した行は出力しない
+Transform = Callable[[str], str | None]
+
+CHUNKSIZE = 65536
+COORD_RECORDS = ("ATOM  ", "HETATM")
+
+
+def compose(transforms: Iterable[Transform]) -> Transform:
+    """Compose line transforms into one transform applied from left to right."""
+    transforms = list(transforms)
+
+    def composed(line: str) -> str | None:
+        for transform in transforms:
+            line = transform(line)
+            if line is None:
+                return None
+        return line
+
+    return composed
+
+
+def _output_mode(outfile: str) -> int:
+    """Permission bits for outfile: the existing ones, or the umask default."""
+    if os.path.exists(outfile):
+        return stat.S_IMODE(os.stat(outfile).st_mode)
+    umask = os.umask(0)
+    os.umask(umask)
+    return 0o666 & ~umask
+
+
+def rewrite(
+    infile: str,
+    outfile: str,
+    transforms: Iterable[Transform],
+    header: Iterable[str] = (),
+) -> None:
+    """Stream infile through the transforms into outfile in one pass.
+
+    Only one line is kept in memory. The output is written to a temporary file
+    in the same directory and renamed at the end, so infile and outfile may be
+    the same file. outfile keeps its permissions (or gets the umask default
+    if it is new) instead of the 0600 of the temporary file.
+    """
+    transform = compose(transforms)
+    outdir = os.path.dirname(os.path.abspath(outfile))
+    fd, tmpfile = tempfile.mkstemp(prefix=".tmp-", suffix=".pdb", dir=outdir)
+    try:
+        with open(infile) as fin, os.fdopen(fd, "w") as fout:
+            fout.writelines(header)
+            for line in fin:
+                line = transform(line)
+                if line is not None:
+                    fout.write(line)
+        os.chmod(tmpfile, _output_mode(outfile))
+        os.replace(tmpfile, outfile)
+    except BaseException:
+        if os.path.exists(tmpfile):
+            os.remove(tmpfile)
+        raise
+
+
+def iter_atom_chunks(
+    infile: str, chunksize: int = CHUNKSIZE
+) -> Iterator[tuple[np.ndarray, np.ndarray, np.ndarray]]:
+    """Read ATOM/HETATM records in chunks.
+
+    Yields:
+        (coords, is_ca, radii): (n, 3) coordinates, boolean mask of CA atoms and
+        approximate radii of at most `chunksize` atoms.
+    """
+    coords, is_ca, radii = [], [], []
+    with open(infile) as f:
+        for line in f:
+            if not line.startswith(COORD_RECORDS):
+                continue
+            coords.append((float(line[30:38]), float(line[38:46]), float(line[46:54])))
+            is_ca.append(line[12:16].strip() == "CA")
+            radii.append(geometry.atom_radius(element(line)))
+            if len(coords) == chunksize:
+                yield np.array(coords), np.array(is_ca), np.array(radii)
+                coords, is_ca, radii = [], [], []
+    if coords:
+        yield np.array(coords), np.array(is_ca), np.array(radii)
+
+
+def element(line: str) -> str:
+    """Element symbol of an ATOM/HETATM line. The atom name is used when the
+    element column is empty."""
+    symbol = line[76:78].strip()
+    if symbol == "":
+        symbol = line[12:16].strip().lstrip("0123456789")[:1]
+    return symbol
+
+
+def drop_records(*records: str) -> Transform:
+    """Remove records such as CRYST1."""
+
+    def transform(line: str) -> str | None:
+        return None if line.startswith(records) else line
+
+    return transform
+
+
+def move_coordinates(center: np.ndarray, rotation: np.ndarray | None) -> Transform:
+    """Translate coordinates by -center, then rotate them around the origin."""
+    matrix = np.identity(3) if rotation is None else rotation
+    shift = -(matrix @ center)
+
+    def transform(line: str) -> str:
+        if not line.startswith(COORD_RECORDS):
+            return line
+        xyz = (float(line[30:38]), float(line[38:46]), float(line[46:54]))
+        x, y, z = matrix @ xyz + shift
+        return f"{line[:30]}{x:8.3f}{y:8.3f}{z:8.3f}{line[54:]}"
+
+    return transform
+
+
+def rename_residue(old: str, new: str) -> Transform:
+    """Rename residues (e.g. CYX -> CYS) in the residue name columns."""
+
+    def transform(line: str) -> str:
+        if line.startswith(COORD_RECORDS + ("TER   ",)) and line[17:20] == old:
+            return f"{line[:17]}{new}{line[20:]}"
+        return line
+
+    return transform
+
+
+def cys_to_cyx(resnums: set[int]) -> Transform:
+    """Rename CYS residues whose residue numbers are in resnums to CYX."""
+
+    def transform(line: str) -> str:
+        if line.startswith("ATOM  "):
+            resnum = int(line[22:26])
+            if resnum in resnums:
+                if line[17:20] != "CYS":
+                    raise Exception(f"Residue {resnum} is not CYS residue.")
+                return f"{line[:17]}CYX{line[20:]}"
+        return line
+
+    return transform
+
+
+def read_sslink(sslink_file: str) -> set[int]:
+    """Residue numbers of CYS residues that form SS bonds."""
+    cyxresnums = set()
+    with open(sslink_file) as f:
+        for line in f:
+            if line.strip() == "":
+                continue
+            cyxresnums.add(int(line.split()[0]))
+            cyxresnums.add(int(line.split()[1]))
+    return cyxresnums
@@ -0,0 +1,319 @@
+"""Reader of AMBER topology (prmtop/parm7) files.
+
+A prmtop file is a list of sections::
+
+    %FLAG ATOM_NAME
+    %FORMAT(20a4)
+    N   H1  H2  H3  CA  ...
+
+Each section is a sequence of fixed-width fields given by the Fortran format.
+`Prmtop` indexes the sections in one scan and converts only the sections that
+are asked for.
+"""
+
+import mmap
+import os
+import re
+from dataclasses import dataclass
+
+import numpy as np
+
+# POINTERSの各値の位置
+NATOM = 0
+NRES = 11
+IFBOX = 27
+# HMRで水素原子に与える質量(Da)。ParmEdのHMassRepartitionと同じ
+HMR_MASS = 3.024
+WATER_RESIDUES = ("WAT", "HOH", "TIP3")
+# tleapのaddIons2で加えるイオンと水
+SOLVENT_RESIDUES = WATER_RESIDUES + ("Na+", "Cl-", "K+")
+
+
+def _parse_format(fmt: str) -> tuple[int, str, int, int]:
+    """(fields per line, kind, width, decimals) of a %FORMAT line."""
+    match = re.search(r"\((\d+)([aAiIeEfF])(\d+)(?:\.(\d+))?", fmt)
+    if match is None:
+        raise ValueError(f"Unknown %FORMAT: {fmt}")
+    count, kind, width, decimals = match.groups()
+    return int(count), kind.lower(), int(width), int(decimals or 0)
+
+
+def _decode_section(data: bytes, fmt: str) -> np.ndarray:
+    """Convert the lines of a section to a numpy array (str, int64 or float64)."""
+    count, kind, width, _ = _parse_format(fmt)
+    lines = data.replace(b"\r", b"").split(b"\n")
+    if len(lines) > 0 and lines[-1] == b"":
+        lines.pop()
+    # 最後の行以外がすべて1行分の長さなら、つなげたまま固定幅のフィールドに分ける
+    if all(len(line) == count * width for line in lines[:-1]) and (
+        len(lines) == 0 or len(lines[-1]) % width == 0
+    ):
+        fields = np.frombuffer(b"".join(lines), dtype=f"S{width}")
+    else:
+        fields = np.array(
+            [line[i : i + width] for line in lines for i in range(0, len(line), width)],
+            dtype=f"S{width}",
+        )
+    if kind == "a":
+        return np.char.strip(fields.astype(str))
+    if kind == "i":
+        return fields.astype(np.int64)
+    return fields.astype(np.float64)
+
+
+class Prmtop:
+    """Lazy, section-indexed reader of a prmtop file.
+
+    The byte offsets of all %FLAG sections are found in one scan of the file,
+    and a section is read and converted to a numpy array only when it is
+    asked for. Converted sections are cached::
+
+        parm = Prmtop("top/leap.parm7")
+        parm.natom, parm.box_dimensions, parm["CHARGE"]
+    """
+
+    def __init__(self, path: str):
+        if not os.path.isfile(path):
+            raise FileNotFoundError(f"{path} was not found.")
+        self.path = path
+        # {flag: (%FORMAT, 開始位置, 終了位置)}
+        self._index = {}
+        self._cache = {}
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                raise ValueError(f"{path} is empty.")
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                self._scan(mm)
+
+    def _scan(self, mm: mmap.mmap) -> None:
+        # posは%FLAGの行の先頭。ファイルの最初の行は%VERSION
+        pos = 0 if mm[:5] == b"%FLAG" else mm.find(b"\n%FLAG") + 1
+        if pos == 0 and mm[:5] != b"%FLAG":
+            raise ValueError(f"No %FLAG was found in {self.path}.")
+        while pos >= 0:
+            eol = mm.find(b"\n", pos)
+            eol = len(mm) if eol < 0 else eol
+            name = mm[pos + 5 : eol].strip().decode()
+            following = mm.find(b"\n%FLAG", eol - 1)
+            stop = len(mm) if following < 0 else following + 1
+            # %FORMAT, %COMMENTの行を飛ばしてデータの開始位置を求める
+            fmt, start = "", eol + 1
+            while start < stop and mm[start : start + 1] == b"%":
+                end = mm.find(b"\n", start)
+                end = stop if end < 0 else end
+                if mm[start : start + 7] == b"%FORMAT":
+                    fmt = mm[start:end].decode()
+                start = end + 1
+            self._index[name] = (fmt, min(start, stop), stop)
+            pos = following + 1 if following >= 0 else -1
+
+    @property
+    def flags(self) -> list[str]:
+        """Names of the sections in the order of the file."""
+        return list(self._index)
+
+    def __contains__(self, flag: str) -> bool:
+        return flag in self._index
+
+    def __getitem__(self, flag: str) -> np.ndarray:
+        if flag not in self._cache:
+            if flag not in self._index:
+                raise ValueError(f"{flag} was not found in {self.path}.")
+            fmt, start, stop = self._index[flag]
+            with open(self.path, "rb") as f:
+                f.seek(start)
+                data = f.read(stop - start)
+            self._cache[flag] = _decode_section(data, fmt)
+        return self._cache[flag]
+
+    @property
+    def pointers(self) -> np.ndarray:
+        return self["POINTERS"]
+
+    @property
+    def natom(self) -> int:
+        return int(self.pointers[NATOM])
+
+    @property
+    def nres(self) -> int:
+        return int(self.pointers[NRES])
+
+    @property
+    def atom_names(self) -> np.ndarray:
+        return self["ATOM_NAME"][: self.natom]
+
+    @property
+    def residue_labels(self) -> np.ndarray:
+        return self["RESIDUE_LABEL"]
+
+    @property
+    def residue_pointer(self) -> np.ndarray:
+        """The first atom (1-based) of each residue."""
+        return self["RESIDUE_POINTER"]
+
+    @property
+    def masses(self) -> np.ndarray:
+        return self["MASS"]
+
+    @property
+    def residue_index(self) -> np.ndarray:
+        """Residue (0-based) of each atom."""
+        starts = self.residue_pointer - 1
+        return np.repeat(np.arange(len(starts)), np.diff(np.append(starts, self.natom)))
+
+    @property
+    def box_dimensions(self) -> np.ndarray | None:
+        """(beta, a, b, c) of the periodic box, or None without a box (IFBOX=0)."""
+        if "BOX_DIMENSIONS" not in self:
+            return None
+        if len(self.pointers) > IFBOX and int(self.pointers[IFBOX]) == 0:
+            return None
+        return self["BOX_DIMENSIONS"]
+
+    def solute_residues(self, solvent=SOLVENT_RESIDUES) -> int:
+        """Number of residues before the first water or ion residue.
+
+        tleapは溶質の後にイオンと水を加えるので、pdb4amberの残基数と同じになる。
+        """
+        is_solvent = np.isin(self.residue_labels, list(solvent))
+        return int(np.argmax(is_solvent)) if is_solvent.any() else self.nres
+
+
+def read_prmtop(path: str, flags: list[str] | None = None) -> dict:
+    """Read sections of a prmtop file.
+
+    Args:
+        flags: 読み込むセクション名(%FLAGの値)。Noneの場合はすべて。
+
+    Returns:
+        dict: {flag: list of str (%FORMAT(..a..)) or numpy array}
+    """
+    parm = Prmtop(path)
+    flags = parm.flags if flags is None else flags
+    missing = [flag for flag in flags if flag not in parm]
+    if missing:
+        raise ValueError(f"{', '.join(sorted(missing))} was not found in {path}.")
+    sections = {}
+    for flag in flags:
+        values = parm[flag]
+        sections[flag] = values.tolist() if values.dtype.kind == "U" else values
+    return sections
+
+
+@dataclass
+class Topology:
+    """Atoms and residues of a prmtop file."""
+
+    atom_names: list[str]
+    residue_labels: list[str]
+    # 各原子の残基番号(0始まり)
+    residue_index: np.ndarray
+    masses: np.ndarray
+
+    @property
+    def natoms(self) -> int:
+        return len(self.atom_names)
+
+    def atoms_of_residues(self, labels) -> np.ndarray:
+        """Indices of the atoms whose residue label is in labels."""
+        selected = np.isin(np.array(self.residue_labels), list(labels))
+        return np.flatnonzero(selected[self.residue_index])
+
+
+def read_topology(path: str) -> Topology:
+    """Read the atom names, residues and masses of a prmtop file."""
+    parm = Prmtop(path)
+    return Topology(
+        atom_names=parm.atom_names.tolist(),
+        residue_labels=parm.residue_labels.tolist(),
+        residue_index=parm.residue_index,
+        masses=parm.masses,
+    )
+
+
+def _format_section(values, fmt: str) -> list[str]:
+    count, kind, width, decimals = _parse_format(fmt)
+    if kind == "a":
+        fields = [f"{value:<{width}s}" for value in values]
+    elif kind == "i":
+        fields = [f"{int(value):{width}d}" for value in values]
+    else:
+        fields = [f"{value:{width}.{decimals}{kind.upper()}}" for value in values]
+    lines = [
+        "".join(fields[i : i + count]) + "\n" for i in range(0, len(fields), count)
+    ]
+    # 空のセクションは空行1行になる
+    return lines or ["\n"]
+
+
+def write_sections(path: str, values: dict, output: str | None = None) -> None:
+    """Replace the values of sections of a prmtop file.
+
+    The file is written to a temporary file and renamed, so that a prmtop
+    hardlinked from the leap cache is not changed.
+
+    Args:
+        values: {flag: 新しい値}。%FORMATは元のファイルのものを使う。
+        output: 出力先。Noneの場合はpathを置き換える。
+    """
+    output = path if output is None else output
+    found = set()
+    tmpfile = output + ".tmp"
+    with open(path) as f, open(tmpfile, "w") as out:
+        name, fmt = None, ""
+        for line in f:
+            if line.startswith("%FLAG"):
+                name = line[5:].strip()
+                out.write(line)
+            elif name in values and line.startswith("%FORMAT"):
+                fmt = line
+                out.write(line)
+                out.writelines(_format_section(values[name], fmt))
+                found.add(name)
+            elif name in values and not line.startswith("%COMMENT"):
+                continue
+            else:
+                out.write(line)
+    if set(values) - found:
+        os.remove(tmpfile)
+        missing = ", ".join(sorted(set(values) - found))
+        raise ValueError(f"{missing} was not found in {path}.")
+    os.replace(tmpfile, output)
+
+
+def repartition_hydrogen_mass(
+    path: str,
+    output: str | None = None,
+    hmass: float = HMR_MASS,
+    water: tuple[str, ...] = WATER_RESIDUES,
+) -> int:
+    """Hydrogen mass repartitioning (HMR) of a prmtop file.
+
+    水素原子の質量をhmassにし、増えた分を結合している重原子の質量から引く。
+    系全体の質量は変わらない。水分子はSHAKEで剛体なので変えない。
+    すでにHMRされたファイルに対しては何もしない。
+
+    Returns:
+        Number of repartitioned hydrogen atoms.
+    """
+    parm = Prmtop(path)
+    masses = parm.masses.copy()
+    # BONDS_INC_HYDROGENは(原子1, 原子2, 結合の種類)の並び。原子の番号は3倍されている
+    bonds = parm["BONDS_INC_HYDROGEN"].reshape(-1, 3)[:, :2] // 3
+    residue_index = parm.residue_index
+    is_water = np.isin(parm.residue_labels, list(water))
+    # 水素の質量は2.5 Daより小さいとみなす。HMR済みの水素(3.024 Da)は対象外
+    light = masses[bonds] < 2.5
+    mask = (light[:, 0] != light[:, 1]) & ~is_water[residue_index[bonds[:, 0]]]
+    bonds = bonds[mask]
+    hydrogens = np.where(light[mask][:, 0], bonds[:, 0], bonds[:, 1])
+    heavy = np.where(light[mask][:, 0], bonds[:, 1], bonds[:, 0])
+    hydrogens, first = np.unique(hydrogens, return_index=True)
+    heavy = heavy[first]
+    np.subtract.at(masses, heavy, hmass - masses[hydrogens])
+    masses[hydrogens] = hmass
+    if np.any(masses[heavy] <= 0):
+        raise ValueError(f"Repartitioning made non-positive masses in {path}.")
+    if len(hydrogens) > 0 or (output is not None and output != path):
+        write_sections(path, {"MASS": masses}, output)
+    return len(hydrogens)
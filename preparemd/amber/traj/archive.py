@@ -0,0 +1,251 @@
+"""Chunked, compressed trajectory archive with a frame index.
+
+The archive file is a sequence of independently compressed chunks of frames.
+The coordinates are quantized to integers with the given precision (lossy,
+like XTC), delta-encoded between consecutive frames, byte-shuffled and
+compressed with zlib. The sidecar index (path + INDEX_SUFFIX, a .npz file)
+holds for each frame its segment, its frame number in the segment trajectory,
+time and box, and for each chunk its byte offset in the archive, so that any
+frame is found without scanning the file::
+
+    reader = ArchiveReader("traj.arc")
+    coords = reader.read(range(40000, 41000))
+    for frames, coords in reader.iter_frames(reader.select(segment=7, step=10)):
+        ...
+"""
+
+import os
+import zlib
+from collections import OrderedDict
+
+import numpy as np
+
+MAGIC = b"PMDARC01"
+INDEX_SUFFIX = ".idx.npz"
+# 量子化の幅(Å)。XTCのデフォルト(0.001 nm)と同じ
+DEFAULT_PRECISION = 0.01
+DEFAULT_CHUNK_FRAMES = 100
+FRAME_DTYPE = np.dtype(
+    [
+        ("segment", "<i4"),
+        ("frame", "<i8"),
+        ("time", "<f8"),
+        ("chunk", "<i4"),
+        ("cell_lengths", "<f8", (3,)),
+        ("cell_angles", "<f8", (3,)),
+    ]
+)
+CHUNK_DTYPE = np.dtype(
+    [("offset", "<i8"), ("nbytes", "<i8"), ("start", "<i8"), ("nframes", "<i4")]
+)
+
+
+def _encode(coordinates: np.ndarray, precision: float) -> bytes:
+    quantized = np.rint(coordinates / precision).astype("<i4")
+    # 最初のフレームは絶対値、それ以降は前のフレームとの差
+    deltas = np.diff(quantized, axis=0, prepend=np.zeros_like(quantized[:1]))
+    shuffled = deltas.view(np.uint8).reshape(-1, 4).T
+    return zlib.compress(np.ascontiguousarray(shuffled).tobytes(), 6)
+
+
+def _decode(data, nframes: int, natoms: int, precision: float) -> np.ndarray:
+    raw = np.frombuffer(zlib.decompress(data), dtype=np.uint8)
+    deltas = np.ascontiguousarray(raw.reshape(4, -1).T).view("<i4")
+    quantized = np.cumsum(deltas.reshape(nframes, natoms, 3), axis=0, dtype=np.int64)
+    return (quantized * precision).astype(np.float32)
+
+
+def index_path(path: str) -> str:
+    return path + INDEX_SUFFIX
+
+
+class ArchiveWriter:
+    """Write frames to a chunked archive and its index."""
+
+    def __init__(
+        self,
+        path: str,
+        natoms: int,
+        precision: float = DEFAULT_PRECISION,
+        chunk_frames: int = DEFAULT_CHUNK_FRAMES,
+    ):
+        if precision <= 0:
+            raise ValueError("The precision must be positive.")
+        self.path = path
+        self.natoms = natoms
+        self.precision = precision
+        self.chunk_frames = max(1, chunk_frames)
+        self.nframes = 0
+        self._frames = []
+        self._chunks = []
+        self._pending = []
+        self._file = open(path, "wb")
+        self._file.write(MAGIC)
+
+    def write(
+        self,
+        coordinates,
+        time=None,
+        cell_lengths=None,
+        cell_angles=None,
+        segment: int = 0,
+        frames=None,
+    ):
+        """Append frames. coordinates: (n, natoms, 3) in Angstrom.
+
+        Args:
+            segment: フレームが属するセグメントの番号(001/mdcrdなら1)。
+            frames: セグメントのトラジェクトリ内でのフレーム番号。
+        """
+        coordinates = np.asarray(coordinates)
+        n = len(coordinates)
+        info = np.zeros(n, dtype=FRAME_DTYPE)
+        info["segment"] = segment
+        info["frame"] = np.arange(n) if frames is None else frames
+        info["time"] = (
+            np.arange(self.nframes, self.nframes + n) if time is None else time
+        )
+        if cell_lengths is not None:
+            info["cell_lengths"] = cell_lengths
+            info["cell_angles"] = cell_angles
+        self._pending.append((coordinates, info))
+        self.nframes += n
+        while sum(len(c) for c, _ in self._pending) >= self.chunk_frames:
+            self._flush(self.chunk_frames)
+
+    def _flush(self, size: int) -> None:
+        coords = np.concatenate([c for c, _ in self._pending])
+        info = np.concatenate([i for _, i in self._pending])
+        self._pending = [(coords[size:], info[size:])] if len(coords) > size else []
+        coords, info = coords[:size], info[:size]
+        data = _encode(coords, self.precision)
+        chunk = np.zeros((), dtype=CHUNK_DTYPE)
+        chunk["offset"] = self._file.tell()
+        chunk["nbytes"] = len(data)
+        chunk["start"] = sum(len(frames) for frames in self._frames)
+        chunk["nframes"] = len(coords)
+        info["chunk"] = len(self._chunks)
+        self._file.write(data)
+        self._chunks.append(chunk)
+        self._frames.append(info)
+
+    def close(self) -> None:
+        if self._file.closed:
+            return
+        if self._pending:
+            self._flush(sum(len(c) for c, _ in self._pending))
+        self._file.close()
+        np.savez(
+            index_path(self.path),
+            frames=(
+                np.concatenate(self._frames)
+                if self._frames
+                else np.zeros(0, FRAME_DTYPE)
+            ),
+            chunks=np.array(self._chunks, dtype=CHUNK_DTYPE),
+            natoms=self.natoms,
+            precision=self.precision,
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ArchiveReader:
+    """Random access and strided iteration over a chunked archive.
+
+    The archive is memory-mapped and only the chunks that contain the requested
+    frames are decompressed. The last decoded chunks are kept in a small cache
+    so that iterating frame by frame decodes each chunk once.
+    """
+
+    def __init__(self, path: str, cache_chunks: int = 2):
+        if not os.path.isfile(path):
+            raise FileNotFoundError(f"{path} was not found.")
+        if not os.path.isfile(index_path(path)):
+            raise FileNotFoundError(f"The index {index_path(path)} was not found.")
+        with np.load(index_path(path)) as index:
+            self.frames = index["frames"]
+            self.chunks = index["chunks"]
+            self.natoms = int(index["natoms"])
+            self.precision = float(index["precision"])
+        self._mmap = np.memmap(path, dtype=np.uint8, mode="r")
+        if bytes(self._mmap[: len(MAGIC)]) != MAGIC:
+            raise ValueError(f"{path} is not a trajectory archive.")
+        self._cache = OrderedDict()
+        self._cache_chunks = max(1, cache_chunks)
+
+    def __len__(self) -> int:
+        return len(self.frames)
+
+    @property
+    def nframes(self) -> int:
+        return len(self.frames)
+
+    def chunk(self, i: int) -> np.ndarray:
+        """Coordinates (nframes, natoms, 3) of the i-th chunk."""
+        if i in self._cache:
+            self._cache.move_to_end(i)
+            return self._cache[i]
+        chunk = self.chunks[i]
+        offset, nbytes = int(chunk["offset"]), int(chunk["nbytes"])
+        coords = _decode(
+            self._mmap[offset : offset + nbytes],
+            int(chunk["nframes"]),
+            self.natoms,
+            self.precision,
+        )
+        self._cache[i] = coords
+        if len(self._cache) > self._cache_chunks:
+            self._cache.popitem(last=False)
+        return coords
+
+    def select(
+        self,
+        segment: int | None = None,
+        start: int = 0,
+        stop: int | None = None,
+        step: int = 1,
+    ) -> np.ndarray:
+        """Indices of frames[start:stop:step], within a segment if given."""
+        indices = np.arange(len(self.frames))
+        if segment is not None:
+            indices = indices[self.frames["segment"] == segment]
+        return indices[start:stop:step]
+
+    def iter_frames(self, indices=None):
+        """Yield (indices, coordinates) for each chunk that holds the frames.
+
+        Args:
+            indices: 読み込むフレームの番号(昇順)。Noneの場合はすべて。
+        """
+        indices = np.arange(len(self.frames)) if indices is None else indices
+        indices = np.asarray(indices, dtype=np.int64)
+        if len(indices) == 0:
+            return
+        chunks = self.frames["chunk"][indices]
+        # 連続する同じチャンクのフレームをまとめて取り出す
+        bounds = np.flatnonzero(np.diff(chunks)) + 1
+        for group in np.split(np.arange(len(indices)), bounds):
+            i = int(chunks[group[0]])
+            local = indices[group] - int(self.chunks[i]["start"])
+            yield indices[group], self.chunk(i)[local]
+
+    def read(self, indices) -> np.ndarray:
+        """Coordinates (n, natoms, 3) of the frames in the given order."""
+        indices = np.asarray(indices, dtype=np.int64).reshape(-1)
+        coords = np.empty((len(indices), self.natoms, 3), dtype=np.float32)
+        order = np.argsort(indices, kind="stable")
+        pos = 0
+        for group, values in self.iter_frames(indices[order]):
+            coords[order[pos : pos + len(group)]] = values
+            pos += len(group)
+        return coords
+
+    def __getitem__(self, key) -> np.ndarray:
+        if isinstance(key, slice):
+            return self.read(np.arange(len(self.frames))[key])
+        return self.read([range(len(self.frames))[key]])[0]
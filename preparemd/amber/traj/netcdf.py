@@ -0,0 +1,345 @@
+"""AMBER NetCDF trajectories (NetCDF3 classic and 64-bit offset formats).
+
+pmemd writes trajectories with ioutfm=1 in the AMBER convention: coordinates
+(frame, atom, spatial) in Angstrom, time (frame) in ps, and cell_lengths and
+cell_angles (frame, 3) for periodic systems. "frame" is the unlimited
+dimension, so the data of one frame are stored together in one record.
+
+The reader maps the file into memory and reads only the requested frames and
+atoms, so the memory use does not depend on the length of the trajectory.
+"""
+
+import os
+import struct
+
+import numpy as np
+
+NC_DIMENSION = 10
+NC_VARIABLE = 11
+NC_ATTRIBUTE = 12
+NC_CHAR = 2
+NC_FLOAT = 5
+NC_DOUBLE = 6
+# nc_typeとbig endianのdtype
+DTYPES = {1: ">i1", 2: "S1", 3: ">i2", 4: ">i4", 5: ">f4", 6: ">f8"}
+STREAMING = 0xFFFFFFFF
+
+
+def _pad(n: int) -> int:
+    return (n + 3) // 4 * 4
+
+
+class _Header:
+    """Parser of the header of a NetCDF3 file."""
+
+    def __init__(self, data: bytes):
+        self.data = data
+        self.pos = 0
+
+    def int(self) -> int:
+        (value,) = struct.unpack_from(">i", self.data, self.pos)
+        self.pos += 4
+        return value
+
+    def uint(self) -> int:
+        (value,) = struct.unpack_from(">I", self.data, self.pos)
+        self.pos += 4
+        return value
+
+    def int64(self) -> int:
+        (value,) = struct.unpack_from(">q", self.data, self.pos)
+        self.pos += 8
+        return value
+
+    def name(self) -> str:
+        n = self.int()
+        value = self.data[self.pos : self.pos + n].decode()
+        self.pos += _pad(n)
+        return value
+
+    def values(self, nc_type: int, n: int):
+        dtype = np.dtype(DTYPES[nc_type])
+        raw = self.data[self.pos : self.pos + n * dtype.itemsize]
+        self.pos += _pad(n * dtype.itemsize)
+        if nc_type == NC_CHAR:
+            return raw.decode(errors="replace").rstrip("\x00")
+        return np.frombuffer(raw, dtype=dtype)
+
+    def list(self, tag: int) -> int:
+        found, n = self.int(), self.int()
+        if found not in (0, tag):
+            raise ValueError("Broken NetCDF header.")
+        return n
+
+    def attributes(self) -> dict:
+        attributes = {}
+        for _ in range(self.list(NC_ATTRIBUTE)):
+            name = self.name()
+            nc_type = self.int()
+            attributes[name] = self.values(nc_type, self.int())
+        return attributes
+
+
+class NetCDFReader:
+    """Random access to the variables of an AMBER NetCDF trajectory."""
+
+    def __init__(self, path: str):
+        if not os.path.isfile(path):
+            raise FileNotFoundError(f"{path} was not found.")
+        self.path = path
+        with open(path, "rb") as f:
+            head = f.read(4)
+            if head[:3] != b"CDF" or head[3] not in (1, 2):
+                raise ValueError(f"{path} is not a NetCDF3 file.")
+            offset64 = head[3] == 2
+            # ヘッダーの大きさは最初の変数の位置までなので、十分な量を読む
+            data = head + f.read(1 << 20)
+        header = _Header(data)
+        header.pos = 4
+        numrecs = header.uint()
+        self.dimensions = []
+        for _ in range(header.list(NC_DIMENSION)):
+            self.dimensions.append((header.name(), header.int()))
+        self.attributes = header.attributes()
+        self.variables = {}
+        for _ in range(header.list(NC_VARIABLE)):
+            name = header.name()
+            dimids = [header.int() for _ in range(header.int())]
+            attributes = header.attributes()
+            nc_type = header.int()
+            header.int()  # vsize
+            begin = header.int64() if offset64 else header.uint()
+            dims = [self.dimensions[i] for i in dimids]
+            self.variables[name] = {
+                "dtype": np.dtype(DTYPES[nc_type]),
+                "record": bool(dims) and dims[0][1] == 0,
+                "shape": tuple(length for _, length in dims if length != 0),
+                "begin": begin,
+                "attributes": attributes,
+            }
+        records = [v for v in self.variables.values() if v["record"]]
+        sizes = [int(np.prod(v["shape"])) * v["dtype"].itemsize for v in records]
+        # レコード変数が1つだけの場合は4バイト境界に揃えない
+        self.recsize = sizes[0] if len(sizes) == 1 else sum(_pad(s) for s in sizes)
+        self._mmap = np.memmap(path, dtype=np.uint8, mode="r")
+        if records and (numrecs == STREAMING or numrecs == 0):
+            start = min(v["begin"] for v in records)
+            numrecs = (len(self._mmap) - start) // max(self.recsize, 1)
+        self.nframes = numrecs if records else 0
+
+    @property
+    def natoms(self) -> int:
+        return self.variables["coordinates"]["shape"][0]
+
+    @property
+    def has_box(self) -> bool:
+        return "cell_lengths" in self.variables
+
+    def variable(self, name: str) -> np.ndarray:
+        """A read-only view of a variable. Record variables have the frames as
+        the first axis."""
+        var = self.variables[name]
+        if not var["record"]:
+            return np.ndarray(
+                var["shape"], var["dtype"], buffer=self._mmap, offset=var["begin"]
+            )
+        # 1レコード内ではC orderで並ぶ
+        strides = []
+        step = var["dtype"].itemsize
+        for length in reversed(var["shape"]):
+            strides.insert(0, step)
+            step *= length
+        return np.ndarray(
+            (self.nframes, *var["shape"]),
+            var["dtype"],
+            buffer=self._mmap,
+            offset=var["begin"],
+            strides=(self.recsize, *strides),
+        )
+
+    def read(self, frames, atoms=None) -> dict:
+        """Read frames (an index array) of the trajectory.
+
+        Args:
+            atoms: 読み込む原子の番号(0始まり)。Noneの場合はすべて。
+
+        Returns:
+            dict: coordinates (n, natoms, 3), time (n,), and cell_lengths and
+                cell_angles (n, 3) or None, as float64 arrays.
+        """
+        frames = np.asarray(frames, dtype=np.int64)
+        coordinates = self.variable("coordinates")
+        if atoms is None:
+            coords = coordinates[frames]
+        else:
+            atoms = np.asarray(atoms, dtype=np.int64)
+            coords = coordinates[frames[:, None], atoms[None, :]]
+        result = {
+            "coordinates": coords.astype(np.float64),
+            "time": (
+                self.variable("time")[frames].astype(np.float64)
+                if "time" in self.variables
+                else frames.astype(np.float64)
+            ),
+            "cell_lengths": None,
+            "cell_angles": None,
+        }
+        if self.has_box:
+            result["cell_lengths"] = self.variable("cell_lengths")[frames].astype(
+                np.float64
+            )
+            result["cell_angles"] = self.variable("cell_angles")[frames].astype(
+                np.float64
+            )
+        return result
+
+
+class NetCDFWriter:
+    """Write an AMBER NetCDF trajectory (64-bit offset format) frame by frame."""
+
+    def __init__(
+        self, path: str, natoms: int, box: bool = True, title: str = "preparemd"
+    ):
+        self.path = path
+        self.natoms = natoms
+        self.box = box
+        self.nframes = 0
+        dims = [("frame", 0), ("spatial", 3), ("atom", natoms)]
+        if box:
+            dims += [("cell_spatial", 3), ("label", 5), ("cell_angular", 3)]
+        dimid = {name: i for i, (name, _) in enumerate(dims)}
+        gatts = {
+            "title": title,
+            "application": "AMBER",
+            "program": "preparemd",
+            "programVersion": "1.0",
+            "Conventions": "AMBER",
+            "ConventionVersion": "1.0",
+        }
+        # (name, dims, nc_type, attributes, data of a fixed-size variable)
+        variables = [("spatial", ["spatial"], NC_CHAR, {}, b"xyz")]
+        if box:
+            variables += [
+                ("cell_spatial", ["cell_spatial"], NC_CHAR, {}, b"abc"),
+                (
+                    "cell_angular",
+                    ["cell_angular", "label"],
+                    NC_CHAR,
+                    {},
+                    b"alphabeta gamma",
+                ),
+            ]
+        variables += [
+            ("time", ["frame"], NC_FLOAT, {"units": "picosecond"}, None),
+            (
+                "coordinates",
+                ["frame", "atom", "spatial"],
+                NC_FLOAT,
+                {"units": "angstrom"},
+                None,
+            ),
+        ]
+        if box:
+            variables += [
+                (
+                    "cell_lengths",
+                    ["frame", "cell_spatial"],
+                    NC_DOUBLE,
+                    {"units": "angstrom"},
+                    None,
+                ),
+                (
+                    "cell_angles",
+                    ["frame", "cell_angular"],
+                    NC_DOUBLE,
+                    {"units": "degree"},
+                    None,
+                ),
+            ]
+        fields = [("time", ">f4"), ("coordinates", ">f4", (natoms, 3))]
+        if box:
+            fields += [("cell_lengths", ">f8", (3,)), ("cell_angles", ">f8", (3,))]
+        self.record = np.dtype(fields)
+
+        sizes = {}
+        for name, vdims, nc_type, _, _ in variables:
+            n = int(np.prod([dict(dims)[d] for d in vdims if d != "frame"]))
+            sizes[name] = _pad(n * np.dtype(DTYPES[nc_type]).itemsize)
+
+        def build(begins: dict) -> bytes:
+            out = [b"CDF\x02", struct.pack(">i", 0)]
+            out.append(struct.pack(">ii", NC_DIMENSION, len(dims)))
+            for name, length in dims:
+                out += [_name(name), struct.pack(">i", length)]
+            out.append(_attributes(gatts))
+            out.append(struct.pack(">ii", NC_VARIABLE, len(variables)))
+            for name, vdims, nc_type, atts, _ in variables:
+                out.append(_name(name))
+                out.append(struct.pack(">i", len(vdims)))
+                out += [struct.pack(">i", dimid[d]) for d in vdims]
+                out.append(_attributes(atts))
+                out.append(struct.pack(">iiq", nc_type, sizes[name], begins[name]))
+            return b"".join(out)
+
+        header_size = len(build(dict.fromkeys(sizes, 0)))
+        begins, pos = {}, header_size
+        for name, _, _, _, data in variables:
+            if data is not None:
+                begins[name] = pos
+                pos += sizes[name]
+        for name, _, _, _, data in variables:
+            if data is None:
+                begins[name] = pos
+                pos += sizes[name]
+        self._file = open(path, "wb")
+        self._file.write(build(begins))
+        for name, _, _, _, data in variables:
+            if data is not None:
+                self._file.write(data.ljust(sizes[name], b"\x00"))
+
+    def write(self, coordinates, time=None, cell_lengths=None, cell_angles=None):
+        """Append frames. coordinates: (n, natoms, 3) in Angstrom."""
+        coordinates = np.asarray(coordinates)
+        n = len(coordinates)
+        records = np.zeros(n, dtype=self.record)
+        records["coordinates"] = coordinates
+        records["time"] = (
+            np.arange(self.nframes, self.nframes + n) if time is None else time
+        )
+        if self.box:
+            records["cell_lengths"] = cell_lengths
+            records["cell_angles"] = cell_angles
+        self._file.write(records.tobytes())
+        self.nframes += n
+
+    def close(self) -> None:
+        if self._file.closed:
+            return
+        self._file.seek(4)
+        self._file.write(struct.pack(">i", self.nframes))
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _name(name: str) -> bytes:
+    raw = name.encode()
+    return struct.pack(">i", len(raw)) + raw.ljust(_pad(len(raw)), b"\x00")
+
+
+def _attributes(attributes: dict) -> bytes:
+    if not attributes:
+        return struct.pack(">ii", 0, 0)
+    out = [struct.pack(">ii", NC_ATTRIBUTE, len(attributes))]
+    for name, value in attributes.items():
+        raw = value.encode()
+        out += [
+            _name(name),
+            struct.pack(">ii", NC_CHAR, len(raw)),
+            raw.ljust(_pad(len(raw)), b"\x00"),
+        ]
+    return b"".join(out)
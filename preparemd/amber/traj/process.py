@@ -0,0 +1,257 @@
+"""Post-processing of production trajectories without cpptraj.
+
+This does what the trajfix.in cpptraj script does::
+
+    unwrap :1-N
+    center :1-N@CA mass origin
+    rms first out rmsd.dat @CA
+    strip :SOD,WAT,TIP3,Cl-,Na+
+
+Only the solute atoms (atoms not in STRIP_RESIDUES) are read from the NetCDF
+trajectories, and the frames are processed in chunks with vectorized NumPy, so
+the memory use is bounded by the chunk size whatever the trajectory length.
+Triclinic boxes (e.g. truncated octahedra) are supported by unwrapping in
+fractional coordinates.
+"""
+
+import os
+from dataclasses import dataclass, field
+
+import numpy as np
+from loguru import logger
+
+from preparemd.amber.top import geometry, prmtop
+from preparemd.amber.traj import archive, netcdf, trr
+
+STRIP_RESIDUES = ("SOD", "WAT", "TIP3", "Cl-", "Na+")
+# 1チャンクで扱う座標の大きさの目安(バイト)
+CHUNK_BYTES = 64 * 1024 * 1024
+
+
+@dataclass
+class Selection:
+    """Atoms used by each step, as indices into the solute atoms."""
+
+    # 読み込む原子(トポロジー全体での番号)
+    solute: np.ndarray
+    unwrap: np.ndarray
+    center: np.ndarray
+    masses: np.ndarray
+    fit: np.ndarray
+
+
+def make_selection(
+    topology: prmtop.Topology,
+    resnumber: int = 0,
+    strip: tuple[str, ...] = STRIP_RESIDUES,
+    fitatom: str = "CA",
+) -> Selection:
+    """Atoms of ":1-resnumber" and ":1-resnumber@CA" among the solute atoms.
+
+    resnumber=0 means all residues that are not stripped.
+    """
+    stripped = topology.atoms_of_residues(strip)
+    keep = np.ones(topology.natoms, dtype=bool)
+    keep[stripped] = False
+    solute = np.flatnonzero(keep)
+    if len(solute) == 0:
+        raise ValueError("All atoms are stripped.")
+    residues = topology.residue_index[solute]
+    if resnumber <= 0:
+        resnumber = int(residues.max()) + 1
+    inrange = residues < resnumber
+    names = np.array(topology.atom_names)[solute]
+    center = np.flatnonzero(inrange & (names == fitatom))
+    if len(center) == 0:
+        raise ValueError(f"No {fitatom} atoms were found in :1-{resnumber}.")
+    return Selection(
+        solute=solute,
+        unwrap=np.flatnonzero(inrange),
+        center=center,
+        masses=topology.masses[solute][center],
+        fit=center,
+    )
+
+
+@dataclass
+class Unwrapper:
+    """Remove jumps across the periodic boundaries between frames.
+
+    The number of box vectors crossed by each atom is accumulated as integers,
+    so the state carried over between chunks is only the last frame.
+    """
+
+    previous: np.ndarray | None = None
+    images: np.ndarray | None = None
+
+    def __call__(self, coords: np.ndarray, boxes: np.ndarray | None) -> np.ndarray:
+        if boxes is None:
+            return coords
+        if self.previous is None:
+            self.previous = coords[0]
+            self.images = np.zeros_like(coords[0])
+        raw = np.concatenate([self.previous[None], coords])
+        # 各フレームの箱で変位を分数座標に直し、整数に丸めたものが跨いだ箱の数
+        inverse = np.linalg.inv(boxes)
+        frac = np.einsum("nai,nij->naj", np.diff(raw, axis=0), inverse)
+        images = self.images + np.cumsum(np.rint(frac), axis=0)
+        self.previous = coords[-1]
+        self.images = images[-1]
+        return coords - np.einsum("naj,nji->nai", images, boxes)
+
+
+@dataclass
+class Fitter:
+    """Fit frames onto the first frame ("rms first") and record the RMSD."""
+
+    reference: np.ndarray | None = None
+    rmsd: list[np.ndarray] = field(default_factory=list)
+
+    def __call__(self, coords: np.ndarray, atoms: np.ndarray) -> np.ndarray:
+        if self.reference is None:
+            self.reference = coords[0, atoms].copy()
+        ref_center = self.reference.mean(axis=0)
+        centers = coords[:, atoms].mean(axis=1)
+        rotations, rmsd = geometry.kabsch(
+            coords[:, atoms] - centers[:, None], self.reference - ref_center
+        )
+        self.rmsd.append(rmsd)
+        return (coords - centers[:, None]) @ rotations + ref_center
+
+
+def process_chunk(
+    coords: np.ndarray,
+    boxes: np.ndarray | None,
+    selection: Selection,
+    unwrapper: Unwrapper,
+    fitter: Fitter,
+) -> np.ndarray:
+    """unwrap, center and fit a chunk of solute coordinates (n, natoms, 3)."""
+    coords[:, selection.unwrap] = unwrapper(coords[:, selection.unwrap], boxes)
+    weights = selection.masses / selection.masses.sum()
+    centers = np.einsum("nai,a->ni", coords[:, selection.center], weights)
+    coords -= centers[:, None]
+    return fitter(coords, selection.fit)
+
+
+def open_writer(
+    path: str, natoms: int, box: bool, precision: float = archive.DEFAULT_PRECISION
+):
+    """TRR writer for *.trr, archive writer for *.arc and NetCDF writer for
+    other names."""
+    if path.endswith(".trr"):
+        return trr.TRRWriter(path, natoms)
+    if path.endswith(".arc"):
+        return archive.ArchiveWriter(path, natoms, precision=precision)
+    return netcdf.NetCDFWriter(path, natoms, box=box)
+
+
+def write_pdb(path: str, topology: prmtop.Topology, atoms: np.ndarray, coords):
+    """Write one frame of the atoms as a PDB file without a box."""
+    lines = []
+    for serial, (atom, xyz) in enumerate(zip(atoms, coords, strict=True), start=1):
+        name = topology.atom_names[atom]
+        name = f" {name:<3}" if len(name) < 4 else name
+        resnum = topology.residue_index[atom] + 1
+        resname = topology.residue_labels[topology.residue_index[atom]]
+        lines.append(
+            f"ATOM  {serial % 100000:5d} {name} {resname:>3}  {resnum % 10000:4d}    "
+            f"{xyz[0]:8.3f}{xyz[1]:8.3f}{xyz[2]:8.3f}  1.00  0.00\n"
+        )
+    lines.append("END\n")
+    with open(path, "w") as f:
+        f.writelines(lines)
+
+
+def fix_trajectories(
+    topfile: str,
+    trajins: list[str],
+    output: str,
+    resnumber: int = 0,
+    step: int = 50,
+    init_pdb: str = "",
+    rmsd_file: str = "rmsd.dat",
+    chunk_bytes: int = CHUNK_BYTES,
+    precision: float = archive.DEFAULT_PRECISION,
+) -> int:
+    """Unwrap, center, fit and strip trajectories into one output trajectory.
+
+    Args:
+        topfile: prmtopファイル。
+        trajins: NetCDFトラジェクトリ。この順に結合する。
+        output: 出力ファイル。拡張子が.trrならTRR、.arcなら索引付きの圧縮アーカイブ
+            (`archive.ArchiveWriter`)、それ以外はNetCDF。
+        resnumber: unwrapとcenterの対象の残基数(:1-resnumber)。0なら溶質すべて。
+        step: 各トラジェクトリからstepフレームごとに読み込む("trajin x 1 last step")。
+        init_pdb: 指定した場合、最初のフレームをPDBファイルに書き出す。
+        rmsd_file: 最初のフレームに対するCA原子のRMSD。
+        precision: アーカイブに保存する座標の精度(Å)。
+
+    Returns:
+        Number of written frames.
+    """
+    topology = prmtop.read_topology(topfile)
+    selection = make_selection(topology, resnumber)
+    natoms = len(selection.solute)
+    # 一時配列を含めて1フレームあたりおよそ4倍の大きさになる
+    chunk = max(1, chunk_bytes // (natoms * 3 * 8 * 4))
+    unwrapper, fitter = Unwrapper(), Fitter()
+    writer = None
+    try:
+        for segment, trajin in enumerate(trajins, start=1):
+            reader = netcdf.NetCDFReader(trajin)
+            if reader.natoms != topology.natoms:
+                raise ValueError(
+                    f"{trajin} has {reader.natoms} atoms, but {topfile} has "
+                    f"{topology.natoms} atoms."
+                )
+            if writer is None:
+                writer = open_writer(output, natoms, reader.has_box, precision)
+            frames = np.arange(0, reader.nframes, step)
+            for start in range(0, len(frames), chunk):
+                indices = frames[start : start + chunk]
+                data = reader.read(indices, selection.solute)
+                boxes = None
+                if data["cell_lengths"] is not None:
+                    boxes = geometry.box_vectors(
+                        data["cell_lengths"], data["cell_angles"]
+                    )
+                coords = process_chunk(
+                    data["coordinates"], boxes, selection, unwrapper, fitter
+                )
+                if init_pdb != "" and writer.nframes == 0:
+                    write_pdb(init_pdb, topology, selection.solute, coords[0])
+                # アーカイブには元のセグメントとフレーム番号も索引として残す
+                extra = {}
+                if isinstance(writer, archive.ArchiveWriter):
+                    extra = {"segment": segment, "frames": indices}
+                writer.write(
+                    coords,
+                    data["time"],
+                    data["cell_lengths"],
+                    data["cell_angles"],
+                    **extra,
+                )
+            logger.info(f"{trajin}: {len(frames)} frames")
+    finally:
+        if writer is not None:
+            writer.close()
+    if writer is None:
+        raise ValueError("No trajectory was given.")
+
+    rmsd = np.concatenate(fitter.rmsd) if fitter.rmsd else np.zeros(0)
+    if rmsd_file != "":
+        with open(rmsd_file, "w") as f:
+            f.write(f"#{'Frame':<7s} {'RMSD_00001':>12s}\n")
+            for i, value in enumerate(rmsd, start=1):
+                f.write(f"{i:8d} {value:12.4f}\n")
+    return writer.nframes
+
+
+def default_trajins(prdir: str = ".") -> list[str]:
+    """001/mdcrd, 002/mdcrd, ... in prdir."""
+    trajins, i = [], 1
+    while os.path.isfile(path := os.path.join(prdir, str(i).zfill(3), "mdcrd")):
+        trajins.append(path)
+        i += 1
+    return trajins
@@ -0,0 +1,70 @@
+"""Writer of GROMACS TRR trajectories (single precision, coordinates only).
+
+Each frame is an XDR (big endian) header followed by the box vectors and the
+coordinates in nm. This is the format that cpptraj writes for "trajout *.trr".
+"""
+
+import struct
+
+import numpy as np
+
+from preparemd.amber.top import geometry
+
+MAGIC = 1993
+VERSION = b"GMX_trn_file"
+
+
+class TRRWriter:
+    """Write frames to a TRR file."""
+
+    def __init__(self, path: str, natoms: int):
+        self.natoms = natoms
+        self.nframes = 0
+        self._file = open(path, "wb")
+
+    def write(self, coordinates, time=None, cell_lengths=None, cell_angles=None):
+        """Append frames. coordinates: (n, natoms, 3) in Angstrom."""
+        coordinates = np.asarray(coordinates)
+        n = len(coordinates)
+        times = np.arange(self.nframes, self.nframes + n) if time is None else time
+        boxes = None
+        if cell_lengths is not None:
+            boxes = geometry.box_vectors(cell_lengths, cell_angles) / 10.0
+        for i in range(n):
+            box_size = 0 if boxes is None else 36
+            header = struct.pack(
+                ">iii12s13iff",
+                MAGIC,
+                len(VERSION) + 1,
+                len(VERSION),
+                VERSION,
+                0,  # ir_size
+                0,  # e_size
+                box_size,
+                0,  # vir_size
+                0,  # pres_size
+                0,  # top_size
+                0,  # sym_size
+                self.natoms * 12,  # x_size
+                0,  # v_size
+                0,  # f_size
+                self.natoms,
+                self.nframes + i,  # step
+                0,  # nre
+                float(times[i]),
+                0.0,  # lambda
+            )
+            self._file.write(header)
+            if boxes is not None:
+                self._file.write(boxes[i].astype(">f4").tobytes())
+            self._file.write((coordinates[i] / 10.0).astype(">f4").tobytes())
+        self.nframes += n
+
+    def close(self) -> None:
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,260 @@
+import csv
+import json
+import os
+import time
+import tomllib
+import traceback
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from loguru import logger
+
+from preparemd.preparemd import add_cache_arguments, run_preparemd
+from preparemd.utils.log import log_setup
+from preparemd.utils.profile import PROFILE_FILE, aggregate_reports
+
+log_setup(level="INFO")
+
+# manifestで指定可能なキーと、その値の変換方法
+MANIFEST_KEYS = {
+    "file": str,
+    "distdir": str,
+    "strip": str,
+    "num_mddir": int,
+    "ns_per_mddir": int,
+    "ion_conc": int,
+    "boxsize": str,
+    "boxshape": str,
+    "rotate": str,
+    "trajprefix": str,
+    "sslink": str,
+    "machineenv": str,
+    "frcmod": list,
+    "prep": list,
+    "mol2": list,
+    "fftype": str,
+    "run_leap": bool,
+    "mdin": list,
+    "mdin_config": str,
+    "replicas": int,
+    "replica_seed": int,
+    "submit_mode": str,
+    "walltime": str,
+    "gpus_per_node": int,
+    "trajfix_parallel": bool,
+    "hmr": bool,
+    "resume_partial": bool,
+}
+
+
+def _to_bool(value) -> bool:
+    if isinstance(value, bool):
+        return value
+    if str(value).strip().lower() in ["1", "true", "yes", "on"]:
+        return True
+    if str(value).strip().lower() in ["0", "false", "no", "off"]:
+        return False
+    raise ValueError(f"Could not interpret {value} as a boolean value.")
+
+
+def _to_list(value) -> list | None:
+    """CSVでは複数の値を';'区切りで与える。mol2の値は空白を含むため。"""
+    if isinstance(value, list):
+        return [str(v) for v in value]
+    items = [v.strip() for v in str(value).split(";") if v.strip() != ""]
+    return items if items else None
+
+
+def normalize_system(entry: dict, defaults: dict | None = None) -> dict:
+    """Convert one manifest entry to keyword arguments of `run_preparemd`.
+
+    Args:
+        entry: One row of a CSV manifest or one [[system]] table of a TOML manifest.
+        defaults: Values applied to every system unless the entry overrides them.
+    Returns:
+        dict: keyword arguments for `run_preparemd`.
+    """
+    merged = dict(defaults or {})
+    merged.update({k: v for k, v in entry.items() if v is not None and v != ""})
+
+    unknown = set(merged) - set(MANIFEST_KEYS)
+    if unknown:
+        raise ValueError(f"Unknown manifest keys: {', '.join(sorted(unknown))}")
+    for key in ["file", "distdir"]:
+        if key not in merged:
+            raise ValueError(f"'{key}' is required for every system in a manifest.")
+
+    system = {}
+    for key, value in merged.items():
+        kind = MANIFEST_KEYS[key]
+        if kind is bool:
+            system[key] = _to_bool(value)
+        elif kind is list:
+            system[key] = _to_list(value)
+        else:
+            system[key] = kind(value)
+    return system
+
+
+def read_manifest(manifest: str) -> list[dict]:
+    """Read a CSV or TOML manifest file.
+
+    CSV: the header line contains option names (file, distdir, strip, boxsize, ...).
+         Multiple frcmod/prep/mol2 values are separated by ';'.
+    TOML: systems are given as [[system]] tables. An optional [defaults] table
+          is applied to all systems.
+    """
+    if not os.path.isfile(manifest):
+        raise FileNotFoundError(f"{manifest} was not found.")
+
+    if manifest.endswith(".toml"):
+        with open(manifest, "rb") as f:
+            content = tomllib.load(f)
+        defaults = content.get("defaults", {})
+        entries = content.get("system", [])
+    elif manifest.endswith(".csv"):
+        with open(manifest, newline="") as f:
+            entries = [
+                {k.strip(): v.strip() for k, v in row.items() if k is not None}
+                for row in csv.DictReader(f)
+            ]
+        defaults = {}
+    else:
+        raise ValueError("The manifest file must be a .csv or .toml file.")
+
+    systems = [normalize_system(entry, defaults) for entry in entries]
+    if len(systems) == 0:
+        raise ValueError(f"No systems were found in {manifest}.")
+    distdirs = [os.path.abspath(s["distdir"]) for s in systems]
+    if len(set(distdirs)) != len(distdirs):
+        raise ValueError("Each system in a manifest must have its own distdir.")
+    return systems
+
+
+def _run_system(system: dict) -> float:
+    """Worker process: run one pipeline and return its wall time."""
+    start = time.perf_counter()
+    run_preparemd(**system)
+    return time.perf_counter() - start
+
+
+def run_batch(systems: list[dict], workers: int = 1) -> list[dict]:
+    """Run pipelines of all systems concurrently with a process pool.
+
+    Each system runs in a new worker process. A failure of one system does not
+    stop the others. The result of each system
+    is returned as a dict with "distdir", "status", "elapsed" and "error" keys.
+    """
+    if workers < 1:
+        raise ValueError("The workers argument must be 1 or more.")
+
+    results = []
+    start = time.perf_counter()
+    # ru_maxrssはプロセスの最大値なので、系ごとに新しいプロセスで実行して
+    # profile.jsonのRSSに前の系の分が含まれないようにする
+    with ProcessPoolExecutor(max_workers=workers, max_tasks_per_child=1) as executor:
+        futures = {executor.submit(_run_system, s): s for s in systems}
+        for future in as_completed(futures):
+            system = futures[future]
+            try:
+                elapsed = future.result()
+            except Exception as e:
+                logger.error(f"{system['distdir']}: failed. {e}")
+                results.append(
+                    {
+                        "distdir": system["distdir"],
+                        "status": "failed",
+                        "elapsed": None,
+                        "error": "".join(traceback.format_exception_only(e)).strip(),
+                    }
+                )
+            else:
+                logger.info(f"{system['distdir']}: finished in {elapsed:.1f} s.")
+                results.append(
+                    {
+                        "distdir": system["distdir"],
+                        "status": "ok",
+                        "elapsed": elapsed,
+                        "error": "",
+                    }
+                )
+    total = time.perf_counter() - start
+    print_summary(results, total)
+    return results
+
+
+def print_summary(results: list[dict], total: float) -> None:
+    """Print failures and an aggregate throughput of a batch run."""
+    nok = sum(1 for r in results if r["status"] == "ok")
+    failed = [r for r in results if r["status"] != "ok"]
+    throughput = nok / (total / 60.0) if total > 0 else 0.0
+
+    print(f"Prepared {nok}/{len(results)} systems in {total:.1f} s.")
+    print(f"Throughput: {throughput:.2f} systems/minute")
+    for r in failed:
+        print(f"FAILED {r['distdir']}: {r['error']}")
+
+
+def write_profile_summary(systems: list[dict], outfile: str) -> None:
+    """Aggregate distdir/profile.json of all systems into one report."""
+    reports = []
+    for system in systems:
+        reportfile = os.path.join(system["distdir"], PROFILE_FILE)
+        if os.path.isfile(reportfile):
+            with open(reportfile) as f:
+                reports.append(json.load(f))
+    summary = aggregate_reports(reports)
+    with open(outfile, "w") as f:
+        json.dump(summary, f, indent=2)
+    logger.info(f"Aggregated profile report of {len(reports)} systems: {outfile}")
+
+
+def main():
+    parser = ArgumentParser(
+        description="Prepare MD input files for many systems listed in a manifest."
+    )
+    parser.add_argument(
+        "manifest",
+        help=(
+            "Path to a CSV or TOML manifest file. Each system takes the same options "
+            "as the preparemd command (file, distdir, strip, boxsize, fftype, ...)."
+        ),
+    )
+    parser.add_argument(
+        "--workers",
+        "-j",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="Number of systems prepared at the same time. Default: number of CPUs.",
+    )
+    add_cache_arguments(parser)
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        default=False,
+        help="Write distdir/profile.json of each system and aggregate them.",
+    )
+    parser.add_argument(
+        "--profile_report",
+        default="batch_profile.json",
+        help="Output file of the aggregated profile. Default: batch_profile.json.",
+    )
+    args = parser.parse_args()
+
+    systems = read_manifest(args.manifest)
+    for system in systems:
+        system.update(
+            use_cache=not args.no_cache,
+            cache_dir=args.cache_dir,
+            cache_size=args.cache_size,
+            profile=args.profile,
+        )
+    results = run_batch(systems, workers=args.workers)
+    if args.profile:
+        write_profile_summary(systems, args.profile_report)
+    if any(r["status"] != "ok" for r in results):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
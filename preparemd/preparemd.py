@@ -1,17 +1,353 @@
+import contextlib
+import os
 from argparse import ArgumentParser
 
-from preparemd.amber.md import prepareinputs, writetrajfix
-from preparemd.amber.top import makeleapin
+from loguru import logger
+
+from preparemd.amber.md import namelist, prepareinputs, submit, writetrajfix
+from preparemd.amber.top import leapin, makeleapin, prmtop
+from preparemd.utils import cache, manifest
 from preparemd.utils.log import log_setup
+from preparemd.utils.profile import Profiler, stage
 
 log_setup(level="INFO")
 
 
+def check_args(
+    num_mddir: int,
+    ns_per_mddir: int,
+    ion_conc: int,
+    replicas: int = 0,
+    gpus_per_node: int = 1,
+    hmr: bool = False,
+    run_leap: bool = True,
+) -> None:
+    """Validate numerical options before any file is generated."""
+    if num_mddir < 1:
+        raise ValueError("The num_mddir argument must be 1 or more.")
+    if ns_per_mddir < 1:
+        raise ValueError("The ns_per_mddir argument must be 1 or more.")
+    if ion_conc < 1:
+        raise ValueError("The ion_conc argument must be 1 or more.")
+    if replicas < 0:
+        raise ValueError("The replicas argument must be 0 or more.")
+    if gpus_per_node < 1:
+        raise ValueError("The gpus_per_node argument must be 1 or more.")
+    # HMRはleapで作ったleap.parm7に対して行うため、leapを実行しない場合は
+    # dt=0.004の入力だけが書かれて質量が再分配されないトポロジーになる
+    if hmr and not run_leap:
+        raise ValueError("The hmr option requires run_leap.")
+
+
+def run_preparemd(
+    file: str,
+    distdir: str,
+    strip: str = "",
+    num_mddir: int = 3,
+    ns_per_mddir: int = 50,
+    ion_conc: int = 150,
+    boxsize: str = "",
+    boxshape: str = "box",
+    rotate: str = "",
+    trajprefix: str = "",
+    sslink: str = "",
+    machineenv: str = "foodin",
+    frcmod: list | None = None,
+    prep: list | None = None,
+    mol2: list | None = None,
+    fftype: str = "ff19SB",
+    run_leap: bool = True,
+    use_cache: bool = True,
+    cache_dir: str = cache.DEFAULT_CACHE_DIR,
+    cache_size: float = cache.DEFAULT_CACHE_SIZE,
+    profile: bool = False,
+    mdin: list | None = None,
+    mdin_config: str = "",
+    replicas: int = 0,
+    replica_seed: int = 1,
+    submit_mode: str = "",
+    walltime: str = "",
+    gpus_per_node: int = 1,
+    trajfix_parallel: bool = False,
+    hmr: bool = False,
+    resume_partial: bool = False,
+) -> None:
+    """Run the whole preparation pipeline for one input structure.
+
+    The keyword arguments have the same meaning and defaults as the command line
+    options of `preparemd`. This function is also called by `preparemd-batch`
+    for every system listed in a manifest file.
+    If profile is True, wall time, CPU time and peak RSS of each stage and of each
+    external command are written to distdir/profile.json.
+    mdin and mdin_config override values of min*.in and md*.in
+    (see `preparemd.amber.md.namelist.parse_overrides` and `load_overrides`).
+    If replicas > 0, amber/rep01..repNN production trees sharing one topology and
+    one equilibration are made instead of amber/pr.
+    """
+    check_args(
+        num_mddir,
+        ns_per_mddir,
+        ion_conc,
+        replicas,
+        gpus_per_node,
+        hmr=hmr,
+        run_leap=run_leap,
+    )
+    if submit_mode != "":
+        submit.check_submit(machineenv, replicas, submit_mode)
+    mdin_overrides = namelist.merge_overrides(
+        namelist.load_overrides(mdin_config) if mdin_config != "" else None,
+        namelist.parse_overrides(mdin),
+    )
+
+    pdb4amber_cache = None
+    leap_cache = None
+    if use_cache:
+        pdb4amber_cache = cache.FileCache(cache_dir, "pdb4amber", cache_size)
+        leap_cache = cache.FileCache(cache_dir, "leap", cache_size)
+
+    profiler = Profiler() if profile else None
+    with profiler.activate() if profiler else contextlib.nullcontext():
+        try:
+            with stage("pdb4amber"):
+                resnumber, sslink_file = prepareinputs.run_pdb4amber(
+                    file,
+                    distdir,
+                    strip=strip,
+                    sslink_file=sslink,
+                    filecache=pdb4amber_cache,
+                )
+            with stage("pre2"):
+                pre2boxsize = prepareinputs.preparepre2file(
+                    distdir, rotate=rotate, sslink_file=sslink_file, boxshape=boxshape
+                )
+            with stage("makeleapin"):
+                makeleapin.makeleapin(
+                    distdir,
+                    boxsize=boxsize,
+                    pre2boxsize=pre2boxsize,
+                    ion_conc=ion_conc,
+                    sslink_file=sslink_file,
+                    fftype=fftype,
+                    frcmod=frcmod,
+                    prep=prep,
+                    mol2=mol2,
+                    boxshape=boxshape,
+                )
+            # amberディレクトリの生成ファイルは内容が変わったものだけ書き直す
+            filemanifest = manifest.Manifest(os.path.join(distdir, "amber"))
+            with stage("amberfiles"):
+                prepareinputs.prepareamberfiles(
+                    distdir,
+                    resnumber,
+                    num_mddir,
+                    ns_per_mddir,
+                    machineenv,
+                    filemanifest=filemanifest,
+                    mdin_overrides=mdin_overrides,
+                    replicas=replicas,
+                    replica_seed=replica_seed,
+                    submit_mode=submit_mode,
+                    walltime=walltime,
+                    gpus_per_node=gpus_per_node,
+                    hmr=hmr,
+                    resume_partial=resume_partial,
+                )
+            if run_leap:
+                with stage("leap"):
+                    prepareinputs.run_leap(
+                        distdir,
+                        boxsize,
+                        pre2boxsize,
+                        paramfiles=makeleapin.paramfile_names(frcmod, prep, mol2),
+                        filecache=leap_cache,
+                        boxshape=boxshape,
+                    )
+                if hmr:
+                    with stage("hmr"):
+                        parmfile = os.path.join(distdir, "top", "leap.parm7")
+                        count = prmtop.repartition_hydrogen_mass(parmfile)
+                        logger.info(f"Repartitioned {count} hydrogen masses.")
+            with stage("trajfix"):
+                writetrajfix.writetrajfix(
+                    distdir,
+                    resnumber,
+                    num_mddir,
+                    trajprefix,
+                    filemanifest=filemanifest,
+                    replicas=replicas,
+                    parallel=trajfix_parallel,
+                )
+            filemanifest.save()
+            filemanifest.log_report()
+        finally:
+            # 失敗した場合もそこまでの記録を書き出す
+            if profiler is not None:
+                os.makedirs(distdir, exist_ok=True)
+                logger.info(f"Profile report: {profiler.write(distdir)}")
+
+
+def add_cache_arguments(parser: ArgumentParser) -> None:
+    """Options of the on-disk cache of pdb4amber/tleap results."""
+    parser.add_argument(
+        "--no-cache",
+        dest="no_cache",
+        action="store_true",
+        default=False,
+        help="Do not reuse or store results of AmberTools commands in the cache.",
+    )
+    parser.add_argument(
+        "--cache_dir",
+        default=cache.DEFAULT_CACHE_DIR,
+        help=(
+            "Directory of the cache. It can be shared by several users. "
+            f"Default: $PREPAREMD_CACHE_DIR or {cache.DEFAULT_CACHE_DIR}."
+        ),
+    )
+    parser.add_argument(
+        "--cache_size",
+        type=float,
+        default=cache.DEFAULT_CACHE_SIZE,
+        help=(
+            "Size limit of each cache (MB). Least recently used entries are removed "
+            f"when it is exceeded. Default: {cache.DEFAULT_CACHE_SIZE}."
+        ),
+    )
+
+
+def add_amber_arguments(parser: ArgumentParser) -> None:
+    """Options of the files in the amber directory.
+
+    They are shared by `preparemd` and `preparemd-segments`, which rewrites the
+    amber directory and must be given the same values.
+    """
+    parser.add_argument(
+        "--trajprefix",
+        "-t",
+        default="",
+        help=(
+            'Prefix of trajectory. This is used in the "trajfix.in" file. e.g. "S36S36".'
+        ),
+    )
+    parser.add_argument(
+        "--trajfix_parallel",
+        action="store_true",
+        default=False,
+        help=(
+            "Write a cpptraj script per production segment (pr/trajfix/NNN.in) and "
+            "a merge script instead of trajfix.in, with pr/trajfix.sh that runs the "
+            "segments concurrently on local cores or as a job array."
+        ),
+    )
+    parser.add_argument(
+        "--machineenv",
+        "-m",
+        choices=["foodin", "flow", "yayoi", "tsubame"],
+        default="foodin",
+        help=(
+            "Choose server clusters where you want to run. "
+            "This will change the qsub/pjsub header lines. Default: foodin."
+        ),
+    )
+    parser.add_argument(
+        "--replicas",
+        type=int,
+        default=0,
+        help=(
+            "Number of independent replicas. If 1 or more, amber/rep01, rep02, ... "
+            "are made instead of amber/pr. They share the topology and the "
+            "minimize/heat runs, and differ only in the random seed of the initial "
+            "velocities of the production run. Default is 0 (no replicas)."
+        ),
+    )
+    parser.add_argument(
+        "--replica_seed",
+        type=int,
+        default=1,
+        help="Random seed (ig) of the first replica. Replica N uses this + N - 1.",
+    )
+    parser.add_argument(
+        "--submit",
+        dest="submit_mode",
+        choices=submit.SUBMIT_MODES,
+        default="",
+        help=(
+            "Write amber/submit.sh that submits minimize, heat and each production "
+            "segment as separate jobs chained with afterok dependencies. "
+            '"array" submits each segment as a job array of the replicas (SLURM only).'
+        ),
+    )
+    parser.add_argument(
+        "--walltime",
+        default="",
+        help=(
+            'Walltime of each job ("hh:mm:ss") in the run.sh files. '
+            "Useful with --submit to backfill short jobs. Default: 72:00:00 or none."
+        ),
+    )
+    parser.add_argument(
+        "--gpus_per_node",
+        type=int,
+        default=1,
+        help=(
+            "If 2 or more, write amber/gpu_dispatch.sh that requests a whole node "
+            "with this number of GPUs and runs independent segments (replicas or "
+            "systems) on each GPU with CUDA_VISIBLE_DEVICES. Default is 1."
+        ),
+    )
+    parser.add_argument(
+        "--hmr",
+        action="store_true",
+        default=False,
+        help=(
+            "Repartition the hydrogen masses of top/leap.parm7 (3.024 Da, except "
+            "water) and run the heat and production stages with dt=0.004. "
+            "nstlim and the output intervals are rescaled to keep the same times."
+        ),
+    )
+    parser.add_argument(
+        "--resume_partial",
+        action="store_true",
+        default=False,
+        help=(
+            "Continue a production segment stopped halfway (e.g. by a node failure) "
+            "from its last periodic restart (ntwr) and join the trajectories with "
+            "cpptraj. Finished segments are always skipped."
+        ),
+    )
+    parser.add_argument(
+        "--mdin",
+        action="append",
+        default=None,
+        help=(
+            "Override a value of the AMBER input files as [stage:][namelist.]key=value. "
+            'e.g. "cut=9.0" for all stages, "production:ntwx=10000" or '
+            '"heat:ewald.dsum_tol=1e-6". stage is minimize, heat or production. '
+            "The flag can be specified more than once."
+        ),
+    )
+    parser.add_argument(
+        "--mdin_config",
+        default="",
+        help=(
+            "TOML file with values of the AMBER input files to override. "
+            "Top-level tables ([cntrl], [ewald]) are applied to all stages and "
+            "[minimize.cntrl], [heat.cntrl], [production.cntrl] to one stage. "
+            "Values of --mdin take precedence."
+        ),
+    )
+
+
 def main():
     parser = ArgumentParser(
         description="Prepare MD input files using the provided PDB file and options."
     )
-    parser.add_argument("--file", "-f", required=True, help="Path to input pdb file.")
+    parser.add_argument(
+        "--file",
+        "-f",
+        required=True,
+        help="Path to input pdb or mmCIF (.cif) file.",
+    )
     parser.add_argument(
         "--distdir",
         "-o",
@@ -61,18 +397,23 @@ def main():
         ),
     )
     parser.add_argument(
-        "--rotate",
-        default="",
+        "--boxshape",
+        choices=leapin.BOXSHAPES,
+        default="box",
         help=(
-            'Rotate the solute. For example, "x 90" will rotate the solute 90 degrees around the x-axis.'
+            'Shape of the periodic boundary box. "box" is a rectangular box '
+            '(solvateBox) and "oct" is a truncated octahedron (solvateOct), which '
+            "needs about 23%% fewer water molecules for the same solute-image "
+            'distance. With "oct", the largest value of --boxsize is the edge of '
+            'the cube the octahedron is cut from. Default is "box".'
         ),
     )
     parser.add_argument(
-        "--trajprefix",
-        "-t",
+        "--rotate",
         default="",
         help=(
-            'Prefix of trajectory. This is used in the "trajfix.in" file. e.g. "S36S36".'
+            'Rotate the solute. For example, "x 90" will rotate the solute 90 degrees around the x-axis. '
+            '"auto" searches the orientation that minimizes the volume of the solvated box.'
         ),
     )
     parser.add_argument(
@@ -84,16 +425,6 @@ def main():
             "Set this value if you have a correct pair SS-bond list."
         ),
     )
-    parser.add_argument(
-        "--machineenv",
-        "-m",
-        choices=["foodin", "flow", "yayoi", "tsubame"],
-        default="foodin",
-        help=(
-            "Choose server clusters where you want to run. "
-            "This will change the qsub/pjsub header lines. Default: foodin."
-        ),
-    )
     parser.add_argument(
         "--frcmod",
         nargs="*",
@@ -127,39 +458,52 @@ def main():
             "Turning leap process off may be useful to prepare only amber MD files."
         ),
     )
+    add_cache_arguments(parser)
+    add_amber_arguments(parser)
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        default=False,
+        help=(
+            "Record wall time, CPU time and peak RSS of each stage and each "
+            "AmberTools command, and write them to distdir/profile.json."
+        ),
+    )
     args = parser.parse_args()
 
-    if args.num_mddir < 1:
-        raise ValueError("The num_mddir argument must be 1 or more.")
-    if args.ns_per_mddir < 1:
-        raise ValueError("The ns_per_mddir argument must be 1 or more.")
-    if args.ion_conc < 1:
-        raise ValueError("The ion_conc argument must be 1 or more.")
-
-    resnumber, sslink_file = prepareinputs.run_pdb4amber(
-        args.file, args.distdir, strip=args.strip, sslink_file=args.sslink
-    )
-    pre2boxsize = prepareinputs.preparepre2file(
-        args.distdir, rotate=args.rotate, sslink_file=sslink_file
-    )
-    prepareinputs.cys_to_cyx_in_pre2file(args.distdir, sslink_file=sslink_file)
-    makeleapin.makeleapin(
+    run_preparemd(
+        args.file,
         args.distdir,
-        boxsize=args.boxsize,
-        pre2boxsize=pre2boxsize,
+        strip=args.strip,
+        num_mddir=args.num_mddir,
+        ns_per_mddir=args.ns_per_mddir,
         ion_conc=args.ion_conc,
-        sslink_file=sslink_file,
-        fftype=args.fftype,
+        boxsize=args.boxsize,
+        boxshape=args.boxshape,
+        rotate=args.rotate,
+        trajprefix=args.trajprefix,
+        sslink=args.sslink,
+        machineenv=args.machineenv,
         frcmod=args.frcmod,
         prep=args.prep,
         mol2=args.mol2,
+        fftype=args.fftype,
+        run_leap=args.run_leap,
+        use_cache=not args.no_cache,
+        cache_dir=args.cache_dir,
+        cache_size=args.cache_size,
+        profile=args.profile,
+        mdin=args.mdin,
+        mdin_config=args.mdin_config,
+        replicas=args.replicas,
+        replica_seed=args.replica_seed,
+        submit_mode=args.submit_mode,
+        walltime=args.walltime,
+        gpus_per_node=args.gpus_per_node,
+        trajfix_parallel=args.trajfix_parallel,
+        hmr=args.hmr,
+        resume_partial=args.resume_partial,
     )
-    prepareinputs.prepareamberfiles(
-        args.distdir, resnumber, args.num_mddir, args.ns_per_mddir, args.machineenv
-    )
-    if args.run_leap:
-        prepareinputs.run_leap(args.distdir, args.boxsize, pre2boxsize)
-    writetrajfix.writetrajfix(args.distdir, resnumber, args.num_mddir, args.trajprefix)
 
 
 if __name__ == "__main__":
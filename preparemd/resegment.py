@@ -0,0 +1,202 @@
+import os
+from argparse import ArgumentParser
+
+from loguru import logger
+
+from preparemd.amber.md import (
+    namelist,
+    prepareinputs,
+    production,
+    segments,
+    submit,
+    timestep,
+    writetrajfix,
+)
+from preparemd.preparemd import add_amber_arguments
+from preparemd.utils import header, manifest
+from preparemd.utils.log import log_setup
+
+log_setup(level="INFO")
+
+
+def run_resegment(
+    distdir: str,
+    total_ns: float = 0.0,
+    fraction: float = segments.DEFAULT_FRACTION,
+    ns_per_day: float = 0.0,
+    trajprefix: str = "",
+    machineenv: str = "foodin",
+    mdin: list | None = None,
+    mdin_config: str = "",
+    replicas: int = 0,
+    replica_seed: int = 1,
+    submit_mode: str = "",
+    walltime: str = "",
+    gpus_per_node: int = 1,
+    trajfix_parallel: bool = False,
+    hmr: bool = False,
+    resume_partial: bool = False,
+    dry_run: bool = False,
+) -> dict:
+    """Resize the production segments of distdir/amber to fit the walltime.
+
+    ns/day is read from the heat stage (distdir/amber/heat) unless ns_per_day
+    is given. The other options must be the same as the ones given to
+    `preparemd`, because the whole amber directory is regenerated with them.
+    Only the files whose contents change are rewritten, and segments that are
+    no longer used are reported as stale.
+
+    Args:
+        total_ns: 全セグメントの合計時間(ns)。0の場合はtotalrun.shが実行する現在のセグメントの合計。
+        fraction: 1セグメントに使うwalltimeの割合。
+        walltime: 各ジョブの実行時間の上限。空の場合は72:00:00として計算する。
+        dry_run: Trueの場合は計算結果を返すだけでファイルを書き換えない。
+
+    Returns:
+        dict: The plan made by `segments.plan_segments`.
+    """
+    amberdir = os.path.join(distdir, "amber")
+    if submit_mode != "":
+        submit.check_submit(machineenv, replicas, submit_mode)
+    prdirs = segments.production_dirs(amberdir, replicas)
+    started = segments.started_segments(amberdir, replicas)
+    if started and not dry_run:
+        raise RuntimeError(
+            f"Production runs have already started ({', '.join(started)}). "
+            "The segments cannot be resized."
+        )
+    if total_ns <= 0:
+        total_ns = segments.current_total_ns(
+            os.path.join(amberdir, prdirs[0]), segments.generated_segments(amberdir)
+        )
+    if ns_per_day <= 0:
+        ns_per_day = segments.measure_ns_per_day(os.path.join(amberdir, "heat"))
+
+    mdin_overrides = namelist.merge_overrides(
+        namelist.load_overrides(mdin_config) if mdin_config != "" else None,
+        namelist.parse_overrides(mdin),
+    )
+    base = production.productionmdin(1)
+    timestep.set_timestep(base, timestep.stage_dt(hmr))
+    base.apply(mdin_overrides, "production")
+    plan = segments.plan_segments(
+        total_ns,
+        ns_per_day,
+        walltime or header.DEFAULT_WALLTIME,
+        fraction=fraction,
+        dt=base.cntrl["dt"],
+        step_unit=segments.step_unit(base),
+    )
+    logger.info(
+        f"{ns_per_day:.2f} ns/day: {plan['segments']} segments of "
+        f"{plan['ns_per_segment']:g} ns (nstlim={plan['nstlim']}, "
+        f"{plan['hours']:.1f} h each), {plan['total_ns']:g} ns in total."
+    )
+    if dry_run:
+        return plan
+
+    resnumber = prepareinputs._get_residues_from_pdb(
+        os.path.join(distdir, "top", "pre.pdb")
+    )
+    filemanifest = manifest.Manifest(amberdir)
+    prepareinputs.prepareamberfiles(
+        distdir,
+        resnumber,
+        plan["segments"],
+        1,
+        machineenv,
+        filemanifest=filemanifest,
+        mdin_overrides=mdin_overrides,
+        replicas=replicas,
+        replica_seed=replica_seed,
+        submit_mode=submit_mode,
+        walltime=walltime,
+        gpus_per_node=gpus_per_node,
+        nstlim=plan["nstlim"],
+        hmr=hmr,
+        resume_partial=resume_partial,
+    )
+    writetrajfix.writetrajfix(
+        distdir,
+        resnumber,
+        plan["segments"],
+        trajprefix,
+        filemanifest=filemanifest,
+        replicas=replicas,
+        parallel=trajfix_parallel,
+    )
+    filemanifest.save()
+    filemanifest.log_report()
+    return plan
+
+
+def main():
+    parser = ArgumentParser(
+        description=(
+            "Resize the production segments (amber/pr/NNN) so that each of them "
+            "finishes within the walltime, using ns/day measured in the heat stage."
+        )
+    )
+    parser.add_argument(
+        "--distdir",
+        "-o",
+        required=True,
+        help="Directory made by preparemd, which has the top and amber directories.",
+    )
+    parser.add_argument(
+        "--total_ns",
+        type=float,
+        default=0.0,
+        help=(
+            "Total nanoseconds of the production run. "
+            "Default: the total of the current segments."
+        ),
+    )
+    parser.add_argument(
+        "--fraction",
+        type=float,
+        default=segments.DEFAULT_FRACTION,
+        help=(
+            "Fraction of the walltime used by one segment. The rest is a margin "
+            "for the startup and a slower production run (the heat stage uses a "
+            f"shorter cutoff). Default: {segments.DEFAULT_FRACTION}."
+        ),
+    )
+    parser.add_argument(
+        "--ns_per_day",
+        type=float,
+        default=0.0,
+        help="Use this performance instead of the one measured in amber/heat.",
+    )
+    parser.add_argument(
+        "--dry_run",
+        action="store_true",
+        default=False,
+        help="Only show the number of segments and nstlim.",
+    )
+    add_amber_arguments(parser)
+    args = parser.parse_args()
+
+    run_resegment(
+        args.distdir,
+        total_ns=args.total_ns,
+        fraction=args.fraction,
+        ns_per_day=args.ns_per_day,
+        trajprefix=args.trajprefix,
+        machineenv=args.machineenv,
+        mdin=args.mdin,
+        mdin_config=args.mdin_config,
+        replicas=args.replicas,
+        replica_seed=args.replica_seed,
+        submit_mode=args.submit_mode,
+        walltime=args.walltime,
+        gpus_per_node=args.gpus_per_node,
+        trajfix_parallel=args.trajfix_parallel,
+        hmr=args.hmr,
+        resume_partial=args.resume_partial,
+        dry_run=args.dry_run,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+import os
+from argparse import ArgumentParser
+
+from loguru import logger
+
+from preparemd.amber.traj import archive, process
+from preparemd.utils.log import log_setup
+
+log_setup(level="INFO")
+
+
+def main():
+    parser = ArgumentParser(
+        description=(
+            "Unwrap, center, fit and strip the production trajectories "
+            "(NNN/mdcrd) without cpptraj. Run this in the amber/pr directory."
+        )
+    )
+    parser.add_argument(
+        "--parm",
+        "-p",
+        default="../../top/leap.parm7",
+        help="Topology file of the solvated system. Default: ../../top/leap.parm7.",
+    )
+    parser.add_argument(
+        "--trajin",
+        "-y",
+        nargs="+",
+        default=None,
+        help="NetCDF trajectories to be joined. Default: 001/mdcrd, 002/mdcrd, ...",
+    )
+    parser.add_argument(
+        "--resnumber",
+        "-r",
+        type=int,
+        default=0,
+        help=(
+            "Residues 1-resnumber are unwrapped and centered. "
+            "Default: all residues that are not stripped."
+        ),
+    )
+    parser.add_argument(
+        "--trajprefix",
+        default="",
+        help='Prefix of the output files, "{prefix}init.pdb" and "{prefix}traj.trr".',
+    )
+    parser.add_argument(
+        "--format",
+        choices=["trr", "nc", "arc"],
+        default="trr",
+        help=(
+            'Format of the output trajectory. "arc" is a chunked, compressed '
+            "archive with a frame index (traj.arc.idx.npz) for random access. "
+            "Default: trr."
+        ),
+    )
+    parser.add_argument(
+        "--precision",
+        type=float,
+        default=archive.DEFAULT_PRECISION,
+        help=(
+            "Precision (Angstrom) of the coordinates stored in the archive. "
+            f"Default: {archive.DEFAULT_PRECISION}."
+        ),
+    )
+    parser.add_argument(
+        "--step",
+        type=int,
+        default=50,
+        help="Read every step-th frame of each trajectory. Default: 50.",
+    )
+    parser.add_argument(
+        "--chunk_mb",
+        type=int,
+        default=process.CHUNK_BYTES // (1024 * 1024),
+        help=(
+            "Approximate memory (MB) for one chunk of frames. "
+            f"Default: {process.CHUNK_BYTES // (1024 * 1024)}."
+        ),
+    )
+    args = parser.parse_args()
+
+    trajins = args.trajin or process.default_trajins(".")
+    if len(trajins) == 0:
+        raise FileNotFoundError("No trajectory (NNN/mdcrd) was found.")
+    missing = [trajin for trajin in trajins if not os.path.isfile(trajin)]
+    if missing:
+        raise FileNotFoundError(f"{', '.join(missing)} was not found.")
+    output = f"{args.trajprefix}traj.{args.format}"
+    nframes = process.fix_trajectories(
+        args.parm,
+        trajins,
+        output,
+        resnumber=args.resnumber,
+        step=args.step,
+        init_pdb=f"{args.trajprefix}init.pdb",
+        chunk_bytes=args.chunk_mb * 1024 * 1024,
+        precision=args.precision,
+    )
+    logger.info(f"{nframes} frames were written to {output}.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import time
+
+from loguru import logger
+
+from preparemd.utils.log import log_setup
+
+log_setup(level="INFO")
+
+DEFAULT_CACHE_DIR = os.environ.get(
+    "PREPAREMD_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "preparemd")
+)
+DEFAULT_CACHE_SIZE = 2048  # MB
+
+
+def hash_file(path: str) -> str:
+    """sha256 of the file content."""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def make_key(*parts: str | bytes) -> str:
+    """Make a cache key from several strings/bytes.
+    Each part is hashed with its length so that ("ab", "c") and ("a", "bc") differ.
+    """
+    h = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode()
+        h.update(len(part).to_bytes(8, "little"))
+        h.update(part)
+    return h.hexdigest()
+
+
+class FileCache:
+    """Content-addressed on-disk cache of output files of external tools.
+
+    Each entry is a directory `{cachedir}/{namespace}/{key[:2]}/{key}` holding
+    copies of the output files. The modification time of an entry is updated
+    on every hit and the least recently used entries are removed when the total
+    size exceeds `max_size` (MB). Entries are created with an atomic rename, so
+    several processes can share one cache directory.
+    """
+
+    def __init__(
+        self,
+        cachedir: str = DEFAULT_CACHE_DIR,
+        namespace: str = "default",
+        max_size: float = DEFAULT_CACHE_SIZE,
+    ):
+        if max_size <= 0:
+            raise ValueError("The cache size must be more than 0 MB.")
+        self.rootdir = os.path.join(cachedir, namespace)
+        self.max_bytes = int(max_size * 1024 * 1024)
+        os.makedirs(self.rootdir, exist_ok=True)
+
+    def _entrydir(self, key: str) -> str:
+        return os.path.join(self.rootdir, key[:2], key)
+
+    def restore(
+        self, key: str, destdir: str, files: list[str], link: bool = False
+    ) -> bool:
+        """Restore cached files into destdir.
+
+        Args:
+            key: cache key.
+            destdir: directory where the files will be restored.
+            files: file names that must be restored. Names missing in the entry
+                   are skipped only if they were also missing when it was stored.
+            link: hardlink the files instead of copying them when possible.
+        Returns:
+            bool: True on a cache hit.
+        """
+        entrydir = self._entrydir(key)
+        if not os.path.isdir(entrydir):
+            return False
+        stored = set(os.listdir(entrydir))
+        for name in files:
+            if name not in stored:
+                continue
+            dest = os.path.join(destdir, name)
+            if os.path.lexists(dest):
+                os.remove(dest)
+            src = os.path.join(entrydir, name)
+            if link:
+                try:
+                    os.link(src, dest)
+                    continue
+                except OSError:
+                    pass
+            shutil.copy2(src, dest)
+        # LRUのためにアクセス時刻を更新する
+        now = time.time()
+        try:
+            os.utime(entrydir, (now, now))
+        except OSError:
+            pass
+        logger.info(f"Restored {', '.join(sorted(stored))} from cache {key[:12]}.")
+        return True
+
+    def store(self, key: str, srcdir: str, files: list[str]) -> None:
+        """Store existing files of srcdir as the entry of key."""
+        entrydir = self._entrydir(key)
+        if os.path.isdir(entrydir):
+            return
+        os.makedirs(os.path.dirname(entrydir), exist_ok=True)
+        tmpdir = tempfile.mkdtemp(prefix=".tmp-", dir=os.path.dirname(entrydir))
+        try:
+            for name in files:
+                src = os.path.join(srcdir, name)
+                if os.path.isfile(src):
+                    shutil.copy2(src, os.path.join(tmpdir, name))
+            os.rename(tmpdir, entrydir)
+        except OSError:
+            # 他のプロセスが同じエントリを先に作成した場合など
+            shutil.rmtree(tmpdir, ignore_errors=True)
+            if not os.path.isdir(entrydir):
+                raise
+        self.evict()
+
+    def _entries(self) -> list[tuple[float, int, str]]:
+        entries = []
+        for prefix in os.listdir(self.rootdir):
+            prefixdir = os.path.join(self.rootdir, prefix)
+            if not os.path.isdir(prefixdir):
+                continue
+            for key in os.listdir(prefixdir):
+                if key.startswith(".tmp-"):
+                    continue
+                entrydir = os.path.join(prefixdir, key)
+                try:
+                    mtime = os.stat(entrydir).st_mtime
+                    size = sum(
+                        os.stat(os.path.join(entrydir, name)).st_size
+                        for name in os.listdir(entrydir)
+                    )
+                except FileNotFoundError:
+                    continue
+                entries.append((mtime, size, entrydir))
+        return entries
+
+    def evict(self) -> None:
+        """Remove least recently used entries until the cache fits in max_size."""
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, entrydir in entries:
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(entrydir, ignore_errors=True)
+            total -= size
+            logger.info(f"Evicted {os.path.basename(entrydir)[:12]} from cache.")
@@ -1,16 +1,25 @@
 import textwrap
 
+# 各計算機環境のジョブスケジューラ
+SCHEDULERS = {"flow": "pjm", "yayoi": "pbs", "foodin": "slurm"}
+DEFAULT_WALLTIME = "72:00:00"
 
-def queue_header(machineenv: str) -> str:
-    """Switch queue_ header properly"""
+
+def queue_header(machineenv: str, walltime: str = "", gpus: int = 1) -> str:
+    """Switch queue_ header properly
+
+    Args:
+        walltime: 実行時間の上限("hh:mm:ss")。空の場合は各環境のデフォルト。
+        gpus: 2以上の場合はGPUをgpus枚持つノード全体を要求する。
+    """
     if machineenv == "flow":
         queue_header = textwrap.dedent(
             """\
             #!/bin/bash
             #PJM -L rscunit=cx
-            #PJM -L rscgrp=cx-share
-            #PJM -L gpu=1
-            #PJM -L elapse=72:00:00
+            #PJM -L rscgrp={rscgrp}
+            #PJM -L gpu={gpus}
+            #PJM -L elapse={walltime}
             #PJM -j
             # move to working directory
             test $PJM_O_WORKDIR && cd $PJM_O_WORKDIR
@@ -20,14 +29,18 @@ def queue_header(machineenv: str) -> str:
             module load amber24
             echo `hostname`
             """
+        ).format(
+            walltime=walltime or DEFAULT_WALLTIME,
+            rscgrp="cx-share" if gpus == 1 else "cx-single",
+            gpus=gpus,
         )
     elif machineenv == "yayoi":
         queue_header = textwrap.dedent(
             """\
             #!/bin/bash
             #queue_ -q default
-            #queue_ -l nodes=1:ppn=16:gpus=1
-            #queue_ -l walltime=72:00:00
+            #queue_ -l nodes=1:ppn=16:gpus={gpus}
+            #queue_ -l walltime={walltime}
 
             test $queue__O_WORKDIR && cd $queue__O_WORKDIR
             # run the environment module
@@ -43,14 +56,14 @@ def queue_header(machineenv: str) -> str:
             fi
             echo `hostname`
             """
-        )
+        ).format(walltime=walltime or DEFAULT_WALLTIME, gpus=gpus)
     elif machineenv == "foodin":
         queue_header = textwrap.dedent(
             """\
             #!/bin/bash
             #SBATCH -p q1
             #SBATCH -n 16
-            #SBATCH --gpus 1
+            #SBATCH --gpus {gpus}{exclusive}{time}
             #SBATCH -o %x.%j.out
             #SBATCH -e %x.%j.err
 
@@ -59,6 +72,10 @@ def queue_header(machineenv: str) -> str:
             module load amber24
             echo `hostname`
             """
+        ).format(
+            gpus=gpus,
+            exclusive="" if gpus == 1 else "\n#SBATCH --exclusive",
+            time=f"\n#SBATCH -t {walltime}" if walltime else "",
         )
 
     return queue_header
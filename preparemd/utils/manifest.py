@@ -0,0 +1,132 @@
+import hashlib
+import json
+import os
+
+from loguru import logger
+
+from preparemd.utils.log import log_setup
+
+log_setup(level="INFO")
+
+MANIFEST_FILE = ".preparemd_manifest.json"
+
+
+class Manifest:
+    """Record of the files generated in a directory with their content hashes.
+
+    `write` compares the new content with the recorded hash and writes the file
+    only when the content changed or the file on disk was modified or removed.
+    Files of the previous run that are not written again are reported as stale
+    and are left in place.
+    """
+
+    def __init__(self, rootdir: str):
+        self.rootdir = rootdir
+        self.manifestfile = os.path.join(rootdir, MANIFEST_FILE)
+        self.entries: dict[str, dict] = {}
+        if os.path.isfile(self.manifestfile):
+            try:
+                with open(self.manifestfile) as f:
+                    self.entries = json.load(f)["files"]
+            except (ValueError, KeyError):
+                logger.warning(f"{self.manifestfile} is broken. It will be rebuilt.")
+        self.added: list[str] = []
+        self.changed: list[str] = []
+        self.unchanged: list[str] = []
+
+    def _is_current(self, path: str, entry: dict | None, digest: str) -> bool:
+        """Whether the file on disk already has the content of digest."""
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return False
+        if entry is not None and entry["sha256"] == digest:
+            # 記録時からサイズ・更新時刻が変わっていなければ中身は読まない
+            if st.st_size == entry["size"] and st.st_mtime_ns == entry["mtime_ns"]:
+                return True
+        with open(path, "rb") as f:
+            return hashlib.sha256(f.read()).hexdigest() == digest
+
+    def write(self, path: str, content: str, executable: bool = False) -> bool:
+        """Write content to path if it differs from the file on disk.
+
+        Args:
+            path: Path to the file. It must be inside rootdir.
+            content: Text to be written.
+            executable: Set the permission to 0o755.
+        Returns:
+            bool: True if the file was written.
+        """
+        relpath = os.path.relpath(path, self.rootdir)
+        data = content.encode()
+        digest = hashlib.sha256(data).hexdigest()
+        entry = self.entries.get(relpath)
+        mode = 0o755 if executable else None
+
+        written = not self._is_current(path, entry, digest)
+        if written:
+            # 記録がなくても既にあるファイル(古いディレクトリの初回など)は上書きなのでchanged
+            existed = entry is not None or os.path.exists(path)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, mode="wb") as f:
+                f.write(data)
+            (self.changed if existed else self.added).append(relpath)
+        else:
+            self.unchanged.append(relpath)
+        if mode is not None and os.stat(path).st_mode & 0o777 != mode:
+            os.chmod(path, mode)
+
+        st = os.stat(path)
+        self.entries[relpath] = {
+            "sha256": digest,
+            "size": st.st_size,
+            "mtime_ns": st.st_mtime_ns,
+        }
+        return written
+
+    @property
+    def stale(self) -> list[str]:
+        """Files recorded in the manifest that were not written in this run."""
+        current = set(self.added + self.changed + self.unchanged)
+        return sorted(relpath for relpath in self.entries if relpath not in current)
+
+    def save(self) -> None:
+        """Write the manifest file. Stale entries are dropped."""
+        stale = set(self.stale)
+        files = {k: v for k, v in sorted(self.entries.items()) if k not in stale}
+        tmpfile = self.manifestfile + ".tmp"
+        with open(tmpfile, "w") as f:
+            json.dump({"files": files}, f, indent=1)
+        os.replace(tmpfile, self.manifestfile)
+
+    def report(self) -> dict:
+        return {
+            "added": self.added,
+            "changed": self.changed,
+            "unchanged": self.unchanged,
+            "stale": self.stale,
+        }
+
+    def log_report(self) -> None:
+        logger.info(
+            f"{self.rootdir}: {len(self.added)} added, {len(self.changed)} changed, "
+            f"{len(self.unchanged)} unchanged."
+        )
+        for relpath in self.changed:
+            logger.info(f"  changed: {relpath}")
+        for relpath in self.stale:
+            logger.warning(f"  {relpath} is no longer generated. Remove it if unused.")
+
+
+def write_file(
+    path: str, content: str, manifest: Manifest | None = None, executable: bool = False
+) -> None:
+    """Write content to path, through manifest if it is provided."""
+    if manifest is not None:
+        manifest.write(path, content, executable=executable)
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, mode="w") as f:
+        f.write(content)
+    if executable:
+        os.chmod(path, 0o755)
@@ -0,0 +1,170 @@
+import contextlib
+import contextvars
+import json
+import os
+import platform
+import sys
+import time
+
+from preparemd.utils import runner
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+PROFILE_FILE = "profile.json"
+
+_active: contextvars.ContextVar = contextvars.ContextVar("profiler", default=None)
+
+
+def _rusage() -> dict:
+    """CPU time (s) and peak RSS (KB) of this process and of its children.
+
+    The peak RSS is ru_maxrss, i.e. the high-water mark since the process
+    started, not the peak of a period.
+    """
+    if resource is None:
+        return {
+            "cpu": time.process_time(),
+            "children_cpu": 0.0,
+            "rss": 0,
+            "children_rss": 0,
+        }
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    # macOSではru_maxrssの単位がbyteになっている
+    scale = 1024 if sys.platform == "darwin" else 1
+    return {
+        "cpu": own.ru_utime + own.ru_stime,
+        "children_cpu": children.ru_utime + children.ru_stime,
+        "rss": own.ru_maxrss // scale,
+        "children_rss": children.ru_maxrss // scale,
+    }
+
+
+class Profiler:
+    """Record wall time, CPU time and peak RSS of each pipeline stage.
+
+    External commands launched during a stage (see `preparemd.utils.runner`)
+    are listed in the stage with their own wall time, CPU time and exit status.
+    The RSS values (``*maxrss_so_far_kb``) are the high-water marks of this
+    process and of all its finished children up to the end of the stage, so a
+    stage only shows a new peak when it is larger than the previous ones.
+    """
+
+    def __init__(self):
+        self.stages: list[dict] = []
+        self._names: list[str] = []
+        self._start = time.perf_counter()
+        self._start_usage = _rusage()
+
+    @contextlib.contextmanager
+    def activate(self):
+        """Make this profiler the target of `preparemd.utils.profile.stage`."""
+        token = _active.set(self)
+        try:
+            yield self
+        finally:
+            _active.reset(token)
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        self._names.append(name)
+        fullname = "/".join(self._names)
+        ncommands = runner.history_count()
+        usage = _rusage()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            end = _rusage()
+            self._names.pop()
+            commands = [
+                {
+                    "cmd": " ".join(r.cmd),
+                    "returncode": r.returncode,
+                    "timed_out": r.timed_out,
+                    "wall": r.elapsed,
+                    "cpu": r.cpu_time,
+                    "children_maxrss_so_far_kb": r.max_rss,
+                }
+                for r in runner.get_history_since(ncommands)
+            ]
+            self.stages.append(
+                {
+                    "name": fullname,
+                    "wall": elapsed,
+                    "cpu": end["cpu"] - usage["cpu"],
+                    "children_cpu": end["children_cpu"] - usage["children_cpu"],
+                    "maxrss_so_far_kb": end["rss"],
+                    "children_maxrss_so_far_kb": end["children_rss"],
+                    "commands": commands,
+                }
+            )
+
+    def report(self) -> dict:
+        end = _rusage()
+        return {
+            "hostname": platform.node(),
+            "total": {
+                "wall": time.perf_counter() - self._start,
+                "cpu": end["cpu"] - self._start_usage["cpu"],
+                "children_cpu": end["children_cpu"] - self._start_usage["children_cpu"],
+                "maxrss_so_far_kb": end["rss"],
+                "children_maxrss_so_far_kb": end["children_rss"],
+            },
+            "stages": self.stages,
+        }
+
+    def write(self, distdir: str) -> str:
+        """Write the report as distdir/profile.json."""
+        outfile = os.path.join(distdir, PROFILE_FILE)
+        with open(outfile, "w") as f:
+            json.dump(self.report(), f, indent=2)
+        return outfile
+
+
+@contextlib.contextmanager
+def stage(name: str):
+    """Record a stage in the active profiler. Does nothing without one."""
+    profiler = _active.get()
+    if profiler is None:
+        yield
+    else:
+        with profiler.stage(name):
+            yield
+
+
+def aggregate_reports(reports: list[dict]) -> dict:
+    """Aggregate profile reports of many systems by stage name."""
+    stages = {}
+    for report in reports:
+        for s in report["stages"]:
+            agg = stages.setdefault(
+                s["name"],
+                {
+                    "count": 0,
+                    "wall_total": 0.0,
+                    "wall_max": 0.0,
+                    "cpu_total": 0.0,
+                    "children_cpu_total": 0.0,
+                    "maxrss_so_far_kb_max": 0,
+                },
+            )
+            agg["count"] += 1
+            agg["wall_total"] += s["wall"]
+            agg["wall_max"] = max(agg["wall_max"], s["wall"])
+            agg["cpu_total"] += s["cpu"]
+            agg["children_cpu_total"] += s["children_cpu"]
+            agg["maxrss_so_far_kb_max"] = max(
+                agg["maxrss_so_far_kb_max"], s["maxrss_so_far_kb"]
+            )
+    for agg in stages.values():
+        agg["wall_mean"] = agg["wall_total"] / agg["count"]
+    return {
+        "systems": len(reports),
+        "wall_total": sum(r["total"]["wall"] for r in reports),
+        "stages": stages,
+    }
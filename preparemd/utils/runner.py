@@ -0,0 +1,258 @@
+import asyncio
+import collections
+import shutil
+import subprocess
+import sys
+import threading
+import time
+from dataclasses import dataclass, field
+
+from loguru import logger
+
+from preparemd.utils.log import log_setup
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+log_setup(level="INFO")
+
+
+@dataclass
+class CommandResult:
+    """Record of one external command call."""
+
+    cmd: list[str]
+    cwd: str | None
+    returncode: int | None
+    elapsed: float
+    stdout: bytes = field(default=b"", repr=False)
+    stderr: bytes = field(default=b"", repr=False)
+    timed_out: bool = False
+    # 子プロセス全体のrusageの差分から求めるため、同時に複数のコマンドを
+    # 実行している場合には他のコマンドの分も含まれる
+    cpu_time: float | None = None
+    # ru_maxrssは終了した子プロセス全体の最大値で、このコマンド単独の値ではない
+    max_rss: int | None = None
+
+    @property
+    def name(self) -> str:
+        return self.cmd[0].split("/")[-1]
+
+
+# 長く動くプロセス(preparemd-batchのワーカーなど)でも増え続けないように、
+# 直近の記録だけを残す
+HISTORY_SIZE = 1000
+
+_history: collections.deque[CommandResult] = collections.deque(maxlen=HISTORY_SIZE)
+_history_count = 0
+_history_lock = threading.Lock()
+
+
+def _record(result: CommandResult) -> None:
+    global _history_count
+    with _history_lock:
+        _history.append(result)
+        _history_count += 1
+
+
+def get_history() -> list[CommandResult]:
+    """Return a copy of the last HISTORY_SIZE command records of this process."""
+    with _history_lock:
+        return list(_history)
+
+
+def history_count() -> int:
+    """Number of commands recorded so far, including the ones already dropped."""
+    with _history_lock:
+        return _history_count
+
+
+def get_history_since(count: int) -> list[CommandResult]:
+    """Records of the commands run after `history_count()` returned count.
+
+    Records older than the last HISTORY_SIZE are not included.
+    """
+    with _history_lock:
+        new = min(_history_count - count, len(_history))
+        return list(_history)[len(_history) - new :] if new > 0 else []
+
+
+def clear_history() -> None:
+    with _history_lock:
+        _history.clear()
+
+
+def find_command(name: str) -> str:
+    """Return the full path of an AmberTools command."""
+    path = shutil.which(name)
+    if path is None:
+        raise RuntimeError(
+            f"{name} command was not found. Make sure AmberTools was correctly installed."
+        )
+    return path
+
+
+def _children_usage() -> tuple[float, int] | None:
+    """CPU time (s) and peak RSS (KB) of finished child processes."""
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    scale = 1024 if sys.platform == "darwin" else 1
+    return usage.ru_utime + usage.ru_stime, usage.ru_maxrss // scale
+
+
+def _check(
+    result: CommandResult, check: bool, usage: tuple[float, int] | None
+) -> CommandResult:
+    end = _children_usage()
+    if usage is not None and end is not None:
+        result.cpu_time = end[0] - usage[0]
+        result.max_rss = end[1]
+    _record(result)
+    if result.timed_out:
+        logger.error(f"{result.name} timed out after {result.elapsed:.1f} s.")
+        if check:
+            raise RuntimeError(f"{result.name} process timed out.")
+    elif result.returncode:
+        logger.error(
+            f"{result.name} exited with status {result.returncode} "
+            f"after {result.elapsed:.1f} s."
+        )
+        if check:
+            print(result.stdout.decode(errors="replace"))
+            print(result.stderr.decode(errors="replace"))
+            raise RuntimeError(f"{result.name} process failed.")
+    else:
+        logger.debug(f"{result.name} finished in {result.elapsed:.1f} s.")
+    return result
+
+
+def run_command(
+    cmd: list[str],
+    cwd: str | None = None,
+    timeout: float | None = None,
+    input: bytes | None = None,
+    check: bool = True,
+) -> CommandResult:
+    """Run an external command and wait for it.
+
+    Args:
+        cmd: command and its arguments.
+        cwd: working directory of the command. The working directory of the
+             Python process is not changed.
+        timeout: seconds until the command is killed. None means no limit.
+        input: bytes passed to the standard input of the command.
+        check: if True, raise RuntimeError when the command fails or times out.
+    Returns:
+        CommandResult: exit status, wall time and outputs of the command.
+    """
+    logger.info(f"Launching subprocess {' '.join(cmd)}")
+    usage = _children_usage()
+    start = time.perf_counter()
+    try:
+        process = subprocess.run(
+            cmd,
+            cwd=cwd,
+            input=input,
+            stdin=subprocess.DEVNULL if input is None else None,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            timeout=timeout,
+        )
+    except subprocess.TimeoutExpired as e:
+        result = CommandResult(
+            cmd=list(cmd),
+            cwd=cwd,
+            returncode=None,
+            elapsed=time.perf_counter() - start,
+            stdout=e.stdout or b"",
+            stderr=e.stderr or b"",
+            timed_out=True,
+        )
+    else:
+        result = CommandResult(
+            cmd=list(cmd),
+            cwd=cwd,
+            returncode=process.returncode,
+            elapsed=time.perf_counter() - start,
+            stdout=process.stdout,
+            stderr=process.stderr,
+        )
+    return _check(result, check, usage)
+
+
+async def run_command_async(
+    cmd: list[str],
+    cwd: str | None = None,
+    timeout: float | None = None,
+    input: bytes | None = None,
+    check: bool = True,
+    limiter: asyncio.Semaphore | None = None,
+) -> CommandResult:
+    """asyncio version of `run_command`.
+
+    Args:
+        limiter: if given, the command waits for this semaphore before it is
+                 launched. Use it to limit the number of concurrent commands.
+    """
+    if limiter is not None:
+        async with limiter:
+            return await run_command_async(cmd, cwd, timeout, input, check)
+
+    logger.info(f"Launching subprocess {' '.join(cmd)}")
+    usage = _children_usage()
+    start = time.perf_counter()
+    process = await asyncio.create_subprocess_exec(
+        *cmd,
+        cwd=cwd,
+        stdin=subprocess.PIPE if input is not None else subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+    try:
+        stdout, stderr = await asyncio.wait_for(process.communicate(input), timeout)
+    except TimeoutError:
+        process.kill()
+        stdout, stderr = await process.communicate()
+        result = CommandResult(
+            cmd=list(cmd),
+            cwd=cwd,
+            returncode=None,
+            elapsed=time.perf_counter() - start,
+            stdout=stdout,
+            stderr=stderr,
+            timed_out=True,
+        )
+    else:
+        result = CommandResult(
+            cmd=list(cmd),
+            cwd=cwd,
+            returncode=process.returncode,
+            elapsed=time.perf_counter() - start,
+            stdout=stdout,
+            stderr=stderr,
+        )
+    return _check(result, check, usage)
+
+
+async def run_commands_async(
+    jobs: list[dict], max_concurrency: int = 4
+) -> list[CommandResult | BaseException]:
+    """Run many commands with at most `max_concurrency` of them at the same time.
+
+    Args:
+        jobs: keyword arguments of `run_command_async` for each command,
+              e.g. [{"cmd": [...], "cwd": "sys1/top", "timeout": 600}, ...].
+        max_concurrency: maximum number of commands running at the same time.
+    Returns:
+        list: CommandResult or the raised exception of each job, in the order of `jobs`.
+    """
+    if max_concurrency < 1:
+        raise ValueError("The max_concurrency argument must be 1 or more.")
+    limiter = asyncio.Semaphore(max_concurrency)
+    return await asyncio.gather(
+        *[run_command_async(**job, limiter=limiter) for job in jobs],
+        return_exceptions=True,
+    )
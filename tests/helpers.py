@@ -0,0 +1,77 @@
+"""Test data shared by several test modules."""
+
+RECORD = """\
+ NSTEP = {nstep:8d}   TIME(PS) =    {time:8.3f}  TEMP(K) =   300.12  PRESS =    -5.3
+ Etot   =   -123456.7890  EKtot   =     23456.7890  EPtot      = {eptot:14.4f}
+ BOND   =       123.4567  ANGLE   =       345.6789  DIHED      = {dihed:14.4f}
+ 1-4 NB =       111.1111  1-4 EEL =      2222.2222  VDWAALS    =     33333.3333
+ EELEC  =   -444444.4444  EHBOND  =         0.0000  RESTRAINT  =         0.0000
+ EKCMT  =      5555.5555  VIRIAL  =      6666.6666  VOLUME     =    777777.7777
+                                                    Density    =         1.0123
+ Ewald error estimate:   0.1234E-03
+ ------------------------------------------------------------------------------
+
+"""
+
+TIMINGS = """\
+|  Final Performance Info:
+|     -----------------------------------------------------
+|     Average timings for last    5000 steps:
+|     Elapsed(s) =      10.00 Per Step(ms) =       2.00
+|         ns/day =      90.00   seconds/ns =     960.00
+|
+|     Average timings for all steps:
+|     Elapsed(s) =     100.00 Per Step(ms) =       2.00
+|         ns/day =      86.40   seconds/ns =    1000.00
+|     -----------------------------------------------------
+
+|  Master Setup CPU time:            0.50 seconds
+|  Master Total wall time:         101    seconds     0.03 hours
+"""
+
+
+def make_mdout(eptots, dihed=456.789):
+    lines = ["| Run on 01/01/2024 at 00:00:00\n", "   4.  RESULTS\n\n"]
+    for i, eptot in enumerate(eptots, start=1):
+        lines.append(
+            RECORD.format(nstep=i * 5000, time=i * 10.0, eptot=eptot, dihed=dihed)
+        )
+    n = len(eptots)
+    lines.append(f"      A V E R A G E S   O V E R    {n} S T E P S\n\n")
+    lines.append(
+        RECORD.format(nstep=n * 5000, time=n * 10.0, eptot=sum(eptots) / n, dihed=dihed)
+    )
+    lines.append("      R M S  F L U C T U A T I O N S\n\n")
+    lines.append(RECORD.format(nstep=n * 5000, time=n * 10.0, eptot=1.5, dihed=0.5))
+    lines.append(TIMINGS)
+    return "".join(lines)
+
+
+# ALA(N, H, CA, HA), WAT(O, H1, H2)
+PRMTOP = """\
+%VERSION  VERSION_STAMP = V0001.000
+%FLAG POINTERS
+%FORMAT(10I8)
+       7       0       0       0       0       0       0       0       0       0
+       0       2       0       0       0       0       0       0       0       0
+%FLAG ATOM_NAME
+%FORMAT(20a4)
+N   H   CA  HA  O   H1  H2
+%FLAG MASS
+%FORMAT(5E16.8)
+  1.40100000E+01  1.00800000E+00  1.20100000E+01  1.00800000E+00  1.60000000E+01
+  1.00800000E+00  1.00800000E+00
+%FLAG RESIDUE_LABEL
+%FORMAT(20a4)
+ALA WAT
+%FLAG RESIDUE_POINTER
+%FORMAT(10I8)
+       1       5
+%FLAG BONDS_INC_HYDROGEN
+%FORMAT(10I8)
+       0       3       1       9       6       1      12      15       2      12
+      18       2      15      18       3
+%FLAG BOX_DIMENSIONS
+%FORMAT(5E16.8)
+  9.00000000E+01  3.00000000E+01  3.00000000E+01  3.00000000E+01
+"""
@@ -1,7 +1,59 @@
-from preparemd.amber.md.prepareinputs import _get_residues_from_pdb
+from preparemd.amber.md.prepareinputs import _get_leap_version, _get_residues_from_pdb
+from preparemd.amber.top.leapin import calculate_ion_nums, leapininput
+from preparemd.amber.top.makeleapin import paramfile_names
 
 
 def test_get_residues_from_pdb():
     pdbfile = "testfiles/1lke_af3/pre2.pdb"
     residues = _get_residues_from_pdb(pdbfile)
     assert residues == 363
+
+
+def test_paramfile_names():
+    names = paramfile_names(
+        ["/path/to/frcmod.lig1"],
+        None,
+        ["ACA = loadMol2 /path/to/Acetyl_CoA.mol2", "DON = loadMol2 DON.mol2"],
+    )
+    assert names == ["frcmod.lig1", "Acetyl_CoA.mol2", "DON.mol2"]
+
+
+def test_calculate_ion_nums_oct():
+    assert calculate_ion_nums("120 120 120", 150) == 156
+    # 切頂八面体は立方体の半分の体積
+    assert calculate_ion_nums("120 100 80", 150, boxshape="oct") == 78
+
+
+def test_leapininput_oct(tmp_path):
+    sslink = tmp_path / "sslink"
+    sslink.write_text("")
+    content = leapininput(
+        "", "60 50 40", 150, str(sslink), "ff19SB", None, None, None, boxshape="oct"
+    )
+    assert "solvateOct mol OPCBOX 10.0" in content
+    assert "solvateBox" not in content
+
+    content = leapininput(
+        "80 80 80", "60 50 40", 150, str(sslink), "ff14SB", None, None, None, "oct"
+    )
+    assert "solvateOct mol TIP3PBOX 10.0" in content
+
+
+def test_get_leap_version(tmp_path, monkeypatch):
+    bindir = tmp_path / "bin"
+    parmdir = tmp_path / "dat" / "leap" / "parm"
+    bindir.mkdir()
+    parmdir.mkdir(parents=True)
+    # tleapは実行されない
+    tleap = bindir / "tleap"
+    tleap.write_text(f"#!/bin/sh\ntouch {tmp_path}/executed\n")
+    tleap.chmod(0o755)
+    (bindir / "teLeap").write_text("")
+    (parmdir / "parm19.dat").write_text("old")
+    monkeypatch.setenv("AMBERHOME", str(tmp_path))
+    monkeypatch.setenv("PATH", str(bindir))
+
+    version = _get_leap_version.__wrapped__(str(tleap))
+    assert not (tmp_path / "executed").exists()
+    (parmdir / "parm19.dat").write_text("new parameters")
+    assert _get_leap_version.__wrapped__(str(tleap)) != version
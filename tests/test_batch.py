@@ -0,0 +1,70 @@
+import pytest
+
+from preparemd.batch import read_manifest, run_batch
+from preparemd.preparemd import run_preparemd
+
+
+def test_read_manifest_toml(tmp_path):
+    manifest = tmp_path / "systems.toml"
+    manifest.write_text(
+        "[defaults]\n"
+        'fftype = "ff14SB"\n'
+        "num_mddir = 5\n"
+        "\n"
+        "[[system]]\n"
+        'file = "a.pdb"\n'
+        'distdir = "out/a"\n'
+        "\n"
+        "[[system]]\n"
+        'file = "b.pdb"\n'
+        'distdir = "out/b"\n'
+        "num_mddir = 2\n"
+        'frcmod = ["frcmod.lig1", "frcmod.lig2"]\n'
+    )
+    systems = read_manifest(str(manifest))
+    assert systems[0] == {
+        "fftype": "ff14SB",
+        "num_mddir": 5,
+        "file": "a.pdb",
+        "distdir": "out/a",
+    }
+    assert systems[1]["num_mddir"] == 2
+    assert systems[1]["frcmod"] == ["frcmod.lig1", "frcmod.lig2"]
+
+
+def test_read_manifest_csv(tmp_path):
+    manifest = tmp_path / "systems.csv"
+    manifest.write_text(
+        "file,distdir,ion_conc,mol2,run_leap\n"
+        "a.pdb,out/a,100,ACA = loadMol2 ACA.mol2;DON = loadMol2 DON.mol2,false\n"
+        "b.pdb,out/b,,,\n"
+    )
+    systems = read_manifest(str(manifest))
+    assert systems[0]["ion_conc"] == 100
+    assert systems[0]["mol2"] == ["ACA = loadMol2 ACA.mol2", "DON = loadMol2 DON.mol2"]
+    assert systems[0]["run_leap"] is False
+    assert systems[1] == {"file": "b.pdb", "distdir": "out/b"}
+
+
+def test_read_manifest_duplicated_distdir(tmp_path):
+    manifest = tmp_path / "systems.csv"
+    manifest.write_text("file,distdir\na.pdb,out\nb.pdb,out\n")
+    with pytest.raises(ValueError):
+        read_manifest(str(manifest))
+
+
+def test_hmr_requires_leap(tmp_path):
+    # leapを実行しない場合はleap.parm7の質量が再分配されない
+    with pytest.raises(ValueError):
+        run_preparemd("a.pdb", str(tmp_path / "out"), run_leap=False, hmr=True)
+    assert not (tmp_path / "out").exists()
+
+
+def test_run_batch_failures(tmp_path):
+    systems = [
+        {"file": "a.pdb", "distdir": str(tmp_path / name), "num_mddir": 0}
+        for name in ("a", "b")
+    ]
+    results = run_batch(systems, workers=2)
+    assert [r["status"] for r in results] == ["failed", "failed"]
+    assert all("num_mddir" in r["error"] for r in results)
@@ -0,0 +1,48 @@
+import os
+
+from preparemd.utils.cache import FileCache, make_key
+
+
+def test_make_key():
+    assert make_key("ab", "c") != make_key("a", "bc")
+    assert make_key("ab", "c") == make_key(b"ab", b"c")
+
+
+def test_filecache_store_restore(tmp_path):
+    srcdir = tmp_path / "src"
+    srcdir.mkdir()
+    (srcdir / "pre.pdb").write_text("ATOM\n")
+    (srcdir / "pre_sslink").write_text("1 2\n")
+
+    filecache = FileCache(str(tmp_path / "cache"), "pdb4amber", max_size=1)
+    key = make_key("input", "strip", "version")
+    files = ["pre.pdb", "pre_sslink", "pre_renum.txt"]
+    assert not filecache.restore(key, str(tmp_path), files)
+    filecache.store(key, str(srcdir), files)
+
+    destdir = tmp_path / "dest"
+    destdir.mkdir()
+    assert filecache.restore(key, str(destdir), files, link=True)
+    assert (destdir / "pre.pdb").read_text() == "ATOM\n"
+    assert (destdir / "pre_sslink").read_text() == "1 2\n"
+    assert not (destdir / "pre_renum.txt").exists()
+
+
+def test_filecache_lru_eviction(tmp_path):
+    srcdir = tmp_path / "src"
+    srcdir.mkdir()
+    (srcdir / "leap.parm7").write_bytes(b"x" * 400 * 1024)
+
+    # 1 MBの上限に400 KBのエントリが3つ入ると、最も古いものが消される
+    filecache = FileCache(str(tmp_path / "cache"), "leap", max_size=1)
+    for i, key in enumerate(["a" * 64, "b" * 64]):
+        filecache.store(key, str(srcdir), ["leap.parm7"])
+        entry = os.path.join(filecache.rootdir, key[:2], key)
+        os.utime(entry, (1000 + i, 1000 + i))
+    # "a"を参照して最近使ったことにする
+    assert filecache.restore("a" * 64, str(tmp_path), ["leap.parm7"])
+    filecache.store("c" * 64, str(srcdir), ["leap.parm7"])
+
+    assert filecache.restore("a" * 64, str(tmp_path), ["leap.parm7"])
+    assert not filecache.restore("b" * 64, str(tmp_path), ["leap.parm7"])
+    assert filecache.restore("c" * 64, str(tmp_path), ["leap.parm7"])
@@ -0,0 +1,77 @@
+import os
+import subprocess
+
+from preparemd.amber.md.dispatch import dispatchscript, tasklist
+from preparemd.utils.header import queue_header
+
+
+def test_queue_header_whole_node():
+    assert "#SBATCH --gpus 4\n#SBATCH --exclusive\n" in queue_header("foodin", gpus=4)
+    assert "#PJM -L gpu=8\n" in queue_header("flow", gpus=8)
+
+
+def test_tasklist():
+    assert tasklist(2, replicas=2) == (
+        "minimize\n"
+        "heat minimize\n"
+        "rep01/pr/001 heat\n"
+        "rep02/pr/001 heat\n"
+        "rep01/pr/002 rep01/pr/001\n"
+        "rep02/pr/002 rep02/pr/001\n"
+    )
+
+
+def test_dispatchscript(tmp_path):
+    amber = tmp_path / "amber"
+    tasks = tasklist(2, replicas=3)
+    for line in tasks.splitlines():
+        taskdir = amber / line.split()[0]
+        taskdir.mkdir(parents=True)
+        status = 1 if line.startswith("rep02/pr/001") else 0
+        (taskdir / "run.sh").write_text(
+            f"echo $CUDA_VISIBLE_DEVICES > gpu.txt\nexit {status}\n"
+        )
+    (amber / "tasks.txt").write_text(tasks)
+    script = amber / "gpu_dispatch.sh"
+    script.write_text(dispatchscript("foodin", 2))
+
+    result = subprocess.run(
+        ["bash", str(script)],
+        env={
+            **{k: v for k, v in os.environ.items() if k != "CUDA_VISIBLE_DEVICES"},
+            "POLL": "0.05",
+        },
+        capture_output=True,
+        text=True,
+    )
+    assert result.returncode == 1
+    assert (amber / "rep03" / "pr" / "002" / "dispatch.done").exists()
+    assert not (amber / "rep02" / "pr" / "001" / "dispatch.done").exists()
+    # 失敗したタスクに依存するタスクは実行されない
+    assert not (amber / "rep02" / "pr" / "002" / "gpu.txt").exists()
+    gpus = {(amber / d / "gpu.txt").read_text().strip() for d in ["minimize", "heat"]}
+    assert gpus <= {"0", "1"}
+
+
+def test_dispatchscript_visible_devices(tmp_path):
+    amber = tmp_path / "amber"
+    tasks = tasklist(1)
+    for line in tasks.splitlines():
+        taskdir = amber / line.split()[0]
+        taskdir.mkdir(parents=True)
+        (taskdir / "run.sh").write_text("echo $CUDA_VISIBLE_DEVICES > gpu.txt\n")
+    (amber / "tasks.txt").write_text(tasks)
+    script = amber / "gpu_dispatch.sh"
+    script.write_text(dispatchscript("foodin", 4))
+
+    # スケジューラが割り当てたGPU(4, 5)だけを使う
+    result = subprocess.run(
+        ["bash", str(script)],
+        env={**os.environ, "POLL": "0.05", "CUDA_VISIBLE_DEVICES": "4,5"},
+        capture_output=True,
+        text=True,
+    )
+    assert result.returncode == 0
+    assert "Only 2 GPUs are visible" in result.stdout
+    gpus = {(amber / d / "gpu.txt").read_text().strip() for d in ["heat", "pr/001"]}
+    assert gpus <= {"4", "5"}
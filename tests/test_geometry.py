@@ -0,0 +1,84 @@
+import numpy as np
+import pytest
+
+from preparemd.amber.md.prepareinputs import preparepre2file
+from preparemd.amber.top.geometry import (
+    bounding_box,
+    minimum_volume_rotation,
+    padded_volume,
+    parse_rotate,
+    rotate_string,
+)
+
+
+def test_parse_rotate():
+    matrix = parse_rotate("rotate z 90")
+    np.testing.assert_allclose(matrix @ [1.0, 0.0, 0.0], [0.0, 1.0, 0.0], atol=1e-12)
+    matrix = parse_rotate("x 90 y 90")
+    np.testing.assert_allclose(matrix @ [0.0, 1.0, 0.0], [1.0, 0.0, 0.0], atol=1e-12)
+    with pytest.raises(ValueError):
+        parse_rotate("z")
+
+
+def test_rotate_string():
+    matrix = parse_rotate("x 10 y -20 z 30")
+    assert rotate_string(matrix) == "x 10 y -20 z 30"
+    np.testing.assert_allclose(parse_rotate(rotate_string(matrix)), matrix)
+    # cpptrajと同じく、書いた順番によらずx, y, zの順に回転させる
+    np.testing.assert_allclose(parse_rotate("z 30 x 10 y -20"), matrix)
+    assert rotate_string(parse_rotate("z 90 x 90")) == "x 90 y 0 z 90"
+    with pytest.raises(ValueError):
+        parse_rotate("z 90 x 90 z 10")
+    with pytest.raises(ValueError):
+        parse_rotate("w 90")
+
+
+def test_minimum_volume_rotation():
+    # x, y, z軸のいずれとも平行でない細長い棒
+    rod = np.linspace(0.0, 60.0, 61)[:, None] * np.array([1.0, 1.0, 1.0]) / np.sqrt(3)
+    rotation = minimum_volume_rotation(rod, np.full(len(rod), 1.5))
+    box = bounding_box(rod @ rotation.T, np.full(len(rod), 1.5))
+    np.testing.assert_allclose(sorted(box), [3.0, 3.0, 63.0], atol=0.1)
+    assert padded_volume(rod, rotation=rotation) < padded_volume(rod)
+
+
+def test_bounding_box():
+    coords = np.array([[0.0, 0.0, 0.0], [1.0, 2.0, 3.0]])
+    np.testing.assert_allclose(bounding_box(coords), [1.0, 2.0, 3.0])
+    np.testing.assert_allclose(bounding_box(coords, np.ones(2)), [3.0, 4.0, 5.0])
+
+
+def test_preparepre2file(tmp_path):
+    (tmp_path / "top").mkdir()
+    with open("testfiles/1lke_af3/pre2.pdb") as f:
+        pre = [line for line in f if not line.startswith("CRYST1")]
+    (tmp_path / "top" / "pre.pdb").write_text("".join(pre))
+
+    boxsize = preparepre2file(str(tmp_path))
+    assert boxsize == "52.888 84.132 57.100"
+    with open(tmp_path / "top" / "pre2.pdb") as f:
+        lines = f.readlines()
+    assert lines[0].startswith("CRYST1   52.888   84.132   57.100")
+    assert not any("CYX" in line for line in lines)
+    ca = np.array(
+        [
+            [float(line[30:38]), float(line[38:46]), float(line[46:54])]
+            for line in lines
+            if line.startswith("ATOM  ") and line[12:16].strip() == "CA"
+        ]
+    )
+    np.testing.assert_allclose(ca.mean(axis=0), [0.0, 0.0, 0.0], atol=1e-3)
+
+
+def test_preparepre2file_auto(tmp_path):
+    (tmp_path / "top").mkdir()
+    with open("testfiles/1lke_af3/pre2.pdb") as f:
+        pre = [line for line in f if not line.startswith("CRYST1")]
+    (tmp_path / "top" / "pre.pdb").write_text("".join(pre))
+
+    boxsize = preparepre2file(str(tmp_path), rotate="auto")
+    with open(tmp_path / "top" / "pre2.pdb") as f:
+        lines = f.readlines()
+    assert lines[1].startswith("REMARK   1 PREPAREMD ROTATE x ")
+    box = np.array([float(x) for x in boxsize.split()])
+    assert np.prod(box + 20.0) < (52.888 + 20.0) * (84.132 + 20.0) * (57.100 + 20.0)
@@ -0,0 +1,38 @@
+from preparemd.amber.md.heat import heatinput
+
+
+def test_heatinput():
+    weights = [10.0, 10.0, 5.0, 2.0, 1.0, 0.5, 0.2, 0.1, 0.0]
+    md1 = heatinput(120, weights, 1)
+    assert "    irest=0,                        ! DO NOT restart" in md1
+    assert "    nstlim=100000,                  ! Number of MD steps" in md1
+    assert "    tempi=10.0,  " in md1
+    assert "    restraintmask=':1-120 & !@H=',   ! Atoms to be restrained\n" in md1
+    assert md1.count("ntp=") == 1
+    assert md1.endswith(
+        "&wt TYPE='TEMP0', istep1=0, istep2=100000, value1=10.0, value2=300.0, /\n"
+        "&wt TYPE='END' /\n"
+    )
+
+    md3 = heatinput(120, weights, 3)
+    assert "    ntx=5,  " in md3
+    assert "    restraint_wt=5.0,  " in md3
+    assert "tempi" not in md3
+    assert md3.endswith(
+        "&wt type='DUMPFREQ', istep1=5000, /\n"
+        "&wt type='END' /\n"
+        "DISANG=dist1.rst\n"
+        "DUMPAVE=dist1.dat\n"
+    )
+
+
+def test_heatinput_hmr():
+    weights = [10.0, 10.0, 5.0, 2.0, 1.0, 0.5, 0.2, 0.1, 0.0]
+    md1 = heatinput(120, weights, 1, hmr=True)
+    assert "    dt=0.004,  " in md1
+    # 同じ200 psになる
+    assert "    nstlim=50000,                   ! Number of MD steps ( 200 ps )" in md1
+    assert "istep1=0, istep2=50000," in md1
+    md3 = heatinput(120, weights, 3, hmr=True)
+    assert "    ntwx=2500,  " in md3
+    assert "&wt type='DUMPFREQ', istep1=2500, /\n" in md3
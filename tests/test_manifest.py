@@ -0,0 +1,57 @@
+import os
+
+from preparemd.amber.md.prepareinputs import prepareamberfiles
+from preparemd.utils.manifest import Manifest
+
+
+def test_manifest_write(tmp_path):
+    path = str(tmp_path / "sub" / "run.sh")
+    manifest = Manifest(str(tmp_path))
+    assert manifest.write(path, "echo 1\n", executable=True)
+    assert os.stat(path).st_mode & 0o777 == 0o755
+    manifest.save()
+
+    manifest = Manifest(str(tmp_path))
+    assert not manifest.write(path, "echo 1\n", executable=True)
+    assert manifest.write(path, "echo 2\n", executable=True)
+    assert manifest.report()["changed"] == ["sub/run.sh"]
+
+    # 手で編集されたファイルは書き直す
+    with open(path, "w") as f:
+        f.write("edited\n")
+    assert Manifest(str(tmp_path)).write(path, "echo 1\n")
+
+
+def test_manifest_write_unrecorded(tmp_path):
+    # manifestに記録のない既存のファイル(古いディレクトリ)
+    old = tmp_path / "old.in"
+    old.write_text("old\n")
+    same = tmp_path / "same.in"
+    same.write_text("same\n")
+    manifest = Manifest(str(tmp_path))
+    assert manifest.write(str(old), "new\n")
+    assert not manifest.write(str(same), "same\n")
+    assert manifest.write(str(tmp_path / "new.in"), "new\n")
+    report = manifest.report()
+    assert report["changed"] == ["old.in"]
+    assert report["unchanged"] == ["same.in"]
+    assert report["added"] == ["new.in"]
+
+
+def test_prepareamberfiles_incremental(tmp_path):
+    distdir = str(tmp_path)
+    report = prepareamberfiles(distdir, 100, 3, 50, "foodin")
+    assert "heat/run.sh" in report["added"]
+    assert len(report["added"]) == len(set(report["added"]))
+    assert report["changed"] == []
+
+    mdin = tmp_path / "amber" / "pr" / "001" / "md.in"
+    mtime = os.stat(mdin).st_mtime_ns
+    report = prepareamberfiles(distdir, 100, 2, 50, "foodin")
+    assert report["added"] == []
+    assert report["changed"] == ["totalrun.sh"]
+    assert report["stale"] == ["pr/003/md.in", "pr/003/run.sh"]
+    assert os.stat(mdin).st_mtime_ns == mtime
+
+    report = prepareamberfiles(distdir, 120, 2, 50, "foodin")
+    assert sorted(report["changed"]) == [f"heat/md{i}.in" for i in range(1, 10)]
@@ -0,0 +1,37 @@
+import math
+
+import pytest
+from helpers import make_mdout
+
+from preparemd.amber.md import mdout
+
+
+def test_read_mdout(tmp_path):
+    path = tmp_path / "md.out"
+    path.write_text(make_mdout([-100.0, -200.0, -300.0]))
+    result = mdout.read_mdout(str(path))
+    assert len(result) == 3
+    assert list(result.records["NSTEP"]) == [5000, 10000, 15000]
+    assert list(result.records["EPtot"]) == [-100.0, -200.0, -300.0]
+    assert result.records["1-4 NB"][0] == pytest.approx(111.1111)
+    assert result.records["Density"][2] == pytest.approx(1.0123)
+    assert result.averaged_steps == 3
+    assert result.averages["EPtot"] == pytest.approx(-200.0)
+    assert result.averages["DIHED"] == pytest.approx(456.789)
+    assert result.fluctuations["EPtot"] == pytest.approx(1.5)
+    assert result.timings["ns/day"] == 86.4
+    assert result.timings["Per Step(ms)"] == 2.0
+    assert result.timings["wall_time(s)"] == 101
+
+
+def test_parse_mdout_unfinished():
+    # 書き出し途中の計算には平均も速度もない。桁あふれした値はnan
+    text = make_mdout([-100.0, -200.0]).split("      A V E R A G E S")[0]
+    text = text.replace("-200.0000", "**************", 1)
+    result = mdout.parse_mdout(text.splitlines(keepends=True))
+    assert result.averages == {}
+    assert result.timings == {}
+    assert math.isnan(result.records["EPtot"][1])
+    assert result.average("EPtot") == -100.0
+    with pytest.raises(KeyError):
+        result.average("ESURF")
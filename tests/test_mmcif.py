@@ -0,0 +1,55 @@
+import gemmi
+
+from preparemd.amber.top.mmcif import MAX_PDB_RESNUM, is_mmcif, mmcif_to_pdb_string
+
+
+def test_is_mmcif():
+    assert is_mmcif("testfiles/1lke_af3/1lke_model.cif")
+    assert is_mmcif("model.CIF.gz")
+    assert not is_mmcif("testfiles/1lke_af3/pre2.pdb")
+
+
+def test_mmcif_to_pdb_string():
+    pdbtext = mmcif_to_pdb_string("testfiles/1lke_af3/1lke_model.cif")
+    lines = [
+        line for line in pdbtext.splitlines() if line.startswith(("ATOM", "HETATM"))
+    ]
+    assert len(lines) == 1500
+    assert not any(line.startswith("CRYST1") for line in pdbtext.splitlines())
+    resnums = []
+    for line in lines:
+        if int(line[22:26]) not in resnums:
+            resnums.append(int(line[22:26]))
+    assert resnums == list(range(1, 186))
+
+
+def test_mmcif_to_pdb_string_long_chain(tmp_path):
+    # PDBの残基番号の上限(9999)を超える1本の鎖
+    nres = MAX_PDB_RESNUM + 2
+    st = gemmi.Structure()
+    model = gemmi.Model("1")
+    chain = gemmi.Chain("AAA")
+    for i in range(1, nres + 1):
+        residue = gemmi.Residue()
+        residue.name = "GLY"
+        residue.seqid = gemmi.SeqId(i, " ")
+        atom = gemmi.Atom()
+        atom.name = "CA"
+        atom.element = gemmi.Element("C")
+        atom.pos = gemmi.Position(i * 3.8, 0.0, 0.0)
+        residue.add_atom(atom)
+        chain.add_residue(residue)
+    model.add_chain(chain)
+    st.add_model(model)
+    st.setup_entities()
+    path = tmp_path / "long.cif"
+    st.make_mmcif_document().write_file(str(path))
+
+    pdblines = mmcif_to_pdb_string(str(path)).splitlines()
+    lines = [line for line in pdblines if line.startswith(("ATOM", "HETATM"))]
+    assert len(lines) == nres
+    # 鎖は分けない(途中にTERを入れない)
+    assert sum(line.startswith("TER") for line in pdblines) <= 1
+    assert {line[21] for line in lines} == {"A"}
+    resnums = [int(line[22:26]) for line in lines]
+    assert resnums[MAX_PDB_RESNUM - 1 :] == [MAX_PDB_RESNUM, 1, 2]
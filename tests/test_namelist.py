@@ -0,0 +1,75 @@
+import pytest
+
+from preparemd.amber.md import namelist
+from preparemd.amber.md.minimize import min1input
+from preparemd.amber.md.production import productioninput
+
+
+def test_format_value():
+    assert namelist.format_value(0.000001) == "0.000001"
+    assert namelist.format_value(300.0) == "300.0"
+    assert namelist.format_value(-1) == "-1"
+    assert namelist.format_value(":WAT", '"') == '":WAT"'
+    assert namelist.parse_value("1.0d-5") == (1.0e-5, "'")
+    assert namelist.parse_value("':1-10 & !@H='") == (":1-10 & !@H=", "'")
+
+
+def test_parse_mdin_roundtrip():
+    for text in [min1input(), productioninput(True, 50)]:
+        mdin = namelist.parse_mdin(text)
+        assert mdin.render() == text
+
+    mdin = namelist.parse_mdin(
+        "title\n"
+        " &cntrl\n"
+        "  imin=0, nstlim=1000,  ! two entries\n"
+        "  restraintmask=':1-10 & !@H=',\n"
+        "!  irest=1,\n"
+        " /\n"
+        " &wt type='END' /\n"
+        "DISANG=dist1.rst\n"
+    )
+    assert mdin.cntrl["nstlim"] == 1000
+    assert mdin.cntrl.entries[1].comment == "two entries"
+    assert mdin.cntrl["restraintmask"] == ":1-10 & !@H="
+    assert "irest" not in mdin.cntrl
+    assert mdin.namelist("wt")["type"] == "END"
+    assert mdin.trailer == ["DISANG=dist1.rst"]
+
+
+def test_copy_and_set():
+    base = namelist.parse_mdin(productioninput(False, 50))
+    replica = base.copy()
+    replica.cntrl.set("ig", 12345)
+    replica.cntrl.set("tempi", 300.0, before="temp0")
+    assert base.cntrl["ig"] == -1
+    keys = [e.key for e in replica.cntrl.entries]
+    assert keys.index("tempi") == keys.index("temp0") - 1
+    assert "ig=12345,             ! Random seed" in replica.render()
+
+
+def test_overrides(tmp_path):
+    overrides = namelist.parse_overrides(
+        ["cut=9.0", "production:ntwx=10000", "heat:ewald.dsum_tol=1e-5"]
+    )
+    assert overrides == {
+        "*": {"cntrl": {"cut": 9.0}},
+        "production": {"cntrl": {"ntwx": 10000}},
+        "heat": {"ewald": {"dsum_tol": 1e-5}},
+    }
+    with pytest.raises(ValueError):
+        namelist.parse_overrides(["md:cut=9.0"])
+
+    config = tmp_path / "mdin.toml"
+    config.write_text("[cntrl]\ncut = 12.0\n\n[production.cntrl]\nntpr = 1000\n")
+    merged = namelist.merge_overrides(namelist.load_overrides(str(config)), overrides)
+    assert merged["*"]["cntrl"]["cut"] == 9.0
+    assert merged["production"]["cntrl"] == {"ntpr": 1000, "ntwx": 10000}
+
+    mdin = namelist.parse_mdin(productioninput(False, 50))
+    mdin.apply(merged, "production")
+    assert mdin.cntrl["cut"] == 9.0
+    assert mdin.cntrl["ntwx"] == 10000
+    assert "ewald" not in [n.name for n in mdin.namelists]
+    mdin.apply(merged, "heat")
+    assert [n.name for n in mdin.namelists] == ["cntrl", "ewald", "wt", "wt"]
@@ -0,0 +1,86 @@
+import os
+import stat
+
+import numpy as np
+import pytest
+
+from preparemd.amber.md.prepareinputs import cys_to_cyx_in_pre2file, preparepre2file
+from preparemd.amber.top import pdbstream
+
+
+def _residue_names(pdbfile, resnums):
+    names = {}
+    with open(pdbfile) as f:
+        for line in f:
+            if line.startswith("ATOM  ") and int(line[22:26]) in resnums:
+                names[int(line[22:26])] = line[17:20]
+    return names
+
+
+def test_preparepre2file_with_sslink(tmp_path):
+    (tmp_path / "top").mkdir()
+    with open("testfiles/1lke_af3/pre2.pdb") as f:
+        pre = [line for line in f if not line.startswith("CRYST1")]
+    (tmp_path / "top" / "pre.pdb").write_text("".join(pre))
+    sslink = tmp_path / "top" / "pre_sslink"
+    sslink.write_text("205 225\n284 317\n")
+
+    preparepre2file(str(tmp_path), sslink_file=str(sslink))
+    pre2file = str(tmp_path / "top" / "pre2.pdb")
+    names = _residue_names(pre2file, {205, 225, 284, 285, 300, 317})
+    assert names == {
+        205: "CYX",
+        225: "CYX",
+        284: "CYX",
+        285: "CYS",
+        300: "CYS",
+        317: "CYX",
+    }
+
+    with open(pre2file) as f:
+        onepass = f.read()
+
+    # sslinkを渡さずに作ったpre2.pdbを後から書き換えても同じ結果になる
+    preparepre2file(str(tmp_path))
+    cys_to_cyx_in_pre2file(str(tmp_path), str(sslink))
+    with open(pre2file) as f:
+        assert f.read() == onepass
+
+
+def test_cys_to_cyx_not_cys():
+    transform = pdbstream.cys_to_cyx({1})
+    line = "ATOM      1  N   ASN A   1       2.420   7.463  19.071  1.00 80.51           N  \n"
+    with pytest.raises(Exception, match="Residue 1 is not CYS residue."):
+        transform(line)
+
+
+def test_move_coordinates():
+    line = "ATOM      2  CA  ASN A   1       2.000   8.000  19.000  1.00 82.96           C  \n"
+    rotation = np.array([[0.0, -1.0, 0.0], [1.0, 0.0, 0.0], [0.0, 0.0, 1.0]])
+    transform = pdbstream.compose(
+        [
+            pdbstream.move_coordinates(np.array([1.0, 1.0, 1.0]), rotation),
+            pdbstream.drop_records("CRYST1"),
+        ]
+    )
+    assert transform(line) == (
+        "ATOM      2  CA  ASN A   1      -7.000   1.000  18.000  1.00 82.96           C  \n"
+    )
+    assert transform("CRYST1   52.600   84.082   57.050  90.00  90.00  90.00\n") is None
+
+
+def test_rewrite_mode(tmp_path):
+    pdbfile = tmp_path / "pre.pdb"
+    pdbfile.write_text("ATOM\n")
+    pdbfile.chmod(0o640)
+    umask = os.umask(0o022)
+    try:
+        # 既存のファイルはパーミッションを保つ(mkstempの0600にしない)
+        pdbstream.rewrite(str(pdbfile), str(pdbfile), [str.lower])
+        assert stat.S_IMODE(pdbfile.stat().st_mode) == 0o640
+        assert pdbfile.read_text() == "atom\n"
+        # 新しいファイルはumaskに従う
+        pdbstream.rewrite(str(pdbfile), str(tmp_path / "new.pdb"), [])
+        assert stat.S_IMODE((tmp_path / "new.pdb").stat().st_mode) == 0o644
+    finally:
+        os.umask(umask)
@@ -0,0 +1,72 @@
+from helpers import PRMTOP, make_mdout
+
+import prepare_aMD
+from preparemd.amber.md.production import productioninput
+
+PDB = """\
+ATOM      1  CA  ALA A   1       0.000   0.000   0.000  1.00  0.00           C
+ATOM      2  CA  ALA A   2       3.800   0.000   0.000  1.00  0.00           C
+ATOM      3  O   WAT A   3       9.000   0.000   0.000  1.00  0.00           O
+END
+"""
+
+
+def test_write_amdinputfiles(tmp_path, monkeypatch):
+    amber = tmp_path / "amber"
+    (tmp_path / "top").mkdir()
+    (tmp_path / "top" / "leap.pdb").write_text(PDB)
+    for i, rep in enumerate(["rep01", "rep02"]):
+        prdir = amber / rep / "pr" / "002"
+        prdir.mkdir(parents=True)
+        (prdir / "md.out").write_text(make_mdout([-100.0 * (i + 1)]))
+        (prdir / "run.sh").write_text('rstfile="../001/md.rst7"\n-i md.in\n')
+        (prdir / "md.in").write_text(productioninput(True, 50, hmr=i == 1))
+
+    calls = []
+    count = prepare_aMD._get_res_atom_number
+
+    def counting(pdbfile):
+        calls.append(pdbfile)
+        return count(pdbfile)
+
+    monkeypatch.setattr(prepare_aMD, "_get_res_atom_number", counting)
+    prepare_aMD._cached_res_atom_number.cache_clear()
+    pairs = prepare_aMD.write_amdinputfiles(
+        str(amber),
+        ["rep*/pr/002"],
+        "{parent}/../amd/{name}",
+        "md.out",
+        "amd.in",
+        "run.sh",
+        "run.sh",
+        None,
+        "leap.pdb",
+        "md.rst7",
+        0,
+        workers=2,
+    )
+    assert pairs == [
+        ("rep01/pr/002", "rep01/amd/002"),
+        ("rep02/pr/002", "rep02/amd/002"),
+    ]
+    # トポロジーは1回だけ読む
+    assert len(calls) == 1
+
+    # 3 atoms, 2 residues without water
+    amdin = (amber / "rep02" / "amd" / "002" / "amd.in").read_text()
+    assert "ethreshp=-199.4," in amdin
+    assert "ethreshd=464.79," in amdin
+    # HMRのproductionに続くaMDは4 fsで同じ20 ns
+    assert "dt=0.004," in amdin
+    assert "nstlim=5000000," in amdin
+    assert "dt=0.002," in (amber / "rep01" / "amd" / "002" / "amd.in").read_text()
+    runsh = (amber / "rep01" / "amd" / "002" / "run.sh").read_text()
+    assert runsh == 'rstfile="../../pr/002/md.rst7"\n-i amd.in\n'
+
+
+def test_get_res_atom_number_prmtop(tmp_path):
+    (tmp_path / "leap.parm7").write_text(PRMTOP)
+    (tmp_path / "leap.pdb").write_text(PDB)
+    # ALA 1残基とWAT(3原子)
+    assert prepare_aMD._get_res_atom_number(str(tmp_path / "leap.parm7")) == (1, 7)
+    assert prepare_aMD._get_res_atom_number(str(tmp_path / "leap.pdb")) == (2, 3)
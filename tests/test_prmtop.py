@@ -0,0 +1,42 @@
+import numpy as np
+from helpers import PRMTOP
+
+from preparemd.amber.top import prmtop
+
+
+def test_prmtop(tmp_path):
+    path = tmp_path / "leap.parm7"
+    path.write_text(PRMTOP)
+    parm = prmtop.Prmtop(str(path))
+    assert parm.flags[0] == "POINTERS"
+    assert "CHARGE" not in parm
+    assert parm.natom == 7
+    assert parm.nres == 2
+    # ATOM_NAMEの行末の空白が削られていても読める
+    assert parm.atom_names.tolist() == ["N", "H", "CA", "HA", "O", "H1", "H2"]
+    np.testing.assert_array_equal(parm.residue_index, [0, 0, 0, 0, 1, 1, 1])
+    np.testing.assert_allclose(parm.box_dimensions, [90.0, 30.0, 30.0, 30.0])
+    assert parm.solute_residues() == 1
+    assert parm["BONDS_INC_HYDROGEN"].dtype == np.int64
+    # 2回目はキャッシュしたものを返す
+    assert parm["MASS"] is parm.masses
+
+
+def test_repartition_hydrogen_mass(tmp_path):
+    path = str(tmp_path / "leap.parm7")
+    with open(path, "w") as f:
+        f.write(PRMTOP)
+    before = prmtop.read_prmtop(path, ["MASS"])["MASS"]
+    assert prmtop.repartition_hydrogen_mass(path) == 2
+    sections = prmtop.read_prmtop(path)
+    masses = sections["MASS"]
+    np.testing.assert_allclose(
+        masses, [11.994, 3.024, 9.994, 3.024, 16.0, 1.008, 1.008]
+    )
+    assert np.isclose(masses.sum(), before.sum())
+    # ほかのセクションは変わらない
+    assert sections["ATOM_NAME"][-1] == "H2"
+    np.testing.assert_allclose(sections["BOX_DIMENSIONS"][0], 90.0)
+    assert "  1.19940000E+01  3.02400000E+00" in (tmp_path / "leap.parm7").read_text()
+    # 2回目は何もしない
+    assert prmtop.repartition_hydrogen_mass(path) == 0
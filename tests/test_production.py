@@ -0,0 +1,221 @@
+import shutil
+import subprocess
+
+from helpers import PRMTOP
+
+from preparemd.amber.md.prepareinputs import prepareamberfiles
+from preparemd.amber.md.production import (
+    productioninput,
+    replica_names,
+    segmentfunctions,
+)
+from preparemd.amber.md.writetrajfix import writetrajfix
+
+
+def test_replica_names():
+    assert replica_names(3) == ["rep01", "rep02", "rep03"]
+    assert replica_names(100)[0] == "rep001"
+
+
+def test_prepareamberfiles_replicas(tmp_path):
+    distdir = str(tmp_path)
+    prepareamberfiles(distdir, 100, 2, 50, "foodin", replicas=3, replica_seed=11)
+    amber = tmp_path / "amber"
+    assert not (amber / "pr").exists()
+    assert (amber / "heat" / "md9.in").exists()
+
+    seeds = []
+    for i, name in enumerate(["rep01", "rep02", "rep03"]):
+        first = (amber / name / "pr" / "001" / "md.in").read_text()
+        second = (amber / name / "pr" / "002" / "md.in").read_text()
+        assert f"ig={11 + i}," in first
+        assert "tempi=300.0," in first
+        assert "irest=0," in first
+        assert "ig=-1," in second
+        assert "irest=1," in second
+        seeds.append(first)
+        runsh = (amber / name / "pr" / "001" / "run.sh").read_text()
+        assert 'topfile="../../../../top/leap.parm7"' in runsh
+        assert 'rstfile="../../../heat/md9.rst7"' in runsh
+    # 乱数シード以外は同じ
+    assert seeds[0].replace("ig=11,", "") == seeds[1].replace("ig=12,", "")
+    assert "for rep in rep01 rep02 rep03; do" in (amber / "totalrun.sh").read_text()
+
+    writetrajfix(distdir, 100, 2, replicas=3)
+    pooled = (amber / "trajfix_pooled.in").read_text()
+    # 各レプリカで処理したトラジェクトリを結合するだけで、レプリカをまたいでunwrapしない
+    assert "trajin rep03/pr/traj.trr parm rep01/pr/init.pdb" in pooled
+    assert "mdcrd" not in pooled
+    assert "unwrap" not in pooled
+    assert (
+        "reference ../../../top/leap.rst7"
+        in (amber / "rep01" / "pr" / "trajfix.in").read_text()
+    )
+
+
+def test_writetrajfix_parallel(tmp_path):
+    distdir = str(tmp_path)
+    writetrajfix(distdir, 100, 3, "S_", parallel=True)
+    prdir = tmp_path / "amber" / "pr"
+    assert not (prdir / "trajfix.in").exists()
+    segment = (prdir / "trajfix" / "002.in").read_text()
+    assert "trajin 002/mdcrd 1 last 50" in segment
+    assert "unwrap :1-100 reference" in segment
+    # unwrapの基準はそのセグメントの直前のrestart
+    assert "reference 001/md.rst7" in segment
+    first = (prdir / "trajfix" / "001.in").read_text()
+    assert "reference ../heat/md9.rst7" in first
+    assert "reference ../heat/md9.rst7" in (prdir / "trajfix" / "init.in").read_text()
+    assert "trajout trajfix/002.nc netcdf" in segment
+    merge = (prdir / "trajfix" / "merge.in").read_text().splitlines()
+    # 結合の順番はセグメントの順番
+    trajins = [line.split()[1] for line in merge if line.startswith("trajin")]
+    assert trajins == ["trajfix/001.nc", "trajfix/002.nc", "trajfix/003.nc"]
+    assert "reference S_init.pdb parm S_init.pdb" in merge
+    assert "S_init.pdb pdb nobox" in (prdir / "trajfix" / "init.in").read_text()
+    runner = (prdir / "trajfix.sh").read_text()
+    assert 'segments="001 002 003"' in runner
+    assert "parm=${parm:-../../top/leap.parm7}" in runner
+
+    writetrajfix(distdir, 100, 2, parallel=True, replicas=2)
+    pooled = (tmp_path / "amber" / "trajfix_pooled.in").read_text()
+    assert "trajin rep02/pr/trajfix/002.nc parm rep01/pr/init.pdb" in pooled
+    first = (tmp_path / "amber" / "rep01" / "pr" / "trajfix" / "001.in").read_text()
+    assert "reference ../../heat/md9.rst7" in first
+    runner = (tmp_path / "amber" / "rep01" / "pr" / "trajfix.sh").read_text()
+    assert "parm=${parm:-../../../top/leap.parm7}" in runner
+
+
+def test_productioninput_hmr():
+    md = productioninput(True, 50, hmr=True)
+    assert "dt=0.004," in md
+    # 50 nsは4 fsで12500000ステップ
+    assert "nstlim=12500000," in md
+    assert "ntpr=2500," in md
+    assert "ntwr=250000," in md
+    assert "&wt type='DUMPFREQ', istep1=2500, /" in md
+
+
+def test_run_segment_skips_finished(tmp_path):
+    prepareamberfiles(str(tmp_path), 100, 2, 1, "foodin", resume_partial=True)
+    amber = tmp_path / "amber"
+    runsh = (amber / "pr" / "002" / "run.sh").read_text()
+    assert "run_segment ${rstfile}" in runsh
+    assert "if true && prepare_resume" in runsh
+    assert "run_segment ${rstfile} || exit $?" in (amber / "totalrun.sh").read_text()
+
+    # 001/md.rst7(100 ps)から002で500000ステップ(1 ns)進めた状態
+    segment = amber / "pr" / "002"
+    (amber / "pr" / "001" / "md.rst7").write_text("title\n  10  100.0\n")
+    (segment / "md.out").write_text(" NSTEP =   500000\n|  Total wall time: 1\n")
+
+    def done(time: str) -> int:
+        (segment / "md.rst7").write_text(f"title\n  10  {time}\n")
+        script = segmentfunctions() + "segment_done ../001/md.rst7\n"
+        return subprocess.run(["bash", "-c", script], cwd=segment).returncode
+
+    assert done("1100.0") == 0
+    # 途中のrestartまでしか進んでいない
+    assert done("1000.0") != 0
+
+
+def test_writetrajfix_resnumber_from_prmtop(tmp_path):
+    (tmp_path / "top").mkdir()
+    (tmp_path / "top" / "leap.parm7").write_text(PRMTOP)
+    writetrajfix(str(tmp_path), 0, 2)
+    content = (tmp_path / "amber" / "pr" / "trajfix.in").read_text()
+    assert "unwrap :1-1" in content
+
+
+BASH = shutil.which("bash")
+
+
+def _fake_bin(bindir, scripts: dict[str, str]):
+    # PATHをこのディレクトリだけにして、ncdumpやcpptrajの有無を固定する
+    bindir.mkdir()
+    for name in ("awk", "cat", "cp", "grep", "head", "mktemp", "mv", "rm", "sed", "tr"):
+        (bindir / name).symlink_to(shutil.which(name))
+    for name, content in scripts.items():
+        (bindir / name).write_text(f"#!{BASH}\n" + content)
+        (bindir / name).chmod(0o755)
+    return {"PATH": str(bindir)}
+
+
+def test_rst7_time_netcdf(tmp_path):
+    (tmp_path / "md.rst7").write_bytes(b"CDF\x01" + bytes(16))
+    script = segmentfunctions() + "topfile=top.parm7\nrst7_time md.rst7\n"
+
+    # ncdumpがなければcpptrajでASCIIのrst7に変換して読む
+    cpptraj = (
+        "while [ $# -gt 0 ]; do\n"
+        '    [ "$1" = -x ] && printf "t\\n 10 1234.5\\n" > "$2"\n'
+        "    shift\n"
+        "done\n"
+    )
+    env = _fake_bin(tmp_path / "bin", {"cpptraj": cpptraj})
+    result = subprocess.run(
+        [BASH, "-c", script], cwd=tmp_path, env=env, capture_output=True, text=True
+    )
+    assert result.stdout.strip() == "1234.5"
+
+    (tmp_path / "bin" / "cpptraj").unlink()
+    result = subprocess.run(
+        [BASH, "-c", script], cwd=tmp_path, env=env, capture_output=True, text=True
+    )
+    assert result.returncode != 0
+    assert result.stdout == ""
+    assert "could not be read" in result.stderr
+
+
+def test_prepare_resume(tmp_path):
+    prepareamberfiles(str(tmp_path), 100, 2, 1, "foodin", resume_partial=True)
+    segment = tmp_path / "amber" / "pr" / "002"
+    (tmp_path / "amber" / "pr" / "001" / "md.rst7").write_text("title\n  10  100.0\n")
+    cpptraj = 'cp "$2" cpptraj.in\necho joined > mdcrd.joined\n'
+    env = _fake_bin(tmp_path / "bin", {"cpptraj": cpptraj})
+
+    def stop(time: str, command: str) -> subprocess.CompletedProcess:
+        # ntwx=5000ステップごとにフレームが書かれたmdcrdを残して止まった状態
+        (segment / "md.rst7").write_text(f"title\n  10  {time}\n")
+        (segment / "md.out").write_text(" NSTEP =   5000\n")
+        (segment / "mdcrd").write_text(time)
+        script = segmentfunctions(True) + f"topfile=top.parm7\n{command}\n"
+        return subprocess.run(
+            [BASH, "-c", script], cwd=segment, env=env, capture_output=True, text=True
+        )
+
+    # 100 psから始めて600 ps(250000ステップ)まで進んで止まった
+    result = stop("600.0", 'prepare_resume ../001/md.rst7 && echo "${resume_rst7}"')
+    assert result.stdout.split("\n")[-2] == "md.rst7.1"
+    assert (segment / "resume.steps").read_text() == "250000 md.rst7.1\n"
+    assert (segment / "resume.parts").read_text() == "mdcrd.1 50\n"
+    assert (segment / "md.out.1").is_file()
+    assert (segment / "mdcrd.1").read_text() == "600.0"
+    resume = (segment / "md.resume.in").read_text()
+    assert "nstlim=250000," in resume
+    assert "irest=1," in resume
+    assert "ntx=5," in resume
+
+    # 再開後、800 ps(350000ステップ)で再び止まった
+    result = stop("800.0", "prepare_resume ../001/md.rst7")
+    assert result.returncode == 0
+    assert (segment / "resume.steps").read_text() == "350000 md.rst7.2\n"
+    assert (segment / "resume.parts").read_text() == "mdcrd.1 50\nmdcrd.2 20\n"
+    assert "nstlim=150000," in (segment / "md.resume.in").read_text()
+    assert (segment / "md.out.2").is_file()
+
+    # 最後まで終わったらmdcrdを1つにつなげて途中のファイルを消す
+    result = stop("1100.0", "join_parts")
+    assert result.returncode == 0
+    assert (segment / "cpptraj.in").read_text().split("\n") == [
+        "parm top.parm7",
+        "trajin mdcrd.1 1 50",
+        "trajin mdcrd.2 1 20",
+        "trajin mdcrd",
+        "trajout mdcrd.joined netcdf",
+        "go",
+        "",
+    ]
+    assert (segment / "mdcrd").read_text() == "joined\n"
+    for name in ("mdcrd.1", "mdcrd.2", "md.rst7.1", "md.rst7.2", "resume.parts"):
+        assert not (segment / name).exists()
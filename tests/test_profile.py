@@ -0,0 +1,36 @@
+import json
+import sys
+
+from preparemd.utils import runner
+from preparemd.utils.profile import Profiler, aggregate_reports, stage
+
+
+def test_profiler(tmp_path):
+    profiler = Profiler()
+    with profiler.activate():
+        with stage("pdb4amber"):
+            runner.run_command([sys.executable, "-c", "print(1)"])
+            with stage("count_residues"):
+                sum(range(1000))
+    # activeなprofilerがなければ何も記録しない
+    with stage("leap"):
+        pass
+
+    outfile = profiler.write(str(tmp_path))
+    with open(outfile) as f:
+        report = json.load(f)
+    names = [s["name"] for s in report["stages"]]
+    assert names == ["pdb4amber/count_residues", "pdb4amber"]
+    commands = report["stages"][1]["commands"]
+    assert len(commands) == 1
+    assert commands[0]["returncode"] == 0
+    assert report["stages"][1]["wall"] >= commands[0]["wall"]
+    # RSSはプロセス開始からの最大値なので、後の段階ほど小さくならない
+    stages = report["stages"]
+    assert stages[1]["maxrss_so_far_kb"] >= stages[0]["maxrss_so_far_kb"]
+    assert "peak_rss_kb" not in stages[0]
+
+    summary = aggregate_reports([report, report])
+    assert summary["systems"] == 2
+    assert summary["stages"]["pdb4amber"]["count"] == 2
+    assert summary["stages"]["pdb4amber"]["maxrss_so_far_kb_max"] > 0
@@ -0,0 +1,59 @@
+import asyncio
+import collections
+import sys
+
+import pytest
+
+from preparemd.utils import runner
+
+
+def test_run_command_cwd(tmp_path):
+    result = runner.run_command(
+        [sys.executable, "-c", "import os; print(os.getcwd())"], cwd=str(tmp_path)
+    )
+    assert result.returncode == 0
+    assert result.stdout.decode().strip() == str(tmp_path)
+    assert result in runner.get_history()
+
+
+def test_run_command_failure():
+    with pytest.raises(RuntimeError):
+        runner.run_command([sys.executable, "-c", "raise SystemExit(3)"])
+    result = runner.run_command(
+        [sys.executable, "-c", "raise SystemExit(3)"], check=False
+    )
+    assert result.returncode == 3
+
+
+def test_run_command_stdin():
+    # 標準入力は端末ではなく/dev/nullになる
+    result = runner.run_command(
+        [sys.executable, "-c", "import sys; print(len(sys.stdin.read()))"],
+        timeout=10,
+    )
+    assert result.stdout.decode().strip() == "0"
+
+
+def test_run_commands_async_timeout():
+    jobs = [
+        {"cmd": [sys.executable, "-c", "print(1)"]},
+        {"cmd": [sys.executable, "-c", "import time; time.sleep(10)"], "timeout": 0.5},
+    ]
+    results = asyncio.run(runner.run_commands_async(jobs, max_concurrency=2))
+    assert results[0].returncode == 0
+    assert results[0].stdout.decode().strip() == "1"
+    assert isinstance(results[1], RuntimeError)
+    assert runner.get_history()[-1].timed_out
+
+
+def test_history_size(monkeypatch):
+    monkeypatch.setattr(runner, "_history", collections.deque(maxlen=3))
+    count = runner.history_count()
+    for i in range(5):
+        runner.run_command([sys.executable, "-c", f"print({i})"])
+    assert len(runner.get_history()) == 3
+    assert runner.history_count() == count + 5
+    since = runner.get_history_since(count + 3)
+    assert [r.stdout.decode().strip() for r in since] == ["3", "4"]
+    # 捨てられた記録は返さない
+    assert len(runner.get_history_since(count)) == 3
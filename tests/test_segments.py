@@ -0,0 +1,113 @@
+import pytest
+
+from preparemd.amber.md import segments
+from preparemd.amber.md.prepareinputs import prepareamberfiles
+from preparemd.resegment import run_resegment
+
+MDOUT = """\
+|  Final Performance Info:
+|     -----------------------------------------------------
+|     Average timings for last    5000 steps:
+|     Elapsed(s) =      10.00 Per Step(ms) =       2.00
+|         ns/day =      90.00   seconds/ns =     960.00
+|
+|     Average timings for all steps:
+|     Elapsed(s) =     100.00 Per Step(ms) =       2.00
+|         ns/day =      {value}   seconds/ns =    1000.00
+"""
+
+PDB = """\
+ATOM      1  CA  ALA A   1       0.000   0.000   0.000  1.00  0.00           C
+ATOM      2  CA  ALA A   2       3.800   0.000   0.000  1.00  0.00           C
+END
+"""
+
+
+def write_heat(heatdir, values):
+    heatdir.mkdir(parents=True, exist_ok=True)
+    for i, value in values.items():
+        (heatdir / f"md{i}.out").write_text(MDOUT.format(value=value))
+
+
+def test_read_ns_per_day(tmp_path):
+    path = tmp_path / "md2.out"
+    path.write_text(MDOUT.format(value="86.40"))
+    assert segments.read_ns_per_day(str(path)) == 86.4
+    # 実行中のmdinfoは最後の値を使う
+    path.write_text(MDOUT.split("|\n")[0])
+    assert segments.read_ns_per_day(str(path)) == 90.0
+
+
+def test_measure_ns_per_day(tmp_path):
+    # md1(NVT)は使わない
+    write_heat(tmp_path, {1: "10.0", 2: "80.0", 3: "100.0", 4: "90.0"})
+    assert segments.measure_ns_per_day(str(tmp_path)) == 90.0
+    with pytest.raises(FileNotFoundError):
+        segments.measure_ns_per_day(str(tmp_path / "none"))
+
+
+def test_plan_segments():
+    assert segments.walltime_seconds("24:00:00") == 86400
+    assert segments.walltime_seconds("1-01:00:00") == 90000
+    with pytest.raises(ValueError):
+        segments.walltime_seconds("24h")
+
+    # 100 ns/day, 24 h * 0.5 -> 50 ns/segment at most
+    plan = segments.plan_segments(150, 100.0, "24:00:00", fraction=0.5)
+    assert plan["segments"] == 3
+    assert plan["nstlim"] == 25000000
+    # 120 nsを最大50 nsで分けると3セグメント、均等に40 nsずつ
+    plan = segments.plan_segments(120, 100.0, "24:00:00", fraction=0.5)
+    assert plan["segments"] == 3
+    assert plan["nstlim"] == 20000000
+    assert plan["hours"] == pytest.approx(9.6)
+    plan = segments.plan_segments(1, 7.0, "24:00:00", fraction=0.5, step_unit=5000)
+    assert plan["nstlim"] % 5000 == 0
+    assert plan["total_ns"] >= 1
+    with pytest.raises(ValueError):
+        segments.plan_segments(100, 0.001, "00:01:00")
+
+
+def test_run_resegment(tmp_path):
+    distdir = str(tmp_path)
+    (tmp_path / "top").mkdir()
+    (tmp_path / "top" / "pre.pdb").write_text(PDB)
+    prepareamberfiles(distdir, 2, 3, 50, "foodin")
+    amber = tmp_path / "amber"
+    write_heat(amber / "heat", {i: "100.0" for i in range(2, 10)})
+
+    plan = run_resegment(distdir, walltime="24:00:00", fraction=0.5)
+    # 合計150 nsを50 nsずつ、3セグメントのまま
+    assert plan["segments"] == 3
+    assert "nstlim=25000000," in (amber / "pr" / "003" / "md.in").read_text()
+
+    plan = run_resegment(distdir, walltime="12:00:00", fraction=0.5)
+    assert plan["segments"] == 6
+    assert "nstlim=12500000," in (amber / "pr" / "006" / "md.in").read_text()
+    assert "#SBATCH -t 12:00:00" in (amber / "pr" / "006" / "run.sh").read_text()
+    assert "006/mdcrd" in (amber / "pr" / "trajfix.in").read_text()
+    assert segments.current_total_ns(str(amber / "pr")) == 150
+
+    (amber / "pr" / "001" / "md.out").write_text("")
+    with pytest.raises(RuntimeError):
+        run_resegment(distdir, walltime="24:00:00")
+
+
+def test_resegment_after_shrink(tmp_path):
+    distdir = str(tmp_path)
+    (tmp_path / "top").mkdir()
+    (tmp_path / "top" / "pre.pdb").write_text(PDB)
+    prepareamberfiles(distdir, 2, 6, 25, "foodin")
+    amber = tmp_path / "amber"
+    write_heat(amber / "heat", {i: "100.0" for i in range(2, 10)})
+    assert segments.generated_segments(str(amber)) == 6
+
+    plan = run_resegment(distdir, walltime="24:00:00", fraction=0.5)
+    assert plan["segments"] == 3
+    # 使われなくなったpr/004-006が残っていても、合計はtotalrun.shの3セグメント分
+    assert (amber / "pr" / "006" / "md.in").is_file()
+    assert segments.generated_segments(str(amber)) == 3
+    assert segments.current_total_ns(str(amber / "pr"), 3) == 150
+    plan = run_resegment(distdir, walltime="24:00:00", fraction=0.5)
+    assert plan["segments"] == 3
+    assert plan["total_ns"] == 150
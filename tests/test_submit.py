@@ -0,0 +1,40 @@
+import subprocess
+
+import pytest
+
+from preparemd.amber.md.submit import arrayscript, check_submit, submitscript
+from preparemd.utils.header import queue_header
+
+
+def test_queue_header_walltime():
+    assert queue_header("flow", walltime="06:00:00").count("elapse=06:00:00") == 1
+    assert "#SBATCH -t 06:00:00\n" in queue_header("foodin", walltime="06:00:00")
+    assert "#SBATCH -t" not in queue_header("foodin")
+
+
+def test_submitscript_chain():
+    content = submitscript("foodin", 3, replicas=2)
+    assert "sbatch --parsable ${3:+-d afterok:$3}" in content
+    assert "for prdir in rep01/pr rep02/pr; do\n    jid=${heatjid}\n" in content
+    assert "for j in 001 002 003; do" in content
+    subprocess.run(["bash", "-n"], input=content.encode(), check=True)
+
+    content = submitscript("flow", 2)
+    assert "pjsub -z jid --step" in content
+    assert "for prdir in pr; do\n    for j in 001 002; do" in content
+    subprocess.run(["bash", "-n"], input=content.encode(), check=True)
+
+
+def test_submitscript_array():
+    content = submitscript("foodin", 2, replicas=4, mode="array")
+    assert "--array=1-4" in content
+    assert 'dependency="aftercorr"' in content
+    subprocess.run(["bash", "-n"], input=content.encode(), check=True)
+    assert 'rep=$(printf "rep%02d" "${SLURM_ARRAY_TASK_ID}")' in arrayscript(
+        "foodin", 4
+    )
+
+    with pytest.raises(ValueError):
+        check_submit("flow", 4, "array")
+    with pytest.raises(ValueError):
+        check_submit("foodin", 0, "array")
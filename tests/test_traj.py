@@ -0,0 +1,180 @@
+import numpy as np
+import pytest
+
+from preparemd.amber.top import geometry, prmtop
+from preparemd.amber.traj import archive, netcdf, process
+
+# ALA(CA, CB) x 3, WAT(O)
+PRMTOP = """\
+%VERSION  VERSION_STAMP = V0001.000
+%FLAG TITLE
+%FORMAT(20a4)
+test
+%FLAG POINTERS
+%FORMAT(10I8)
+       7       0       0       0       0       0       0       0       0       0
+       0       4       0       0       0       0       0       0       0       0
+%FLAG ATOM_NAME
+%FORMAT(20a4)
+CA  CB  CA  CB  CA  CB  O
+%FLAG MASS
+%FORMAT(5E16.8)
+  1.20100000E+01  1.20100000E+01  1.20100000E+01  1.20100000E+01  1.20100000E+01
+  1.20100000E+01  1.60000000E+01
+%FLAG RESIDUE_LABEL
+%FORMAT(20a4)
+ALA ALA ALA WAT
+%FLAG RESIDUE_POINTER
+%FORMAT(10I8)
+       1       3       5       7
+"""
+SOLUTE = np.array(
+    [[0, 0, 0], [1.5, 0, 0], [3.8, 0, 0], [3.8, 1.5, 0], [5.0, 3.0, 0], [5.0, 3.0, 1.5]]
+)
+OCTAHEDRON = [109.4712206, 109.4712206, 109.4712206]
+
+
+def test_read_topology(tmp_path):
+    (tmp_path / "leap.parm7").write_text(PRMTOP)
+    topology = prmtop.read_topology(str(tmp_path / "leap.parm7"))
+    assert topology.atom_names == ["CA", "CB", "CA", "CB", "CA", "CB", "O"]
+    np.testing.assert_array_equal(topology.residue_index, [0, 0, 1, 1, 2, 2, 3])
+    np.testing.assert_array_equal(topology.atoms_of_residues(["WAT"]), [6])
+    with pytest.raises(ValueError):
+        prmtop.read_prmtop(str(tmp_path / "leap.parm7"), ["CHARGE"])
+
+
+def test_netcdf_roundtrip(tmp_path):
+    coords = np.arange(2 * 5 * 3, dtype=np.float64).reshape(2, 5, 3)
+    lengths = np.full((2, 3), 30.0)
+    angles = np.full((2, 3), 90.0)
+    with netcdf.NetCDFWriter(str(tmp_path / "mdcrd"), 5) as writer:
+        writer.write(coords, np.array([1.0, 2.0]), lengths, angles)
+    reader = netcdf.NetCDFReader(str(tmp_path / "mdcrd"))
+    assert reader.nframes == 2
+    assert reader.natoms == 5
+    data = reader.read([1], atoms=[0, 4])
+    np.testing.assert_allclose(data["coordinates"], coords[[1]][:, [0, 4]])
+    np.testing.assert_allclose(data["time"], [2.0])
+    np.testing.assert_allclose(data["cell_lengths"], lengths[[1]])
+
+
+def rotation(axis, degrees):
+    axis = np.asarray(axis) / np.linalg.norm(axis)
+    k = np.array(
+        [[0, -axis[2], axis[1]], [axis[2], 0, -axis[0]], [-axis[1], axis[0], 0]]
+    )
+    theta = np.radians(degrees)
+    return np.eye(3) + np.sin(theta) * k + (1 - np.cos(theta)) * k @ k
+
+
+def wrap(coords, box):
+    frac = coords @ np.linalg.inv(box)
+    return (frac - np.floor(frac)) @ box
+
+
+def test_fix_trajectories(tmp_path):
+    (tmp_path / "leap.parm7").write_text(PRMTOP)
+    lengths = np.full((1, 3), 20.0)
+    angles = np.array([OCTAHEDRON])
+    box = geometry.box_vectors(lengths, angles)[0]
+    # 剛体として移動・回転し、周期境界を何度も跨ぐ溶質
+    frames = []
+    for i in range(12):
+        moved = SOLUTE @ rotation([1, 2, 3], 10 * i) + [5.0 + 3.0 * i, 5.0, 5.0]
+        water = [[-2.0 * i, 1.0, 1.0]]
+        frames.append(wrap(np.vstack([moved, water]), box))
+    frames = np.array(frames)
+    for i, chunk in enumerate([frames[:7], frames[7:]], start=1):
+        with netcdf.NetCDFWriter(str(tmp_path / f"{i:03d}.nc"), 7) as writer:
+            writer.write(
+                chunk,
+                None,
+                np.repeat(lengths, len(chunk), 0),
+                np.repeat(angles, len(chunk), 0),
+            )
+
+    output = tmp_path / "traj.nc"
+    nframes = process.fix_trajectories(
+        str(tmp_path / "leap.parm7"),
+        [str(tmp_path / "001.nc"), str(tmp_path / "002.nc")],
+        str(output),
+        step=1,
+        init_pdb=str(tmp_path / "init.pdb"),
+        rmsd_file=str(tmp_path / "rmsd.dat"),
+        # 1フレームずつ処理してチャンク間の状態の引き継ぎを確かめる
+        chunk_bytes=1,
+    )
+    assert nframes == 12
+    fixed = netcdf.NetCDFReader(str(output)).read(np.arange(12))["coordinates"]
+    # 水は除かれ、CAの重心が原点に来る
+    assert fixed.shape == (12, 6, 3)
+    np.testing.assert_allclose(fixed[0, [0, 2, 4]].mean(axis=0), 0.0, atol=1e-4)
+    # すべてのフレームが最初のフレームに重なる
+    np.testing.assert_allclose(fixed, np.repeat(fixed[:1], 12, 0), atol=1e-3)
+
+    rmsd = (tmp_path / "rmsd.dat").read_text().splitlines()
+    assert rmsd[0].split() == ["#Frame", "RMSD_00001"]
+    assert len(rmsd) == 13
+    assert all(float(line.split()[1]) < 1e-3 for line in rmsd[1:])
+    # アーカイブには元のセグメントとフレーム番号が残る
+    process.fix_trajectories(
+        str(tmp_path / "leap.parm7"),
+        [str(tmp_path / "001.nc"), str(tmp_path / "002.nc")],
+        str(tmp_path / "traj.arc"),
+        step=2,
+        rmsd_file="",
+    )
+    index = archive.ArchiveReader(str(tmp_path / "traj.arc")).frames
+    assert list(index["segment"]) == [1, 1, 1, 1, 2, 2, 2]
+    assert list(index["frame"]) == [0, 2, 4, 6, 0, 2, 4]
+    pdb = (tmp_path / "init.pdb").read_text().splitlines()
+    assert len(pdb) == 7
+    assert pdb[2][12:26] == " CA  ALA     2"
+
+
+def test_unwrapper_chunks():
+    box = np.diag([10.0, 10.0, 10.0])[None]
+    walked = np.array([[[1.0 + 4.0 * i, 2.0, 3.0]] for i in range(5)])
+    wrapped = np.array([wrap(frame, box[0]) for frame in walked])
+    unwrapper = process.Unwrapper()
+    result = np.concatenate(
+        [unwrapper(wrapped[:1], box), unwrapper(wrapped[1:], np.repeat(box, 4, 0))]
+    )
+    np.testing.assert_allclose(result, walked)
+
+
+def test_archive(tmp_path):
+    rng = np.random.default_rng(0)
+    coords = np.cumsum(rng.normal(scale=0.1, size=(250, 7, 3)), axis=0) + 50.0
+    path = str(tmp_path / "traj.arc")
+    with archive.ArchiveWriter(path, 7, precision=0.001, chunk_frames=40) as writer:
+        for segment, part in enumerate(np.split(coords, [90, 180]), start=1):
+            # 書き込みの単位とチャンクの境界は一致しなくてよい
+            for frames in np.array_split(np.arange(len(part)), 7):
+                writer.write(part[frames], segment=segment, frames=frames * 50)
+
+    reader = archive.ArchiveReader(path)
+    assert len(reader) == 250
+    assert len(reader.chunks) == 7
+    np.testing.assert_allclose(reader[:], coords, atol=0.0006)
+    np.testing.assert_allclose(reader[-1], coords[-1], atol=0.0006)
+    # 順番通りでなくても、チャンクをまたいでもよい
+    np.testing.assert_allclose(
+        reader.read([200, 3, 41]), coords[[200, 3, 41]], atol=6e-4
+    )
+
+    selected = reader.select(segment=2, step=10)
+    np.testing.assert_array_equal(selected, np.arange(90, 180, 10))
+    assert list(reader.frames["frame"][selected[:2]]) == [0, 500]
+    got = np.concatenate([c for _, c in reader.iter_frames(selected)])
+    np.testing.assert_allclose(got, coords[90:180:10], atol=6e-4)
+
+    # 量子化の精度を粗くすると小さくなる
+    coarse = str(tmp_path / "coarse.arc")
+    with archive.ArchiveWriter(coarse, 7, precision=0.1) as writer:
+        writer.write(coords)
+    assert (tmp_path / "coarse.arc").stat().st_size < (
+        tmp_path / "traj.arc"
+    ).stat().st_size
+    np.testing.assert_allclose(archive.ArchiveReader(coarse)[:], coords, atol=0.06)